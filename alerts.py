@@ -0,0 +1,268 @@
+"""
+Module cảnh báo: vùng trễ chống nhảy mức, nhật ký chuyển mức và chỉ mục cảnh báo
+Alert hysteresis, a persistent level-transition log and a severity-sorted alert index
+
+Processor chỉ so mực nước hiện tại với ngưỡng, nên khi triều dao động quanh ngưỡng mức
+cảnh báo có thể nhảy lên xuống ở mỗi lần quan trắc. Ở bước công bố, AlertTracker giữ mức
+hiệu lực của từng trạm (bảng alert_state):
+
+- Lên mức: ngay lập tức
+- Xuống mức: chỉ khi mực nước xuống dưới ngưỡng của mức đang giữ ít nhất clear_margin_m và
+  mức đó đã giữ tối thiểu min_hold_minutes (theo thời điểm quan trắc, không theo giờ chạy)
+
+Mỗi lần mức hiệu lực đổi được ghi một dòng vào alert_transitions; seq tăng dần và không
+dùng lại, là con trỏ cho /api/alerts/history?since=<seq>. Chỉ mục cảnh báo (trạm
+WARNING/CRITICAL, nặng trước) được scheduler ghi vào snapshot để /api/alerts không phải
+duyệt mọi trạm.
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+
+import config
+
+SEVERITY = {"NORMAL": 0, "WARNING": 1, "CRITICAL": 2}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alert_state (
+    station_id TEXT PRIMARY KEY,
+    level TEXT NOT NULL,
+    since INTEGER NOT NULL,
+    observed_at INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS alert_transitions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    station_id TEXT NOT NULL,
+    from_level TEXT NOT NULL,
+    to_level TEXT NOT NULL,
+    water_level REAL NOT NULL,
+    observed_at INTEGER NOT NULL,
+    recorded_at INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_alert_transitions_station ON alert_transitions (station_id, seq);
+CREATE INDEX IF NOT EXISTS idx_alert_transitions_recorded ON alert_transitions (recorded_at);
+"""
+
+TRANSITION_COLUMNS = "seq, station_id, from_level, to_level, water_level, observed_at, recorded_at"
+
+
+def threshold_for(alert: Dict, level: str) -> float:
+    """Ngưỡng để vào một mức (CRITICAL: ngưỡng lũ, WARNING: ngưỡng cảnh báo)"""
+    return alert['threshold_flood'] if level == "CRITICAL" else alert['threshold_warning']
+
+
+def held_level(water_level: float, alert: Dict, margin: float) -> str:
+    """Mức cao nhất còn được giữ khi các ngưỡng hạ xuống `margin` mét"""
+    if water_level >= alert['threshold_flood'] - margin:
+        return "CRITICAL"
+    if water_level >= alert['threshold_warning'] - margin:
+        return "WARNING"
+    return "NORMAL"
+
+
+def build_index(stations: Dict[str, Dict]) -> List[Dict]:
+    """
+    Chỉ mục cảnh báo từ các trạm đã công bố: chỉ trạm WARNING/CRITICAL, sắp CRITICAL trước,
+    cùng mức thì trạm vượt ngưỡng nhiều hơn đứng trước
+    """
+    ranked = []
+    for station_id, station in stations.items():
+        alert = station.get('alert', {})
+        level = alert.get('level')
+        if SEVERITY.get(level, 0) == 0:
+            continue
+        water_level = station['current']['water_level']
+        exceedance = water_level - threshold_for(alert, level) if 'threshold_warning' in alert else 0.0
+        ranked.append(((-SEVERITY[level], -exceedance, station_id), {
+            "station_id": station_id,
+            "station_name": station['station_name'],
+            "alert_level": level,
+            "message": alert['message'],
+            "current_water_level": water_level,
+            "timestamp": station['current']['timestamp'],
+            "since": alert.get('since')
+        }))
+    ranked.sort(key=lambda item: item[0])
+    return [entry for _, entry in ranked]
+
+
+class AlertTracker:
+    """
+    Trạng thái cảnh báo hiệu lực theo trạm và nhật ký chuyển mức trong SQLite (WAL) dùng
+    chung giữa scheduler (ghi) và các replica API (đọc)
+    """
+    
+    def __init__(self, db_path: Optional[str] = None, clear_margin: Optional[float] = None,
+                 min_hold_minutes: Optional[float] = None):
+        alerts_config = config.ALERTS
+        self.db_path = db_path or alerts_config['db_file']
+        self.clear_margin = alerts_config['clear_margin_m'] if clear_margin is None else clear_margin
+        hold_minutes = alerts_config['min_hold_minutes'] if min_hold_minutes is None else min_hold_minutes
+        self.min_hold_ms = int(hold_minutes * 60 * 1000)
+        self.retention_days = alerts_config['retention_days']
+        self.timezone = pytz.timezone(config.TIMEZONE)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+    
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+    
+    def _iso(self, timestamp_ms: int) -> str:
+        return datetime.fromtimestamp(timestamp_ms / 1000, self.timezone).isoformat()
+    
+    def next_level(self, level: str, raw_level: str, water_level: float, alert: Dict, held_ms: int) -> str:
+        """Mức hiệu lực kế tiếp từ mức đang giữ `level` và mức thô của processor"""
+        if SEVERITY[raw_level] >= SEVERITY[level]:
+            return raw_level
+        if held_ms < self.min_hold_ms:
+            return level
+        held = held_level(water_level, alert, self.clear_margin)
+        return held if SEVERITY[held] < SEVERITY[level] else level
+    
+    def apply(self, processed_data: Dict[str, Dict]) -> Tuple[Dict[str, Dict], List[Dict]]:
+        """
+        Áp dụng vùng trễ cho kết quả vừa xử lý và ghi các lần chuyển mức (một transaction)
+        
+        Returns:
+            (kết quả với alert theo mức hiệu lực, danh sách chuyển mức vừa ghi). Kết quả là
+            bản sao: dict của processor (có thể nằm trong ResultCache) không bị sửa.
+        """
+        published: Dict[str, Dict] = {}
+        transitions: List[Dict] = []
+        if not processed_data:
+            return published, transitions
+        conn = self._connection()
+        
+        with self._write_lock:
+            recorded_at = int(time.time() * 1000)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                placeholders = ",".join("?" * len(processed_data))
+                states = {
+                    row[0]: row[1:]
+                    for row in conn.execute(
+                        f"SELECT station_id, level, since, observed_at FROM alert_state "
+                        f"WHERE station_id IN ({placeholders})",
+                        list(processed_data)
+                    )
+                }
+                
+                for station_id, result in processed_data.items():
+                    alert = result.get('alert') or {}
+                    raw_level = alert.get('level')
+                    if raw_level not in SEVERITY:
+                        published[station_id] = result
+                        continue
+                    
+                    water_level = result['current']['water_level']
+                    observed_at = int(datetime.fromisoformat(result['current']['timestamp']).timestamp() * 1000)
+                    level, since, last_observed = states.get(station_id, ("NORMAL", observed_at, None))
+                    
+                    # Điểm cũ hơn điểm đã xét (công bố lại dữ liệu cũ): giữ nguyên mức
+                    if last_observed is not None and observed_at < last_observed:
+                        new_level, observed_at = level, last_observed
+                    else:
+                        new_level = self.next_level(level, raw_level, water_level, alert, observed_at - since)
+                    
+                    if new_level != level:
+                        cursor = conn.execute(
+                            "INSERT INTO alert_transitions (station_id, from_level, to_level, water_level, "
+                            "observed_at, recorded_at) VALUES (?, ?, ?, ?, ?, ?)",
+                            (station_id, level, new_level, water_level, observed_at, recorded_at)
+                        )
+                        transitions.append(self._transition((
+                            cursor.lastrowid, station_id, level, new_level, water_level,
+                            observed_at, recorded_at
+                        )))
+                        since = observed_at
+                    
+                    conn.execute(
+                        "INSERT INTO alert_state (station_id, level, since, observed_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (station_id) DO UPDATE SET level = excluded.level, "
+                        "since = excluded.since, observed_at = excluded.observed_at",
+                        (station_id, new_level, since, observed_at)
+                    )
+                    published[station_id] = self._published(result, new_level, since)
+                
+                if transitions:
+                    cutoff = recorded_at - self.retention_days * 86400 * 1000
+                    conn.execute("DELETE FROM alert_transitions WHERE recorded_at < ?", (cutoff,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        
+        return published, transitions
+    
+    def _published(self, result: Dict, level: str, since: int) -> Dict:
+        alert = {**result['alert'], "since": self._iso(since)}
+        if level != alert['level']:
+            threshold = threshold_for(alert, level)
+            icon = "🚨" if level == "CRITICAL" else "⚠️"
+            alert.update({
+                "raw_level": alert['level'],
+                "level": level,
+                "message": (
+                    f"{icon} Giữ mức {level} tại {result['station_name']}: mực nước "
+                    f"{result['current']['water_level']}m đã dưới ngưỡng {threshold}m nhưng chưa "
+                    f"xuống dưới {threshold - self.clear_margin:.2f}m hoặc chưa đủ thời gian giữ mức. "
+                    f"Cần tiếp tục theo dõi."
+                )
+            })
+        return {**result, "alert": alert}
+    
+    def _transition(self, row: tuple) -> Dict:
+        seq, station_id, from_level, to_level, water_level, observed_at, recorded_at = row
+        return {
+            "seq": seq,
+            "station_id": station_id,
+            "station_name": config.STATIONS.get(station_id, {}).get('name', station_id),
+            "from_level": from_level,
+            "to_level": to_level,
+            "water_level": water_level,
+            "observed_at": self._iso(observed_at),
+            "recorded_at": self._iso(recorded_at)
+        }
+    
+    def history(self, since: int = 0, limit: int = 100, station_id: Optional[str] = None) -> List[Dict]:
+        """Các lần chuyển mức có seq > since, tăng dần theo seq (tối đa `limit`)"""
+        if station_id is None:
+            rows = self._connection().execute(
+                f"SELECT {TRANSITION_COLUMNS} FROM alert_transitions WHERE seq > ? ORDER BY seq LIMIT ?",
+                (since, limit)
+            ).fetchall()
+        else:
+            rows = self._connection().execute(
+                f"SELECT {TRANSITION_COLUMNS} FROM alert_transitions "
+                f"WHERE station_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (station_id, since, limit)
+            ).fetchall()
+        return [self._transition(row) for row in rows]
+    
+    def last_seq(self) -> int:
+        """seq của lần chuyển mức mới nhất (0 nếu chưa có)"""
+        row = self._connection().execute("SELECT MAX(seq) FROM alert_transitions").fetchone()
+        return row[0] or 0
+    
+    def states(self) -> Dict[str, Dict]:
+        """Mức hiệu lực hiện tại của các trạm đã xét: {station_id: {level, since}}"""
+        rows = self._connection().execute("SELECT station_id, level, since FROM alert_state").fetchall()
+        return {station_id: {"level": level, "since": self._iso(since)} for station_id, level, since in rows}
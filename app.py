@@ -4,29 +4,37 @@ Flask REST API for Mekong River Water Level Monitoring
 """
 
 import os
+import io
+import cProfile
+import csv
 import json
+import time
+import zlib
 import logging
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
 import pytz
 
 from scheduler import DataUpdateScheduler
 from mrc_scraper import MRCWaterLevelScraper
 from data_processor import WaterLevelProcessor
+from history_store import HistoricalStore
+from tide_model import TideModelStore
+from latest_snapshot import LatestSnapshot
+from alerts import AlertTracker, build_index as build_alert_index
+from webhooks import WebhookStore, token_matches as webhook_token_matches, validate_subscription
+from log_setup import setup_logging
+import metrics
+import profiling
+import response_formats
 import config
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f"{config.LOGS_DIR}/api.log"),
-        logging.StreamHandler()
-    ]
-)
+# Setup logging (ghi qua hàng đợi, file logs/api.log xoay vòng theo dung lượng)
+setup_logging("api.log")
 logger = logging.getLogger(__name__)
 
 # Khởi tạo Flask app
@@ -36,10 +44,167 @@ CORS(app)  # Enable CORS cho Flutter app
 # Khởi tạo scheduler
 scheduler = DataUpdateScheduler()
 
+# Store lịch sử (SQLite WAL, mỗi worker thread đọc bằng connection riêng)
+history_store = HistoricalStore()
+
+# Nhật ký chuyển mức cảnh báo (scheduler ghi, API đọc)
+alert_tracker = AlertTracker()
+
+# Đăng ký webhook nhận chuyển mức (dispatcher của scheduler đọc cùng DB để gửi)
+webhook_store = WebhookStore()
+
+# Mô hình triều dùng cho API (nạp lại khi scheduler ghi file mới)
+tide_models = TideModelStore(config.TIDE_MODEL)
+
+# Snapshot mới nhất trong bộ nhớ (nạp lại khi file đổi), vòng thế hệ gần đây cho delta,
+# body mỗi định dạng (JSON, MessagePack, Arrow) serialize một lần cho mỗi thế hệ
+latest_snapshot = LatestSnapshot({
+    # Cùng định dạng byte với jsonify (app.json.response: gọn khi không debug, có dấu xuống dòng cuối)
+    "json": lambda data: app.json.response({"success": True, "data": data}).get_data(),
+    "msgpack": partial(response_formats.encode_stations, "msgpack"),
+    "arrow": partial(response_formats.encode_stations, "arrow")
+})
+
+
+def _station_freshness_lag():
+    """
+    Độ trễ dữ liệu của từng trạm (giây, tính tới lúc Prometheus scrape) theo snapshot
+    dùng chung, nên đúng cả trên replica follower
+    """
+    data = latest_snapshot.load()
+    stations = data.get('stations', {}) if data else {}
+    now = time.time()
+    return {
+        (station_id,): max(now - datetime.fromisoformat(station['current']['timestamp']).timestamp(), 0.0)
+        for station_id, station in stations.items()
+    }
+
+
+metrics.REGISTRY.register(metrics.CallbackGauge(
+    "mekong_station_freshness_lag_seconds",
+    "Thời gian từ điểm quan trắc mới nhất đang được phục vụ của trạm tới hiện tại",
+    ("station_id",),
+    _station_freshness_lag
+))
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    """
+    Ghi nhận độ trễ và kích thước response theo route (response stream: chỉ tính tới byte đầu)
+    """
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started, request.method, route, str(response.status_code)
+        )
+        if not response.is_streamed and response.content_length is not None:
+            metrics.HTTP_RESPONSE_SIZE.observe(response.content_length, request.method, route)
+    return response
+
+
+@app.before_request
+def _start_request_profile():
+    """
+    Profile request khi có header X-Profile (hoặc ?profile=) đúng PROFILING['token'];
+    chọn định dạng bằng ?profile_format=pstats|text|collapsed
+    """
+    if not config.PROFILING['token']:
+        return None
+    
+    supplied = request.headers.get('X-Profile') or request.args.get('profile')
+    if supplied is None:
+        return None
+    if not profiling.token_matches(supplied):
+        return jsonify({
+            "success": False,
+            "error": "Token profile không hợp lệ"
+        }), 403
+    
+    profile_format = request.args.get('profile_format', 'pstats')
+    if profile_format not in profiling.FORMATS:
+        return jsonify({
+            "success": False,
+            "error": f"profile_format phải là một trong: {', '.join(profiling.FORMATS)}"
+        }), 400
+    
+    if profile_format == 'collapsed':
+        profiler = profiling.SamplingProfiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    g.profile = (profile_format, profiler)
+    return None
+
+
+@app.after_request
+def _finish_request_profile(response):
+    """
+    Thay response bằng profile của request (status gốc trong header X-Profiled-Status)
+    """
+    active = g.pop('profile', None)
+    if active is None:
+        return response
+    
+    profile_format, profiler = active
+    if response.is_streamed:
+        # Chạy hết generator trong lúc vẫn đang profile (ví dụ /api/export)
+        response.get_data()
+    
+    if profile_format == 'collapsed':
+        body, mimetype = profiler.stop(), 'text/plain'
+    else:
+        profiler.disable()
+        if profile_format == 'text':
+            body, mimetype = profiling.stats_text(profiler), 'text/plain'
+        else:
+            body, mimetype = profiling.stats_bytes(profiler), 'application/octet-stream'
+    
+    profiled = Response(body, mimetype=mimetype)
+    profiled.headers['X-Profiled-Status'] = str(response.status_code)
+    if profile_format == 'pstats':
+        profiled.headers['Content-Disposition'] = f'attachment; filename="{request.endpoint or "request"}.prof"'
+    return profiled
+
+
+@app.teardown_request
+def _stop_request_profile(error=None):
+    # Request lỗi không qua after_request: vẫn phải tắt profiler của thread
+    active = g.pop('profile', None)
+    if active is not None:
+        profile_format, profiler = active
+        if profile_format == 'collapsed':
+            profiler.stop()
+        else:
+            profiler.disable()
+
+
 # ============================================================================
 # API ENDPOINTS
 # ============================================================================
 
+def _not_acceptable():
+    return jsonify({
+        "success": False,
+        "error": "Không hỗ trợ định dạng trong header Accept (application/json, "
+                 "application/msgpack cần msgpack, application/vnd.apache.arrow.stream cần pyarrow)"
+    }), 406
+
+
+def _negotiated_response(fmt, body):
+    """Response theo định dạng đã chọn, kèm Vary: Accept để cache phân biệt theo định dạng"""
+    response = body if isinstance(body, Response) else Response(body, mimetype=response_formats.mimetype(fmt))
+    response.vary.add('Accept')
+    return response
+
+
 @app.route('/', methods=['GET'])
 def home():
     """
@@ -55,9 +220,14 @@ def home():
             "/api/stations/<station_id>": "Dữ liệu chi tiết của một trạm",
             "/api/latest": "Dữ liệu mới nhất của tất cả các trạm",
             "/api/alerts": "Danh sách cảnh báo hiện tại",
+            "/api/alerts/history": "Nhật ký chuyển mức cảnh báo (?since=<seq> để đồng bộ tăng dần)",
+            "/api/webhooks": "Đăng ký webhook nhận chuyển mức cảnh báo (GET/POST/DELETE, cần X-Admin-Token)",
+            "/api/forecast/<station_id>": "Đường dự báo mực nước từ mô hình triều điều hòa",
+            "/api/export/<station_id>": "Stream lịch sử của một trạm (NDJSON/CSV, hỗ trợ gzip)",
             "/api/update": "Trigger cập nhật dữ liệu thủ công (POST)",
             "/api/status": "Trạng thái của scheduler và hệ thống",
-            "/api/health": "Health check"
+            "/api/health": "Health check",
+            "/metrics": "Metrics định dạng Prometheus"
         },
         "documentation": "https://github.com/your-repo/mekong-water-level",
         "contact": "your-email@example.com"
@@ -102,7 +272,7 @@ def get_all_stations():
         })
         
     except Exception as e:
-        logger.error(f"Lỗi khi lấy danh sách trạm: {str(e)}")
+        logger.error("Lỗi khi lấy danh sách trạm: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -113,25 +283,44 @@ def get_all_stations():
 def get_latest_data():
     """
     Lấy dữ liệu mới nhất của tất cả các trạm
+    
+    Query params:
+    - since: thế hệ client đang có (metadata.generation hoặc generation của lần trả trước);
+      trả delta (chỉ trạm đổi, điểm mới, cảnh báo đổi mức) nếu replica còn giữ thế hệ đó,
+      ngược lại trả toàn bộ với "delta": false
+    
+    Header Accept: application/msgpack hoặc application/vnd.apache.arrow.stream trả điểm dạng cột
     """
     try:
-        # Đọc từ file JSON
-        if not os.path.exists(config.LATEST_DATA_FILE):
+        fmt = response_formats.negotiate(request.accept_mimetypes)
+        if fmt is None:
+            return _not_acceptable()
+        
+        since = request.args.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return jsonify({
+                    "success": False,
+                    "error": "Tham số since phải là số nguyên (generation)"
+                }), 400
+        
+        # Body đã serialize sẵn theo thế hệ: chỉ tính lại khi scheduler ghi snapshot mới
+        body = latest_snapshot.delta_body(since, fmt) if since is not None else None
+        if body is None:
+            body = latest_snapshot.full_body(delta_requested=since is not None, fmt=fmt)
+        
+        if body is None:
             return jsonify({
                 "success": False,
                 "error": "Chưa có dữ liệu. Vui lòng đợi lần cập nhật đầu tiên."
             }), 404
         
-        with open(config.LATEST_DATA_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        return jsonify({
-            "success": True,
-            "data": data
-        })
+        return _negotiated_response(fmt, body)
         
     except Exception as e:
-        logger.error(f"Lỗi khi lấy dữ liệu mới nhất: {str(e)}")
+        logger.error("Lỗi khi lấy dữ liệu mới nhất: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -142,24 +331,28 @@ def get_latest_data():
 def get_station_data(station_id):
     """
     Lấy dữ liệu chi tiết của một trạm cụ thể
+    
+    Header Accept: application/msgpack hoặc application/vnd.apache.arrow.stream trả data_points dạng cột
     """
     try:
+        fmt = response_formats.negotiate(request.accept_mimetypes)
+        if fmt is None:
+            return _not_acceptable()
+        
         if station_id not in config.STATIONS:
             return jsonify({
                 "success": False,
                 "error": f"Không tìm thấy trạm với ID: {station_id}"
             }), 404
         
-        # Đọc từ file JSON
-        if not os.path.exists(config.LATEST_DATA_FILE):
+        # Snapshot trong bộ nhớ (chỉ parse lại file khi scheduler ghi mới)
+        data = latest_snapshot.load()
+        if data is None:
             return jsonify({
                 "success": False,
                 "error": "Chưa có dữ liệu. Vui lòng đợi lần cập nhật đầu tiên."
             }), 404
         
-        with open(config.LATEST_DATA_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
         station_data = data['stations'].get(station_id)
         
         if not station_data:
@@ -168,13 +361,16 @@ def get_station_data(station_id):
                 "error": f"Không có dữ liệu cho trạm {station_id}"
             }), 404
         
-        return jsonify({
+        if fmt != "json":
+            return _negotiated_response(fmt, response_formats.encode_station(fmt, station_data))
+        
+        return _negotiated_response(fmt, jsonify({
             "success": True,
             "data": station_data
-        })
+        }))
         
     except Exception as e:
-        logger.error(f"Lỗi khi lấy dữ liệu trạm {station_id}: {str(e)}")
+        logger.error("Lỗi khi lấy dữ liệu trạm %s: %s", station_id, e)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -184,43 +380,209 @@ def get_station_data(station_id):
 @app.route('/api/alerts', methods=['GET'])
 def get_alerts():
     """
-    Lấy danh sách các cảnh báo hiện tại (chỉ trạm có mực nước cao)
+    Lấy danh sách các cảnh báo hiện tại (chỉ trạm có mực nước cao), CRITICAL trước
+    
+    Đọc chỉ mục cảnh báo scheduler ghi sẵn trong snapshot (không duyệt mọi trạm).
     """
     try:
-        if not os.path.exists(config.LATEST_DATA_FILE):
+        data = latest_snapshot.load()
+        if data is None:
             return jsonify({
                 "success": False,
                 "error": "Chưa có dữ liệu"
             }), 404
         
-        with open(config.LATEST_DATA_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        alerts = []
-        
-        for station_id, station_data in data['stations'].items():
-            alert = station_data.get('alert', {})
-            if alert.get('level') in ['WARNING', 'CRITICAL']:
-                alerts.append({
-                    "station_id": station_id,
-                    "station_name": station_data['station_name'],
-                    "alert_level": alert['level'],
-                    "message": alert['message'],
-                    "current_water_level": station_data['current']['water_level'],
-                    "timestamp": station_data['current']['timestamp']
-                })
+        alerts = data.get('alerts')
+        if alerts is None:
+            # Snapshot ghi trước khi có chỉ mục cảnh báo
+            alerts = build_alert_index(data['stations'])
         
         return jsonify({
             "success": True,
             "data": {
                 "alerts": alerts,
                 "total": len(alerts),
-                "has_critical": any(a['alert_level'] == 'CRITICAL' for a in alerts)
+                "has_critical": bool(alerts) and alerts[0]['alert_level'] == 'CRITICAL'
+            }
+        })
+        
+    except Exception as e:
+        logger.error("Lỗi khi lấy danh sách cảnh báo: %s", e)
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+
+@app.route('/api/alerts/history', methods=['GET'])
+def get_alert_history():
+    """
+    Nhật ký chuyển mức cảnh báo (sau vùng trễ), tăng dần theo seq
+    
+    Query params:
+    - since: seq cuối client đã có (default: 0, từ đầu); lần gọi sau dùng next_since
+    - limit: số chuyển mức tối đa (default: 100, tối đa 1000)
+    - station_id: chỉ lấy một trạm (tùy chọn)
+    """
+    try:
+        alerts_config = config.ALERTS
+        try:
+            since = int(request.args.get('since', 0))
+            limit = int(request.args.get('limit', alerts_config['history_limit']))
+        except ValueError:
+            return jsonify({
+                "success": False,
+                "error": "Tham số since/limit phải là số nguyên"
+            }), 400
+        limit = min(max(limit, 1), alerts_config['history_max_limit'])
+        
+        station_id = request.args.get('station_id')
+        if station_id is not None and station_id not in config.STATIONS:
+            return jsonify({
+                "success": False,
+                "error": f"Không tìm thấy trạm với ID: {station_id}"
+            }), 404
+        
+        # Đọc thêm một dòng để biết còn chuyển mức phía sau hay không
+        transitions = alert_tracker.history(since, limit + 1, station_id)
+        has_more = len(transitions) > limit
+        transitions = transitions[:limit]
+        
+        return jsonify({
+            "success": True,
+            "data": {
+                "transitions": transitions,
+                "total": len(transitions),
+                "next_since": transitions[-1]['seq'] if transitions else since,
+                "has_more": has_more
             }
         })
         
     except Exception as e:
-        logger.error(f"Lỗi khi lấy danh sách cảnh báo: {str(e)}")
+        logger.error("Lỗi khi lấy nhật ký cảnh báo: %s", e)
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+
+def _check_webhook_token():
+    """
+    Lỗi (response, status) nếu request không có header X-Admin-Token đúng WEBHOOKS['admin_token'],
+    None nếu hợp lệ; chưa cấu hình token thì API webhook bị tắt (dùng CLI webhooks.py)
+    """
+    if not config.WEBHOOKS['admin_token']:
+        return jsonify({
+            "success": False,
+            "error": "API webhook chưa bật (đặt WEBHOOK_ADMIN_TOKEN) - dùng python webhooks.py"
+        }), 403
+    if not webhook_token_matches(request.headers.get('X-Admin-Token')):
+        return jsonify({
+            "success": False,
+            "error": "Token quản trị không hợp lệ"
+        }), 403
+    return None
+
+
+@app.route('/api/webhooks', methods=['GET'])
+def list_webhooks():
+    """
+    Các webhook đã đăng ký (không kèm secret) với số chuyển mức đang chờ gửi/dead
+    
+    Header: X-Admin-Token
+    """
+    denied = _check_webhook_token()
+    if denied is not None:
+        return denied
+    
+    try:
+        return jsonify({
+            "success": True,
+            "data": webhook_store.status()
+        })
+    except Exception as e:
+        logger.error("Lỗi khi lấy danh sách webhook: %s", e)
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+
+@app.route('/api/webhooks', methods=['POST'])
+def create_webhook():
+    """
+    Đăng ký URL nhận các lần chuyển mức cảnh báo (POST JSON theo lô)
+    
+    Header: X-Admin-Token
+    Body JSON:
+    - url: URL http(s) nhận webhook
+    - secret: ký body bằng HMAC-SHA256 (header X-Mekong-Signature), tùy chọn
+    - levels: chỉ nhận chuyển mức vào/ra các mức này (default: ["WARNING", "CRITICAL"])
+    - station_ids: chỉ nhận các trạm này (default: tất cả)
+    """
+    denied = _check_webhook_token()
+    if denied is not None:
+        return denied
+    
+    try:
+        body = request.get_json(silent=True) or {}
+        url = body.get('url')
+        levels = body.get('levels')
+        station_ids = body.get('station_ids')
+        if not isinstance(url, str) or not all(
+            value is None or (isinstance(value, list) and all(isinstance(item, str) for item in value))
+            for value in (levels, station_ids)
+        ):
+            error = "Body phải có url (chuỗi); levels/station_ids (nếu có) là danh sách chuỗi"
+        else:
+            error = validate_subscription(url, levels, station_ids)
+        if error:
+            return jsonify({
+                "success": False,
+                "error": error
+            }), 400
+        
+        subscription = webhook_store.add_subscription(url, body.get('secret'), levels, station_ids)
+        subscription['has_secret'] = subscription.pop('secret') is not None
+        logger.info("Đã đăng ký webhook %s → %s", subscription['id'], url)
+        return jsonify({
+            "success": True,
+            "data": subscription
+        }), 201
+        
+    except Exception as e:
+        logger.error("Lỗi khi đăng ký webhook: %s", e)
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+
+@app.route('/api/webhooks/<subscription_id>', methods=['DELETE'])
+def delete_webhook(subscription_id):
+    """
+    Xóa webhook cùng các chuyển mức chưa gửi của nó
+    
+    Header: X-Admin-Token
+    """
+    denied = _check_webhook_token()
+    if denied is not None:
+        return denied
+    
+    try:
+        if not webhook_store.remove_subscription(subscription_id):
+            return jsonify({
+                "success": False,
+                "error": f"Không tìm thấy webhook với ID: {subscription_id}"
+            }), 404
+        logger.info("Đã xóa webhook %s", subscription_id)
+        return jsonify({
+            "success": True,
+            "message": f"Đã xóa webhook {subscription_id}"
+        })
+        
+    except Exception as e:
+        logger.error("Lỗi khi xóa webhook: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -235,6 +597,12 @@ def trigger_update():
     try:
         logger.info("Nhận request cập nhật dữ liệu thủ công")
         
+        if not scheduler.is_leader():
+            return jsonify({
+                "success": False,
+                "error": "Replica này không phải leader, hãy gửi yêu cầu cập nhật tới leader"
+            }), 409
+        
         success = scheduler.update_data()
         
         if success:
@@ -250,7 +618,7 @@ def trigger_update():
             }), 500
         
     except Exception as e:
-        logger.error(f"Lỗi khi trigger update: {str(e)}")
+        logger.error("Lỗi khi trigger update: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -263,22 +631,29 @@ def get_status():
     Lấy trạng thái của scheduler và hệ thống
     """
     try:
-        status = scheduler.get_status()
+        # ?windows=1,24 : các cửa sổ (giờ) tính phân vị thời gian cập nhật
+        windows = request.args.get('windows')
+        try:
+            windows_hours = [float(value) for value in windows.split(',')] if windows else None
+        except ValueError:
+            return jsonify({
+                "success": False,
+                "error": "Tham số windows không hợp lệ (ví dụ: windows=1,24,168)"
+            }), 400
+        
+        status = scheduler.get_status(windows_hours)
         
         # Thêm thông tin file
         data_file_exists = os.path.exists(config.LATEST_DATA_FILE)
         data_file_size = os.path.getsize(config.LATEST_DATA_FILE) if data_file_exists else 0
         
-        last_update = None
-        if data_file_exists:
-            with open(config.LATEST_DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                last_update = data.get('last_updated')
+        data = latest_snapshot.load()
         
         status.update({
             "data_file_exists": data_file_exists,
             "data_file_size_bytes": data_file_size,
-            "last_update": last_update,
+            "last_update": data.get('last_updated') if data else None,
+            "generation": data.get('metadata', {}).get('generation') if data else None,
             "current_time": datetime.now(pytz.timezone(config.TIMEZONE)).isoformat()
         })
         
@@ -288,65 +663,277 @@ def get_status():
         })
         
     except Exception as e:
-        logger.error(f"Lỗi khi lấy status: {str(e)}")
+        logger.error("Lỗi khi lấy status: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
 
 
+def _parse_query_time(value):
+    """Chuyển tham số thời gian ISO 8601 sang epoch ms (không có offset thì hiểu là giờ Việt Nam)"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = pytz.timezone(config.TIMEZONE).localize(parsed)
+    return int(parsed.timestamp() * 1000)
+
+
 @app.route('/api/historical/<station_id>', methods=['GET'])
 def get_historical_data(station_id):
     """
-    Lấy dữ liệu lịch sử của một trạm (từ CSV)
+    Lấy dữ liệu lịch sử của một trạm (từ store SQLite)
+    
+    Dữ liệu cũ tự động lấy từ tầng gộp theo giờ/theo ngày (xem trường "tier").
     
     Query params:
-    - limit: số lượng bản ghi tối đa (default: 100)
+    - limit: số lượng bản ghi tối đa (default: 100, không giới hạn khi có start/end)
+    - start, end: khoảng thời gian ISO 8601 (tùy chọn, mặc định theo giờ Việt Nam)
+    
+    Header Accept: application/msgpack hoặc application/vnd.apache.arrow.stream trả records dạng cột
+    (đọc thẳng từ store thành mảng, không tạo dict cho từng bản ghi)
     """
     try:
+        fmt = response_formats.negotiate(request.accept_mimetypes)
+        if fmt is None:
+            return _not_acceptable()
+        
         if station_id not in config.STATIONS:
             return jsonify({
                 "success": False,
                 "error": f"Không tìm thấy trạm với ID: {station_id}"
             }), 404
         
-        if not os.path.exists(config.HISTORICAL_DATA_FILE):
+        start = request.args.get('start')
+        end = request.args.get('end')
+        
+        if start or end:
+            try:
+                start_ms = _parse_query_time(start)
+                end_ms = _parse_query_time(end)
+            except ValueError:
+                return jsonify({
+                    "success": False,
+                    "error": "Tham số start/end phải theo định dạng ISO 8601"
+                }), 400
+            
+            limit = request.args.get('limit')
+            limit = int(limit) if limit else None
+        else:
+            # Đọc N bản ghi gần nhất theo index (station_id, timestamp)
+            start_ms = end_ms = None
+            limit = int(request.args.get('limit', 100))
+        
+        if fmt != "json":
+            columns = history_store.read_range_columns(station_id, start_ms=start_ms, end_ms=end_ms, limit=limit)
+            total = len(columns['timestamp'])
+            records = None
+        else:
+            records = history_store.read_range(station_id, start_ms=start_ms, end_ms=end_ms, limit=limit)
+            total = len(records)
+        
+        if not total:
             return jsonify({
                 "success": False,
                 "error": "Chưa có dữ liệu lịch sử"
             }), 404
         
-        # Đọc CSV
-        import pandas as pd
-        df = pd.read_csv(config.HISTORICAL_DATA_FILE)
+        if records is None:
+            document = {"station_id": station_id, "total": total}
+            return _negotiated_response(fmt, response_formats.encode_history(fmt, document, columns))
+        
+        return _negotiated_response(fmt, jsonify({
+            "success": True,
+            "data": {
+                "station_id": station_id,
+                "records": records,
+                "total": total
+            }
+        }))
+        
+    except Exception as e:
+        logger.error("Lỗi khi lấy dữ liệu lịch sử: %s", e)
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+
+# Cột CSV export: bản ghi điểm thô và bucket gộp dùng chung một header
+EXPORT_CSV_COLUMNS = [
+    'timestamp', 'station_id', 'station_name', 'water_level', 'alert_level', 'trend_direction',
+    'min_level', 'max_level', 'samples', 'tier'
+]
+
+
+def _ndjson_chunks(chunks):
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    for records in chunks:
+        yield ''.join(encode(record) + '\n' for record in records)
+
+
+def _csv_chunks(chunks):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_CSV_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    for records in chunks:
+        writer.writerows(records)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _gzip_chunks(chunks, level):
+    """Nén gzip theo từng khối, flush sau mỗi khối để client nhận dữ liệu ngay"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+@app.route('/api/export/<station_id>', methods=['GET'])
+def export_historical_data(station_id):
+    """
+    Stream toàn bộ lịch sử của một trạm (NDJSON hoặc CSV), đọc từ store theo từng khối
+    
+    Bộ nhớ của worker không phụ thuộc độ dài khoảng thời gian. Phản hồi được nén gzip
+    khi client gửi Accept-Encoding: gzip.
+    
+    Query params:
+    - format: ndjson (default) hoặc csv
+    - start, end: khoảng thời gian ISO 8601 (tùy chọn, mặc định theo giờ Việt Nam)
+    """
+    if station_id not in config.STATIONS:
+        return jsonify({
+            "success": False,
+            "error": f"Không tìm thấy trạm với ID: {station_id}"
+        }), 404
+    
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({
+            "success": False,
+            "error": "Tham số format phải là ndjson hoặc csv"
+        }), 400
+    
+    try:
+        start_ms = _parse_query_time(request.args.get('start'))
+        end_ms = _parse_query_time(request.args.get('end'))
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": "Tham số start/end phải theo định dạng ISO 8601"
+        }), 400
+    
+    chunks = history_store.iter_range(
+        station_id, start_ms, end_ms, chunk_size=config.EXPORT_STREAM['chunk_size']
+    )
+    if export_format == 'csv':
+        body = _csv_chunks(chunks)
+        mimetype = 'text/csv'
+    else:
+        body = _ndjson_chunks(chunks)
+        mimetype = 'application/x-ndjson'
+    
+    headers = {
+        'Content-Disposition': f'attachment; filename="{station_id}.{export_format}"',
+        'Vary': 'Accept-Encoding'
+    }
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = _gzip_chunks(body, config.EXPORT_STREAM['gzip_level'])
+        headers['Content-Encoding'] = 'gzip'
+    
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+
+@app.route('/api/forecast/<station_id>', methods=['GET'])
+def get_forecast(station_id):
+    """
+    Lấy đường dự báo mực nước của một trạm từ mô hình triều điều hòa
+    
+    Query params:
+    - hours: số giờ dự báo, > 0 (default: 72, tối đa TIDE_MODEL['max_horizon_hours'])
+    - step: bước thời gian tính bằng phút, 1 đến hours * 60 (default: 60)
+    """
+    try:
+        if station_id not in config.STATIONS:
+            return jsonify({
+                "success": False,
+                "error": f"Không tìm thấy trạm với ID: {station_id}"
+            }), 404
+        
+        model_config = config.TIDE_MODEL
+        try:
+            hours = int(request.args.get('hours', model_config['default_horizon_hours']))
+            step = int(request.args.get('step', model_config['default_step_minutes']))
+        except ValueError:
+            return jsonify({
+                "success": False,
+                "error": "Tham số hours/step phải là số nguyên"
+            }), 400
         
-        # Filter theo station_id
-        df_station = df[df['station_id'] == station_id]
+        if hours <= 0 or step <= 0 or step > hours * 60:
+            return jsonify({
+                "success": False,
+                "error": "Tham số hours phải > 0 và step phải trong khoảng 1 đến hours * 60 phút"
+            }), 400
+        hours = min(hours, model_config['max_horizon_hours'])
         
-        # Limit
-        limit = int(request.args.get('limit', 100))
-        df_station = df_station.tail(limit)
+        # Nạp lại hệ số nếu scheduler vừa cập nhật file mô hình
+        tide_models.load()
+        model = tide_models.get(station_id)
         
-        # Convert to dict
-        records = df_station.to_dict('records')
+        # Mốc bắt đầu làm tròn theo bước để các request gần nhau dùng chung cache
+        step_ms = step * 60 * 1000
+        now_ms = int(datetime.now(pytz.utc).timestamp() * 1000)
+        start_ms = (now_ms // step_ms + 1) * step_ms
+        
+        timezone = pytz.timezone(config.TIMEZONE)
+        points = tide_models.forecast(station_id, start_ms, hours, step, timezone)
+        
+        if points is None:
+            return jsonify({
+                "success": False,
+                "error": f"Chưa đủ dữ liệu để dự báo cho trạm {station_id}"
+            }), 404
         
         return jsonify({
             "success": True,
             "data": {
                 "station_id": station_id,
-                "records": records,
-                "total": len(records)
+                "horizon_hours": hours,
+                "step_minutes": step,
+                "model": {
+                    "constituents": model.describe(),
+                    "fitted_points": model.count,
+                    "last_observation": datetime.fromtimestamp(
+                        model.last_timestamp / 1000, tz=timezone
+                    ).isoformat()
+                },
+                "points": points
             }
         })
         
     except Exception as e:
-        logger.error(f"Lỗi khi lấy dữ liệu lịch sử: {str(e)}")
+        logger.error("Lỗi khi lấy dự báo trạm %s: %s", station_id, e)
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Metrics định dạng Prometheus: độ trễ/kích thước response theo route, cache,
+    thời gian từng bước cập nhật và độ trễ dữ liệu theo trạm
+    """
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
 # ============================================================================
 # ERROR HANDLERS
 # ============================================================================
@@ -0,0 +1,328 @@
+"""
+Module backfill dữ liệu lịch sử: chia khoảng thời gian thành chunk, lấy song song, ghi theo lô
+Resumable parallel historical backfill into the historical store
+
+Chạy:
+    python backfill.py --start 2024-01-01 --end 2025-01-01
+    python backfill.py --start 2024-01-01 --end 2025-01-01 --stations can_tho,tan_chau --workers 8
+    python backfill.py --start 2024-01-01 --end 2025-01-01 --backend sample --rate 50
+
+Tiến độ được lưu vào file checkpoint sau mỗi lần ghi; chạy lại cùng lệnh sẽ bỏ qua các chunk đã xong.
+Không backfill phần trước mốc nén tầng thô của trạm (đã gộp theo giờ): chunk đó bị bỏ qua hoặc cắt bớt.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import pytz
+
+import config
+from history_store import HistoricalStore
+from log_setup import setup_logging
+from mrc_scraper import MRCWaterLevelScraper
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+HOUR_MS = 3600 * 1000
+
+# Một chunk: (station_id, start_ms, end_ms)
+Chunk = Tuple[str, int, int]
+
+
+class TokenBucket:
+    """
+    Giới hạn tốc độ dùng chung cho mọi worker: `rate` request/giây, cho phép dồn tối đa `burst`
+    """
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BackfillCheckpoint:
+    """
+    File checkpoint JSON: danh sách chunk đã ghi xong cho một cấu hình backfill
+    
+    Nếu cấu hình (khoảng thời gian, kích thước chunk) thay đổi, tiến độ cũ bị bỏ qua.
+    """
+    
+    def __init__(self, file_path: str, signature: str):
+        self.file_path = file_path
+        self.signature = signature
+        self.done: Set[str] = set()
+        self._load()
+    
+    @staticmethod
+    def key(chunk: Chunk) -> str:
+        station_id, start_ms, _ = chunk
+        return f"{station_id}:{start_ms}"
+    
+    def is_done(self, chunk: Chunk) -> bool:
+        return self.key(chunk) in self.done
+    
+    def mark_done(self, chunks: List[Chunk]):
+        """Đánh dấu các chunk đã được commit vào store rồi ghi file (ghi file tạm rồi os.replace)"""
+        self.done.update(self.key(chunk) for chunk in chunks)
+        Path(self.file_path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"signature": self.signature, "done": sorted(self.done)}, f)
+        os.replace(tmp_path, self.file_path)
+    
+    def reset(self):
+        self.done.clear()
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+    
+    def _load(self):
+        if not os.path.exists(self.file_path):
+            return
+        
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved.get('signature') == self.signature:
+            self.done = set(saved.get('done', []))
+            logger.info(f"✓ Tiếp tục backfill: {len(self.done)} chunk đã hoàn thành trước đó")
+        else:
+            logger.warning("✗ Checkpoint thuộc cấu hình backfill khác, bắt đầu lại từ đầu")
+
+
+def plan_chunks(station_ids: List[str], start_ms: int, end_ms: int, chunk_hours: int) -> List[Chunk]:
+    """
+    Chia [start_ms, end_ms) của từng trạm thành các chunk `chunk_hours` giờ
+    
+    Thứ tự xen kẽ giữa các trạm để worker song song không dồn vào một trạm.
+    """
+    chunk_ms = chunk_hours * HOUR_MS
+    chunks = []
+    for chunk_start in range(start_ms, end_ms, chunk_ms):
+        for station_id in station_ids:
+            chunks.append((station_id, chunk_start, min(chunk_start + chunk_ms, end_ms)))
+    return chunks
+
+
+class Backfill:
+    """
+    Lấy các chunk song song qua scraper (giới hạn tốc độ chung), ghi theo lô vào HistoricalStore
+    
+    Chỉ thread chính ghi store và checkpoint, sau khi transaction đã commit, nên chunk
+    bị gián đoạn giữa chừng sẽ được lấy lại ở lần chạy sau.
+    
+    Điểm thô trước mốc nén (store.tier_cutoff) của trạm không được ghi: khoảng đó đã được
+    gộp sang tầng theo giờ, ghi thêm sẽ bị lần nén sau cộng dồn lần nữa.
+    """
+    
+    def __init__(self, store: Optional[HistoricalStore] = None,
+                 scraper: Optional[MRCWaterLevelScraper] = None,
+                 workers: Optional[int] = None, rate: Optional[float] = None,
+                 burst: Optional[int] = None):
+        backfill_config = config.BACKFILL
+        self.store = store or HistoricalStore()
+        self.scraper = scraper or MRCWaterLevelScraper()
+        self.workers = workers or backfill_config['workers']
+        self.limiter = TokenBucket(rate or backfill_config['rate_per_second'],
+                                   burst or backfill_config['burst'])
+        self.max_retries = backfill_config['max_retries']
+        self.write_batch_points = backfill_config['write_batch_points']
+    
+    def run(self, chunks: List[Chunk], checkpoint: BackfillCheckpoint) -> Dict:
+        """
+        Returns:
+            Thống kê: số chunk xong/lỗi, số điểm, số dòng mới, thời gian, điểm/giây
+        """
+        stats = {"chunks_done": 0, "chunks_failed": 0, "chunks_skipped": 0, "points": 0, "rows_written": 0}
+        pending = self._clamp_to_cutoffs([chunk for chunk in chunks if not checkpoint.is_done(chunk)], stats)
+        logger.info(f"Backfill {len(pending)}/{len(chunks)} chunk với {self.workers} worker")
+        
+        batch: Dict[str, Dict] = {}
+        batch_chunks: List[Chunk] = []
+        batch_points = 0
+        start_time = time.time()
+        
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = {executor.submit(self._fetch, fetch_range): chunk for chunk, fetch_range in pending}
+        try:
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    points = future.result()
+                except ValueError:
+                    # Lỗi cấu hình (backend/URL): dừng ngay thay vì lỗi lần lượt mọi chunk
+                    raise
+                except Exception as e:
+                    stats["chunks_failed"] += 1
+                    logger.error(f"✗ Bỏ qua chunk {BackfillCheckpoint.key(chunk)}: {str(e)}")
+                    continue
+                
+                station_id = chunk[0]
+                batch.setdefault(station_id, {"raw_data": {"data": []}})["raw_data"]["data"].extend(points)
+                batch_chunks.append(chunk)
+                batch_points += len(points)
+                
+                if batch_points >= self.write_batch_points:
+                    self._flush(batch, batch_chunks, batch_points, checkpoint, stats, start_time)
+                    batch, batch_chunks, batch_points = {}, [], 0
+        except (KeyboardInterrupt, ValueError):
+            # Hủy các chunk chưa chạy; chunk đã lấy xong vẫn được ghi và checkpoint bên dưới
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            if batch_chunks:
+                self._flush(batch, batch_chunks, batch_points, checkpoint, stats, start_time)
+        executor.shutdown()
+        
+        elapsed = time.time() - start_time
+        stats["elapsed_seconds"] = round(elapsed, 2)
+        stats["points_per_second"] = round(stats["points"] / elapsed, 1) if elapsed > 0 else 0.0
+        return stats
+    
+    def _clamp_to_cutoffs(self, chunks: List[Chunk], stats: Dict) -> List[Tuple[Chunk, Chunk]]:
+        """
+        Cắt các chunk theo mốc nén tầng thô của từng trạm
+        
+        Returns:
+            Cặp (chunk gốc dùng cho checkpoint, khoảng cần lấy); chunk nằm trọn trước mốc bị bỏ
+        """
+        cutoffs = {station_id: self.store.tier_cutoff(station_id, "raw")
+                   for station_id in {chunk[0] for chunk in chunks}}
+        skipped: Dict[str, int] = {}
+        pending = []
+        for chunk in chunks:
+            station_id, start_ms, end_ms = chunk
+            cutoff = cutoffs[station_id]
+            if cutoff is None or start_ms >= cutoff:
+                pending.append((chunk, chunk))
+            elif end_ms <= cutoff:
+                skipped[station_id] = skipped.get(station_id, 0) + 1
+            else:
+                pending.append((chunk, (station_id, cutoff, end_ms)))
+        
+        tz = pytz.timezone(config.TIMEZONE)
+        for station_id, count in skipped.items():
+            cutoff_time = datetime.fromtimestamp(cutoffs[station_id] / 1000, tz).isoformat()
+            logger.warning(
+                f"✗ Bỏ qua {count} chunk của trạm {station_id} trước mốc nén {cutoff_time} "
+                f"(dữ liệu thô đã được gộp theo giờ)",
+                extra={"station_id": station_id}
+            )
+        stats["chunks_skipped"] = sum(skipped.values())
+        return pending
+    
+    def _fetch(self, chunk: Chunk) -> List[Dict]:
+        """Lấy một chunk, thử lại với backoff lũy thừa khi lỗi"""
+        station_id, start_ms, end_ms = chunk
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                result = self.scraper.fetch_history(station_id, start_ms, end_ms)
+                return result['raw_data']['data'] if result else []
+            except ValueError:
+                raise
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Lỗi chunk {BackfillCheckpoint.key(chunk)} ({str(e)}), thử lại sau {delay}s")
+                time.sleep(delay)
+        return []
+    
+    def _flush(self, batch: Dict[str, Dict], chunks: List[Chunk], points: int,
+               checkpoint: BackfillCheckpoint, stats: Dict, start_time: float):
+        stats["rows_written"] += self.store.upsert_observations(batch)
+        checkpoint.mark_done(chunks)
+        stats["chunks_done"] += len(chunks)
+        stats["points"] += points
+        
+        elapsed = max(time.time() - start_time, 1e-9)
+        logger.info(
+            f"✓ Đã ghi {stats['chunks_done']} chunk, {stats['points']:,} điểm "
+            f"({stats['points'] / elapsed:,.0f} điểm/giây)"
+        )
+
+
+def _parse_time(value: str) -> int:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = pytz.timezone(config.TIMEZONE).localize(parsed)
+    return int(parsed.timestamp() * 1000)
+
+
+def main():
+    backfill_config = config.BACKFILL
+    parser = argparse.ArgumentParser(description="Backfill dữ liệu mực nước lịch sử vào store")
+    parser.add_argument('--start', required=True, help='Thời điểm bắt đầu (ISO 8601, mặc định giờ Việt Nam)')
+    parser.add_argument('--end', required=True, help='Thời điểm kết thúc (không tính)')
+    parser.add_argument('--stations', help='Danh sách station_id, cách nhau bởi dấu phẩy (mặc định: tất cả)')
+    parser.add_argument('--chunk-hours', type=int, default=backfill_config['chunk_hours'])
+    parser.add_argument('--workers', type=int, default=backfill_config['workers'])
+    parser.add_argument('--rate', type=float, default=backfill_config['rate_per_second'],
+                        help='Số request tối đa mỗi giây (mọi worker cộng lại)')
+    parser.add_argument('--backend', choices=['http', 'sample'], help='Ghi đè BACKFILL["backend"]')
+    parser.add_argument('--checkpoint', default=backfill_config['checkpoint_file'])
+    parser.add_argument('--reset', action='store_true', help='Bỏ checkpoint cũ, chạy lại từ đầu')
+    args = parser.parse_args()
+    
+    if args.backend:
+        config.BACKFILL['backend'] = args.backend
+    
+    station_ids = args.stations.split(',') if args.stations else list(config.STATIONS.keys())
+    unknown = [station_id for station_id in station_ids if station_id not in config.STATIONS]
+    if unknown:
+        parser.error(f"Không tìm thấy trạm: {', '.join(unknown)}")
+    
+    start_ms, end_ms = _parse_time(args.start), _parse_time(args.end)
+    if end_ms <= start_ms:
+        parser.error("--end phải sau --start")
+    
+    chunks = plan_chunks(station_ids, start_ms, end_ms, args.chunk_hours)
+    signature = f"{','.join(sorted(station_ids))}|{start_ms}|{end_ms}|{args.chunk_hours}"
+    checkpoint = BackfillCheckpoint(args.checkpoint, signature)
+    if args.reset:
+        checkpoint.reset()
+    
+    try:
+        stats = Backfill(workers=args.workers, rate=args.rate).run(chunks, checkpoint)
+    except ValueError as e:
+        logger.error(f"✗ {str(e)}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        logger.info("Đã dừng backfill, chạy lại cùng lệnh để tiếp tục")
+        sys.exit(130)
+    
+    print(f"\n{'='*60}")
+    print(f"Chunk hoàn thành: {stats['chunks_done']}, lỗi: {stats['chunks_failed']}, "
+          f"bỏ qua (trước mốc nén): {stats['chunks_skipped']}")
+    print(f"Điểm đã lấy: {stats['points']:,} ({stats['rows_written']:,} dòng mới/sửa đổi)")
+    print(f"Thời gian: {stats['elapsed_seconds']} giây, {stats['points_per_second']:,} điểm/giây")
+    if stats['chunks_failed']:
+        print("Chạy lại cùng lệnh để lấy lại các chunk lỗi")
+    print(f"{'='*60}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark truy vấn "một trạm, một tháng trong 5 năm": quét CSV lịch sử cũ so với Parquet archive
+Historical query benchmark: legacy CSV scan vs station/month-partitioned Parquet archive
+
+Chạy:
+    python benchmarks/bench_parquet_archive.py
+    python benchmarks/bench_parquet_archive.py --stations 50 --years 5 --interval-minutes 15
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from history_store import HistoricalStore  # noqa: E402
+from parquet_archive import ParquetArchive  # noqa: E402
+
+HOUR_MS = 3600 * 1000
+
+
+def generate_history(n_stations: int, years: int, interval_minutes: int, seed: int = 42):
+    """
+    Tạo chuỗi triều tổng hợp cho nhiều trạm, kết thúc tại đầu năm 2025
+    """
+    rng = np.random.default_rng(seed)
+    end_ms = int(pd.Timestamp("2025-01-01", tz=config.TIMEZONE).timestamp() * 1000)
+    step_ms = interval_minutes * 60 * 1000
+    timestamps = np.arange(end_ms - years * 365 * 24 * HOUR_MS, end_ms, step_ms, dtype=np.int64)
+    hours = (timestamps - timestamps[0]) / HOUR_MS
+    
+    for i in range(n_stations):
+        levels = (
+            1.0 + 0.1 * i
+            + 0.8 * np.sin(2 * np.pi * hours / 12.42 + i)
+            + 0.25 * np.sin(2 * np.pi * hours / 23.93)
+            + rng.normal(0, 0.01, hours.size)
+        )
+        yield f"station_{i:03d}", timestamps, np.round(levels, 2)
+
+
+def write_legacy_csv(path: str, history) -> int:
+    """
+    Ghi CSV theo định dạng historical_data.csv cũ (một file cho mọi trạm)
+    """
+    rows = 0
+    header = True
+    for station_id, timestamps, levels in history:
+        frame = pd.DataFrame({
+            "timestamp": pd.to_datetime(timestamps, unit="ms", utc=True).tz_convert(config.TIMEZONE)
+                           .strftime("%Y-%m-%dT%H:%M:%S+07:00"),
+            "station_id": station_id,
+            "station_name": station_id,
+            "water_level": levels,
+            "alert_level": "NORMAL",
+            "trend_direction": "stable"
+        })
+        frame.to_csv(path, mode="w" if header else "a", header=header, index=False)
+        header = False
+        rows += len(frame)
+    return rows
+
+
+def legacy_query(csv_path: str, station_id: str, start_ms: int, end_ms: int) -> pd.DataFrame:
+    """
+    Cách đọc cũ của /api/historical: nạp toàn bộ CSV rồi lọc bằng pandas
+    """
+    df = pd.read_csv(csv_path)
+    df = df[df["station_id"] == station_id]
+    times = pd.to_datetime(df["timestamp"], utc=True)
+    start = pd.Timestamp(start_ms, unit="ms", tz="UTC")
+    end = pd.Timestamp(end_ms, unit="ms", tz="UTC")
+    return df[(times >= start) & (times < end)]
+
+
+def _best_of(func, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--stations", type=int, default=20, help="Số trạm")
+    parser.add_argument("--years", type=int, default=5, help="Số năm dữ liệu")
+    parser.add_argument("--interval-minutes", type=int, default=60, help="Khoảng cách giữa hai điểm (phút)")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần lặp, lấy thời gian tốt nhất")
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix="bench_archive_")
+    try:
+        csv_path = os.path.join(workdir, "historical_data.csv")
+        archive_dir = os.path.join(workdir, "archive")
+        
+        start = time.perf_counter()
+        rows = write_legacy_csv(
+            csv_path, generate_history(args.stations, args.years, args.interval_minutes)
+        )
+        print(f"CSV cũ: {rows:,} dòng, {os.path.getsize(csv_path) / 1e6:.1f} MB "
+              f"({time.perf_counter() - start:.1f} s)")
+        
+        # Đi qua đường ghi thật: store SQLite -> export tăng dần sang Parquet
+        store = HistoricalStore(os.path.join(workdir, "historical.db"))
+        for station_id, timestamps, levels in generate_history(
+            args.stations, args.years, args.interval_minutes
+        ):
+            store.upsert_rows(
+                (station_id, ts, level, None, None)
+                for ts, level in zip(timestamps.tolist(), levels.tolist())
+            )
+        
+        archive = ParquetArchive(root=archive_dir)
+        start = time.perf_counter()
+        partitions = archive.export_from_store(store)
+        print(f"Parquet: {partitions:,} partition, {_directory_size(archive_dir) / 1e6:.1f} MB "
+              f"(export {time.perf_counter() - start:.1f} s)")
+        
+        # Một trạm ở giữa, một tháng ở năm thứ hai
+        station_id = f"station_{args.stations // 2:03d}"
+        start_ms = int(pd.Timestamp("2021-06-01", tz=config.TIMEZONE).timestamp() * 1000)
+        end_ms = int(pd.Timestamp("2021-07-01", tz=config.TIMEZONE).timestamp() * 1000)
+        
+        legacy_time, legacy_rows = _best_of(
+            lambda: legacy_query(csv_path, station_id, start_ms, end_ms), args.repeat
+        )
+        archive_time, archive_rows = _best_of(
+            lambda: archive.query(station_id, start_ms, end_ms), args.repeat
+        )
+        assert len(legacy_rows) == archive_rows.num_rows, (len(legacy_rows), archive_rows.num_rows)
+        
+        print(f"\n{'query':>28} {'time (s)':>10} {'rows':>8}")
+        print(f"{'CSV scan (pandas)':>28} {legacy_time:>10.4f} {len(legacy_rows):>8,}")
+        print(f"{'Parquet archive':>28} {archive_time:>10.4f} {archive_rows.num_rows:>8,}")
+        print(f"{'speedup':>28} {legacy_time / archive_time:>9.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark định dạng response: JSON so với MessagePack / Arrow IPC dạng cột
+Payload size and decode time of JSON vs columnar MessagePack / Arrow IPC API responses
+
+Sinh dữ liệu tổng hợp vào thư mục tạm rồi gọi API qua Flask test client với từng header
+Accept: kích thước body (thô và gzip), thời gian phía server và thời gian client giải mã
+thành cấu trúc dùng được (JSON -> dict/list, MessagePack -> mảng NumPy, Arrow -> Table).
+
+Chạy:
+    python benchmarks/bench_response_formats.py
+    python benchmarks/bench_response_formats.py --stations 300 --days 365 --repeat 10
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+import response_formats  # noqa: E402
+from synthetic_data import generate  # noqa: E402
+
+ACCEPT = {
+    "json": response_formats.JSON,
+    "msgpack": response_formats.MSGPACK,
+    "arrow": response_formats.ARROW
+}
+
+
+def decode(fmt: str, body: bytes):
+    if fmt == "json":
+        return json.loads(body)
+    if fmt == "msgpack":
+        return response_formats.decode_msgpack(body)
+    reader = response_formats.pa.ipc.open_stream(body)
+    table = reader.read_all()
+    return table, json.loads(table.schema.metadata[b"document"])
+
+
+def _best_of(func, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--stations", type=int, default=100, help="Số trạm tổng hợp")
+    parser.add_argument("--days", type=float, default=365, help="Số ngày lịch sử")
+    parser.add_argument("--repeat", type=int, default=5, help="Số lần lặp, lấy thời gian tốt nhất")
+    args = parser.parse_args()
+    
+    formats = [fmt for fmt in ACCEPT if response_formats.is_available(fmt)]
+    workdir = tempfile.mkdtemp(prefix="bench_formats_")
+    try:
+        stats = generate(data_dir=workdir, stations=args.stations, days=args.days)
+        config.LOGS_DIR = os.path.join(workdir, "logs")
+        config.LEADER_ELECTION["enabled"] = False
+        logging.disable(logging.INFO)
+        print(f"Dữ liệu tổng hợp: {stats['stations']} trạm, {stats['rows_written']:,} điểm lịch sử")
+        
+        import app as app_module
+        client = app_module.app.test_client()
+        
+        station_id = sorted(config.STATIONS)[0]
+        start = datetime.fromtimestamp(time.time() - args.days * 86400, pytz.timezone(config.TIMEZONE))
+        paths = [
+            "/api/latest",
+            f"/api/stations/{station_id}",
+            f"/api/historical/{station_id}?limit=100",
+            f"/api/historical/{station_id}?start={start.strftime('%Y-%m-%dT%H:%M:%S')}"
+        ]
+        
+        print(f"\n{'endpoint':<52} {'định dạng':<9} {'bytes':>11} {'gzip':>10} {'server':>10} {'giải mã':>10}")
+        for path in paths:
+            baseline = None
+            for fmt in formats:
+                headers = {"Accept": ACCEPT[fmt]}
+                
+                def call():
+                    response = client.get(path, headers=headers)
+                    assert response.status_code == 200, (path, fmt, response.status_code)
+                    return response.get_data()
+                
+                server_seconds, body = _best_of(call, args.repeat)
+                decode_seconds, _ = _best_of(lambda: decode(fmt, body), args.repeat)
+                compressed = len(gzip.compress(body, compresslevel=6))
+                
+                ratio = ""
+                if baseline is None:
+                    baseline = (len(body), decode_seconds)
+                else:
+                    ratio = f"  ({len(body) / baseline[0]:.2f}x bytes, {decode_seconds / baseline[1]:.3f}x giải mã)"
+                print(f"{path[:52]:<52} {fmt:<9} {len(body):>11,} {compressed:>10,} "
+                      f"{server_seconds * 1000:>8.2f}ms {decode_seconds * 1000:>8.2f}ms{ratio}")
+        
+        print("\n/api/latest phục vụ body đã serialize sẵn cho thế hệ snapshot hiện tại (mỗi định dạng một lần)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
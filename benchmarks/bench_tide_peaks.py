@@ -0,0 +1,134 @@
+"""
+Benchmark phát hiện đỉnh triều: vòng lặp Python cũ so với find_tide_extrema (NumPy)
+Tide peak detection benchmark: legacy Python loop vs vectorized find_tide_extrema
+
+Trước khi đo, kiểm tra hồi quy các trường hợp đỉnh/chân có khấc nhiễu 1 cm (batch và
+StationState cập nhật từng điểm).
+
+Chạy:
+    python benchmarks/bench_tide_peaks.py
+    python benchmarks/bench_tide_peaks.py --max-exp 6 --repeat 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peak_detection import find_tide_extrema  # noqa: E402
+from station_state import StationState  # noqa: E402
+from water_series import WaterLevelSeries  # noqa: E402
+
+# (tên, chuỗi mực nước theo giờ, chỉ số đỉnh cao mong đợi, chỉ số chân thấp mong đợi)
+NOTCHED_CASES = [
+    ("đỉnh có khấc bằng nhau",
+     [1.0, 1.4, 1.7, 1.80, 1.79, 1.80, 1.6, 1.2, 0.9, 0.6, 0.9, 1.3], [5], [9]),
+    ("đỉnh có khấc, nửa sau cao hơn",
+     [1.0, 1.4, 1.7, 1.79, 1.78, 1.80, 1.6, 1.2, 0.9, 0.6, 0.9, 1.3], [5], [9]),
+    ("đỉnh có khấc, nửa trước cao hơn",
+     [1.0, 1.4, 1.7, 1.81, 1.79, 1.80, 1.6, 1.2, 0.9, 0.6, 0.9, 1.3], [3], [9]),
+    ("chân có khấc bằng nhau",
+     [1.5, 1.0, 0.6, 0.40, 0.41, 0.40, 0.7, 1.2, 1.6, 1.3], [8], [5]),
+    ("chân có khấc, nửa trước thấp hơn",
+     [1.5, 1.0, 0.6, 0.39, 0.41, 0.40, 0.7, 1.2, 1.6, 1.3], [8], [3]),
+    ("đỉnh có hai khấc liên tiếp",
+     [1.0, 1.4, 1.80, 1.79, 1.80, 1.79, 1.81, 1.5, 1.0, 0.6, 0.9, 1.3], [6], [9])
+]
+
+
+def legacy_find_peaks(water_levels):
+    """
+    Bản sao thuật toán cũ của WaterLevelProcessor._find_tide_peaks (2 vòng lặp)
+    """
+    peaks_high_idx = []
+    for i in range(1, len(water_levels) - 1):
+        if water_levels[i] > water_levels[i-1] and water_levels[i] > water_levels[i+1]:
+            peaks_high_idx.append(i)
+    
+    peaks_low_idx = []
+    for i in range(1, len(water_levels) - 1):
+        if water_levels[i] < water_levels[i-1] and water_levels[i] < water_levels[i+1]:
+            peaks_low_idx.append(i)
+    
+    return peaks_high_idx, peaks_low_idx
+
+
+def generate_series(n: int, seed: int = 42):
+    """
+    Tạo chuỗi triều bán nhật theo giờ, làm tròn 1 cm như dữ liệu MRC
+    """
+    rng = np.random.default_rng(seed)
+    hours = np.arange(n, dtype=np.float64)
+    times = (hours * 3600 * 1000).astype(np.int64)
+    levels = (
+        1.2
+        + 0.8 * np.sin(2 * np.pi * hours / 12.42)
+        + 0.25 * np.sin(2 * np.pi * hours / 23.93)
+        + rng.normal(0, 0.01, n)
+    )
+    return times, np.round(levels, 2)
+
+
+def check_notched_extrema():
+    """
+    Khấc nhiễu 1 cm ở đỉnh/chân không được làm mất cực trị thật (min_prominence 2 cm),
+    cả khi tìm trên cả chuỗi lẫn khi StationState nhận từng điểm một
+    """
+    for name, levels, expected_highs, expected_lows in NOTCHED_CASES:
+        times = np.arange(len(levels), dtype=np.int64) * 3600 * 1000
+        highs, lows = find_tide_extrema(levels, times=times, min_prominence=0.02)
+        assert highs.tolist() == expected_highs and lows.tolist() == expected_lows, (name, highs, lows)
+        
+        state = StationState(capacity=64, min_prominence=0.02)
+        for i in range(len(levels)):
+            state.update(WaterLevelSeries(times[i:i + 1], np.asarray(levels[i:i + 1])))
+        state_highs, state_lows = state.peaks()
+        assert state_highs.timestamps.tolist() == times[expected_highs].tolist(), (name, state_highs.timestamps)
+        assert state_lows.timestamps.tolist() == times[expected_lows].tolist(), (name, state_lows.timestamps)
+    print(f"✓ {len(NOTCHED_CASES)} trường hợp đỉnh/chân có khấc nhiễu")
+
+
+def _best_of(func, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--min-exp', type=int, default=3, help='Kích thước nhỏ nhất 10^min-exp')
+    parser.add_argument('--max-exp', type=int, default=7, help='Kích thước lớn nhất 10^max-exp')
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần lặp, lấy thời gian tốt nhất')
+    args = parser.parse_args()
+    
+    check_notched_extrema()
+    
+    print(f"{'points':>12} {'legacy (s)':>12} {'numpy (s)':>12} {'speedup':>9} {'highs':>9} {'lows':>9}")
+    
+    for exp in range(args.min_exp, args.max_exp + 1):
+        n = 10 ** exp
+        times, levels = generate_series(n)
+        
+        # Vòng lặp cũ chạy trên mảng NumPy như trong processor (df['water_level'].values)
+        legacy_time = _best_of(lambda: legacy_find_peaks(levels), 1 if exp >= 6 else args.repeat)
+        numpy_time = _best_of(
+            lambda: find_tide_extrema(levels, times=times, min_prominence=0.02,
+                                      min_separation=3 * 3600 * 1000),
+            args.repeat
+        )
+        highs, lows = find_tide_extrema(levels, times=times, min_prominence=0.02,
+                                        min_separation=3 * 3600 * 1000)
+        
+        print(f"{n:>12,} {legacy_time:>12.4f} {numpy_time:>12.4f} "
+              f"{legacy_time / numpy_time:>8.1f}x {len(highs):>9,} {len(lows):>9,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Bộ benchmark các đường nóng: processor, store lịch sử và các endpoint Flask, so với baseline đã commit
+Benchmark suite for processor, storage and API hot paths with committed baselines
+
+Mọi dữ liệu là chuỗi triều tổng hợp có seed cố định; file cấu hình/dữ liệu được chuyển
+sang thư mục tạm nên không đụng tới data/ thật.
+
+Chạy:
+    python benchmarks/suite.py                       # so với benchmarks/baselines.json
+    python benchmarks/suite.py --quick               # kích thước nhỏ, chạy nhanh
+    python benchmarks/suite.py --filter processor    # chỉ các benchmark có tên chứa chuỗi này
+    python benchmarks/suite.py --update-baseline     # ghi lại baseline từ lần chạy này
+    python benchmarks/suite.py --threshold 1.3       # chậm hơn baseline quá 30% là regression
+
+Thoát với mã 1 nếu có benchmark chậm hơn baseline quá ngưỡng. Baseline phụ thuộc máy đo:
+chỉ so sánh trên cùng loại máy (thông tin máy được ghi kèm trong file baseline).
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from synthetic_data import use_data_dir  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_THRESHOLD = 1.5
+
+HOUR_MS = 3600 * 1000
+# Mốc kết thúc cố định của dữ liệu tổng hợp (2025-01-01 00:00 giờ Việt Nam)
+END_MS = 1735664400000
+
+# Một benchmark: (tên, hàm chuẩn bị trả về callable cần đo, số lần đo)
+Case = Tuple[str, Callable[[], Callable[[], object]], int]
+
+
+def tide_levels(hours: np.ndarray, station_index: int, rng: np.random.Generator) -> np.ndarray:
+    """Triều bán nhật + nhật triều + nhiễu, làm tròn 1 cm như dữ liệu MRC"""
+    return np.round(
+        1.2 + 0.05 * (station_index % 7)
+        + 0.8 * np.sin(2 * np.pi * hours / 12.42 + station_index)
+        + 0.25 * np.sin(2 * np.pi * hours / 23.93)
+        + rng.normal(0, 0.01, hours.size),
+        2
+    )
+
+
+def raw_station(station_id: str, n_points: int, station_index: int = 0,
+                end_ms: int = END_MS, seed: int = 42) -> Dict:
+    """Dữ liệu thô dạng output của scraper: n_points điểm theo giờ kết thúc tại end_ms"""
+    rng = np.random.default_rng(seed + station_index)
+    timestamps = end_ms - np.arange(n_points - 1, -1, -1, dtype=np.int64) * HOUR_MS
+    levels = tide_levels((timestamps - END_MS) / HOUR_MS, station_index, rng)
+    return {
+        "station_id": station_id,
+        "station_name": config.STATIONS[station_id]['name'],
+        "data_source": "synthetic",
+        "raw_data": {
+            "data": [
+                {"timestamp": ts, "value": level}
+                for ts, level in zip(timestamps.tolist(), levels.tolist())
+            ],
+            "unit": "m"
+        }
+    }
+
+
+def register_stations(count: int) -> List[str]:
+    """Thêm `count` trạm tổng hợp vào config.STATIONS (chỉ trong process benchmark)"""
+    station_ids = []
+    for i in range(count):
+        station_id = f"bench_{i:04d}"
+        config.STATIONS.setdefault(station_id, {
+            "name": f"Trạm benchmark {i}",
+            "name_en": f"Benchmark station {i}",
+            "flood_threshold": 2.6,
+            "warning_threshold": 2.3,
+            "coordinates": {"lat": 10.0 + i * 0.001, "lon": 105.0 + i * 0.001}
+        })
+        station_ids.append(station_id)
+    return station_ids
+
+
+def isolate_data_dir(workdir: str):
+    """Chuyển mọi file dữ liệu/cấu hình/log sang thư mục tạm"""
+    use_data_dir(workdir)
+    config.LOGS_DIR = os.path.join(workdir, "logs")
+    os.makedirs(config.LOGS_DIR, exist_ok=True)
+    config.PROFILING['token'] = ""
+    config.PROFILING['profile_next_runs'] = 0
+
+
+# ============================================================================
+# PROCESSOR
+# ============================================================================
+
+def processor_cases(quick: bool) -> List[Case]:
+    from data_processor import WaterLevelProcessor
+    
+    repeat = 5 if quick else 15
+    lengths = (24, 720) if quick else (24, 720, 8760)
+    station_counts = (5, 50) if quick else (5, 50, 200)
+    cases: List[Case] = []
+    
+    def cold(n_points: int):
+        def setup():
+            raw = raw_station("can_tho", n_points)
+            processors = [WaterLevelProcessor(use_cache=False) for _ in range(repeat + 1)]
+            return lambda: processors.pop().process_station_data(raw)
+        return setup
+    
+    def incremental(n_points: int):
+        def setup():
+            # Trạng thái streaming đã có n_points điểm, mỗi lần gọi thêm một giờ mới
+            processor = WaterLevelProcessor(use_cache=False)
+            processor.process_station_data(raw_station("can_tho", n_points))
+            updates = [
+                raw_station("can_tho", n_points, end_ms=END_MS + (i + 1) * HOUR_MS)
+                for i in range(repeat + 1)
+            ]
+            return lambda: processor.process_station_data(updates.pop(0))
+        return setup
+    
+    def cached(n_points: int):
+        def setup():
+            processor = WaterLevelProcessor(use_cache=True)
+            raw = raw_station("can_tho", n_points)
+            processor.process_station_data(raw)
+            return lambda: processor.process_station_data(raw)
+        return setup
+    
+    for n_points in lengths:
+        cases.append((f"processor.process_station_data[cold,n={n_points}]", cold(n_points), repeat))
+        cases.append((f"processor.process_station_data[incremental,n={n_points}]", incremental(n_points), repeat))
+        cases.append((f"processor.process_station_data[cached,n={n_points}]", cached(n_points), repeat))
+    
+    def all_stations(count: int):
+        def setup():
+            station_ids = register_stations(count)
+            raw = {
+                station_id: raw_station(station_id, 720, index)
+                for index, station_id in enumerate(station_ids)
+            }
+            processors = [WaterLevelProcessor(use_cache=False) for _ in range(repeat + 1)]
+            return lambda: processors.pop().process_all_stations(raw)
+        return setup
+    
+    for count in station_counts:
+        cases.append((f"processor.process_all_stations[stations={count},n=720]", all_stations(count), repeat))
+    return cases
+
+
+# ============================================================================
+# STORAGE
+# ============================================================================
+
+def storage_cases(quick: bool, workdir: str) -> List[Case]:
+    from history_store import HistoricalStore
+    
+    repeat = 5 if quick else 15
+    sizes = (10_000, 100_000) if quick else (10_000, 100_000, 1_000_000)
+    n_stations = 10
+    cases: List[Case] = []
+    
+    def build_store(rows: int) -> HistoricalStore:
+        store = HistoricalStore(os.path.join(workdir, f"bench_store_{rows}.db"))
+        if store.count():
+            return store
+        per_station = rows // n_stations
+        for index, station_id in enumerate(register_stations(n_stations)):
+            rng = np.random.default_rng(42 + index)
+            timestamps = END_MS - np.arange(per_station - 1, -1, -1, dtype=np.int64) * HOUR_MS
+            levels = tide_levels((timestamps - END_MS) / HOUR_MS, index, rng)
+            store.upsert_rows(
+                (station_id, ts, level, None, None)
+                for ts, level in zip(timestamps.tolist(), levels.tolist())
+            )
+        return store
+    
+    for rows in sizes:
+        station_id = "bench_0005"
+        
+        def recent(rows=rows):
+            store = build_store(rows)
+            return lambda: store.read_recent(station_id, 100)
+        
+        def week(rows=rows):
+            store = build_store(rows)
+            start = END_MS - 30 * 24 * HOUR_MS
+            return lambda: store.read_range(station_id, start, start + 7 * 24 * HOUR_MS)
+        
+        def full_scan(rows=rows):
+            store = build_store(rows)
+            return lambda: sum(len(chunk) for chunk in store.iter_range(station_id))
+        
+        cases.append((f"storage.read_recent[rows={rows},limit=100]", recent, repeat))
+        cases.append((f"storage.read_range[rows={rows},week]", week, repeat))
+        cases.append((f"storage.iter_range[rows={rows},station]", full_scan, max(repeat // 3, 3)))
+    return cases
+
+
+# ============================================================================
+# API
+# ============================================================================
+
+def api_cases(quick: bool) -> List[Case]:
+    repeat = 20 if quick else 50
+    
+    def client_setup():
+        import app as app_module
+        from data_processor import WaterLevelProcessor
+        
+        # Snapshot và lịch sử của 5 trạm thật, dữ liệu 30 ngày theo giờ
+        station_ids = ["can_tho", "my_thuan", "vinh_long", "tan_chau", "chau_doc"]
+        raw = {
+            station_id: raw_station(station_id, 30 * 24, index)
+            for index, station_id in enumerate(station_ids)
+        }
+        processed = WaterLevelProcessor(use_cache=False).process_all_stations(raw)
+        scheduler = app_module.scheduler
+        scheduler.leader = None
+        scheduler.history_store.fencing = None
+        scheduler._save_latest_data(processed)
+        scheduler._save_historical_data(raw, processed)
+        app_module.tide_models.load()
+        return app_module.app.test_client()
+    
+    client_holder: Dict = {}
+    
+    def endpoint(path: str):
+        def setup():
+            if "client" not in client_holder:
+                client_holder["client"] = client_setup()
+            client = client_holder["client"]
+            
+            def call():
+                response = client.get(path)
+                body = response.get_data()
+                assert response.status_code == 200, (path, response.status_code)
+                return body
+            return call
+        return setup
+    
+    start = datetime.fromtimestamp(
+        (END_MS - 7 * 24 * HOUR_MS) / 1000, pytz.timezone(config.TIMEZONE)
+    ).strftime("%Y-%m-%dT%H:%M:%S")
+    paths = [
+        "/",
+        "/api/health",
+        "/api/stations",
+        "/api/latest",
+        "/api/stations/can_tho",
+        "/api/alerts",
+        "/api/status",
+        "/api/historical/can_tho?limit=100",
+        f"/api/historical/can_tho?start={start}",
+        "/api/forecast/can_tho?hours=72&step=60",
+        "/api/export/can_tho?format=ndjson",
+        "/api/export/can_tho?format=csv",
+        "/metrics"
+    ]
+    return [(f"api.GET {path}", endpoint(path), repeat) for path in paths]
+
+
+# ============================================================================
+# RUNNER
+# ============================================================================
+
+def measure(setup: Callable[[], Callable[[], object]], repeat: int) -> Dict:
+    func = setup()
+    func()  # warmup
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "repeat": repeat
+    }
+
+
+def load_baseline(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: Dict[str, Dict], quick: bool):
+    baseline = load_baseline(path)
+    baseline.setdefault("results", {}).update({
+        name: {"median": round(result["median"], 7), "min": round(result["min"], 7)}
+        for name, result in results.items()
+    })
+    baseline["machine"] = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "numpy": np.__version__
+    }
+    baseline["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    baseline["quick"] = quick
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, ensure_ascii=False, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--quick", action="store_true", help="Kích thước nhỏ, ít lần lặp")
+    parser.add_argument("--filter", default="", help="Chỉ chạy benchmark có tên chứa chuỗi này")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="File baseline JSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Tỉ lệ median/baseline tối đa trước khi coi là regression")
+    parser.add_argument("--update-baseline", action="store_true", help="Ghi kết quả lần này làm baseline")
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    isolate_data_dir(workdir)
+    # Log INFO của processor/scheduler làm nhiễu kết quả và màn hình
+    logging.disable(logging.INFO)
+    try:
+        cases = processor_cases(args.quick) + storage_cases(args.quick, workdir) + api_cases(args.quick)
+        cases = [case for case in cases if args.filter in case[0]]
+        
+        baseline = load_baseline(args.baseline).get("results", {})
+        results: Dict[str, Dict] = {}
+        regressions = []
+        
+        print(f"{'benchmark':<62} {'median':>10} {'min':>10} {'baseline':>10} {'ratio':>7}")
+        for name, setup, repeat in cases:
+            result = measure(setup, repeat)
+            results[name] = result
+            
+            reference = baseline.get(name, {}).get("median")
+            ratio = result["median"] / reference if reference else None
+            flag = ""
+            if ratio is not None and ratio > args.threshold:
+                regressions.append(name)
+                flag = "  ✗ REGRESSION"
+            print(
+                f"{name:<62} {result['median'] * 1000:>8.3f}ms {result['min'] * 1000:>8.3f}ms "
+                f"{(f'{reference * 1000:.3f}ms' if reference else '-'):>10} "
+                f"{(f'{ratio:.2f}x' if ratio is not None else '-'):>7}{flag}"
+            )
+        
+        if args.update_baseline:
+            save_baseline(args.baseline, results, args.quick)
+            print(f"\nĐã ghi baseline {len(results)} benchmark vào {args.baseline}")
+        elif regressions:
+            print(f"\n✗ {len(regressions)} benchmark chậm hơn baseline quá {args.threshold:.2f}x:")
+            for name in regressions:
+                print(f"  - {name}")
+            sys.exit(1)
+        else:
+            print(f"\n✓ Không có regression (ngưỡng {args.threshold:.2f}x)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ Cấu hình cho hệ thống giám sát mực nước sông Mekong
 Configuration for Mekong River water level monitoring system
 """
 
+import os
+
 # URL của trang MRC
 MRC_URL = "https://portal.mrcmekong.org/monitoring/river-monitoring-telemetry"
 
@@ -53,14 +55,129 @@ SELENIUM_CONFIG = {
     "page_load_timeout": 30
 }
 
+# Cấu hình phát hiện đỉnh triều
+PEAK_DETECTION = {
+    "min_prominence": 0.02,  # Độ nổi bật tối thiểu (mét) - lọc dao động do làm tròn 1 cm
+    "min_separation_hours": 3  # Khoảng cách tối thiểu giữa hai đỉnh cùng loại (giờ)
+}
+
+# Trạng thái streaming của từng trạm (xử lý tăng dần, chi phí O(số điểm mới))
+STREAMING_STATE = {
+    "window_points": 168,  # Số điểm giữ trong ring buffer mỗi trạm (7 ngày dữ liệu giờ)
+    "trend_window": 6,  # Số điểm gần nhất để tính xu hướng
+    "data_points_limit": 48  # Số điểm trả về trong data_points
+}
+
+# Xử lý theo lô nhiều trạm (khối dữ liệu dạng cột, tính toán vector hóa theo nhóm)
+BATCH_PROCESSING = {
+    "enabled": True,
+    "min_stations": 20,  # Dùng chế độ lô khi số trạm >= ngưỡng này
+    "process_pool_min_stations": 500,  # Chia cho process pool khi số trạm >= ngưỡng này
+    "process_pool_workers": None,  # None = số CPU
+    "process_pool_chunk_size": 200  # Số trạm mỗi lô gửi cho process con
+}
+
+# Cache kết quả xử lý theo nội dung dữ liệu thô (bỏ qua xử lý lại khi MRC chưa có dữ liệu mới)
+RESULT_CACHE = {
+    "enabled": True,
+    "max_entries": 256,  # Số kết quả tối đa giữ trong LRU
+    "file": "data/processed_cache.json"  # Lưu cache để dùng lại sau khi restart
+}
+
+# Mô hình thủy triều điều hòa (least-squares harmonic fit, hệ số cache theo trạm)
+TIDE_MODEL = {
+    "enabled": True,
+    "file": "data/tide_models.json",
+    "constituents": ["M2", "K1", "O1", "S2", "M4", "N2", "MS4", "Q1", "P1", "K2"],  # Thứ tự ưu tiên
+    "half_life_days": 30,  # Trọng số dữ liệu giảm một nửa sau mỗi 30 ngày (bám mùa lũ)
+    "rayleigh_factor": 1.0,  # Tiêu chuẩn Rayleigh để tách các thành phần gần tần số
+    "min_points": 24,  # Số điểm tối thiểu trước khi fit
+    "bootstrap_days": 30,  # Khi khởi động, fit lại từ lịch sử thô bao nhiêu ngày (≥ 15 ngày để tách M2/S2)
+    "default_horizon_hours": 72,
+    "max_horizon_hours": 720,
+    "default_step_minutes": 60,
+    "forecast_cache_size": 256  # Số đường dự báo giữ trong cache
+}
+
 # Cấu hình cập nhật dữ liệu
 UPDATE_INTERVAL = 3600  # Cập nhật mỗi 1 giờ (giây)
 
+# Pipeline cập nhật: scrape -> xử lý -> công bố chồng lấp nhau theo từng trạm
+UPDATE_PIPELINE = {
+    "enabled": True,
+    "queue_size": 4,  # Số trạm đã scrape tối đa chờ xử lý (giới hạn bộ nhớ khi xử lý chậm)
+    "put_timeout_seconds": 1.0  # Chu kỳ kiểm tra tín hiệu dừng khi hàng đợi đầy
+}
+
+# Bầu leader khi chạy nhiều replica: chỉ replica giữ lease mới scrape và ghi dữ liệu
+# (các replica phải dùng chung DATA_DIR, ví dụ một volume gắn vào mọi instance)
+LEADER_ELECTION = {
+    "enabled": True,
+    "db_file": "data/leader.db",
+    "name": "scheduler",
+    "lease_seconds": 15,  # Leader chết/treo thì follower lên thay sau tối đa ~lease + renew giây
+    "renew_interval_seconds": 5  # Leader gia hạn, follower thử chiếm lease mỗi 5 giây
+}
+
+# Sổ ghi các lượt cập nhật (thời gian từng bước/trạm, nguồn dữ liệu, kết quả)
+RUN_LEDGER = {
+    "file": "data/run_ledger.jsonl",
+    "max_records": 5000,  # Giữ 5000 lượt gần nhất
+    "compact_slack": 500,  # Viết lại file khi vượt quá max_records thêm 500 dòng
+    "summary_windows_hours": [1, 24, 168]  # Cửa sổ tính p50/p95/p99 trong /api/status
+}
+
+# Nhịp cập nhật thích ứng theo từng trạm (dựa trên mực nước và tốc độ thay đổi)
+ADAPTIVE_POLLING = {
+    "enabled": True,
+    "tick_seconds": 60,  # Chu kỳ kiểm tra trạm nào đến hạn cập nhật
+    "min_interval_seconds": 600,  # Nhịp nhanh nhất: 10 phút
+    "max_interval_seconds": 4 * 3600,  # Nhịp chậm nhất: 4 giờ
+    "warning_margin": 0.3,  # Cách ngưỡng cảnh báo dưới 0.3m thì dùng nhịp nhanh nhất
+    "rate_scale": 0.05,  # Mét/giờ: dưới mức này coi là ổn định; mỗi 5 cm/giờ rút ngắn thêm nhịp
+    "stable_growth": 1.5,  # Trạm ổn định: giãn nhịp 1.5 lần sau mỗi lần cập nhật
+    "lead_fraction": 0.25,  # Đang lên: cập nhật ít nhất 4 lần trước khi chạm ngưỡng cảnh báo
+    "batch_window_seconds": 300  # Gom các trạm sắp đến hạn trong 5 phút vào cùng một phiên scrape
+}
+
 # Cấu hình lưu trữ
 DATA_DIR = "data"
 LOGS_DIR = "logs"
 LATEST_DATA_FILE = "data/latest_water_levels.json"
-HISTORICAL_DATA_FILE = "data/historical_data.csv"
+HISTORICAL_DATA_FILE = "data/historical_data.csv"  # CSV cũ, chỉ dùng để migration
+HISTORICAL_DB_FILE = "data/historical.db"  # Store lịch sử SQLite (WAL)
+
+# Logging qua hàng đợi: một thread nền ghi console/file, request và scrape không chờ ghi đĩa
+LOGGING = {
+    "level": os.environ.get("LOG_LEVEL", "INFO"),
+    "format": os.environ.get("LOG_FORMAT", "text"),  # "text" hoặc "json" (mỗi dòng một object, gồm trường extra)
+    "queue_size": 10000,  # Hàng đợi đầy thì bỏ bản ghi mới thay vì chặn (metric mekong_log_records_dropped_total)
+    "max_bytes": 10 * 1024 * 1024,  # Xoay vòng file log khi vượt 10 MB
+    "backup_count": 5  # Số file cũ giữ lại (api.log.1 ... api.log.5)
+}
+
+# Lưu trữ lịch sử theo tầng: điểm thô -> min/max/mean theo giờ -> theo ngày (giữ vĩnh viễn)
+HISTORY_RETENTION = {
+    "raw_days": 30,  # Giữ điểm quan trắc thô trong 30 ngày
+    "hourly_days": 730,  # Giữ tầng theo giờ trong 2 năm, cũ hơn gộp theo ngày
+    "compaction_interval_seconds": 6 * 3600,  # Chu kỳ chạy job nén nền
+    "compaction_chunk_days": 7,  # Mỗi transaction nén tối đa 7 ngày dữ liệu của một trạm
+    "vacuum_pages_per_step": 1000  # Số trang trả lại cho hệ điều hành mỗi bước incremental_vacuum
+}
+
+# Kho lưu trữ Parquet dài hạn (cần pyarrow), phân vùng station_id=<id>/month=YYYY-MM
+PARQUET_ARCHIVE = {
+    "enabled": True,
+    "dir": "data/archive",
+    "row_group_size": 24 * 7 * 4,  # ~1 tuần điểm 15 phút mỗi row group (lọc theo thời gian trong tháng)
+    "compression": "zstd"
+}
+
+# Export lịch sử dạng stream (/api/export/<station_id>)
+EXPORT_STREAM = {
+    "chunk_size": 5000,  # Số bản ghi đọc từ store mỗi lần (giới hạn bộ nhớ của worker)
+    "gzip_level": 6  # Mức nén gzip khi client gửi Accept-Encoding: gzip
+}
 
 # Múi giờ
 TIMEZONE = "Asia/Ho_Chi_Minh"  # UTC+7
@@ -82,3 +199,86 @@ FALLBACK_APIS = {
 # Delay giữa các request (tuân thủ đạo đức web scraping)
 REQUEST_DELAY = 2  # Giây
 
+
+# Backfill dữ liệu lịch sử (python backfill.py)
+BACKFILL = {
+    "backend": "http",  # "http": endpoint JSON theo khoảng thời gian; "sample": dữ liệu mẫu để test
+    "http_url": "",  # URL mẫu, ví dụ ".../timeseries/{station_id}"; nhận params start/end (ISO 8601)
+    "http_timeout": 30,  # Giây
+    "chunk_hours": 24 * 7,  # Mỗi request lấy 7 ngày của một trạm
+    "workers": 4,  # Số request song song
+    "rate_per_second": 2.0,  # Giới hạn tốc độ chung cho mọi worker
+    "burst": 4,
+    "max_retries": 3,
+    "write_batch_points": 50000,  # Gom điểm của nhiều chunk rồi ghi một transaction
+    "checkpoint_file": "data/backfill_checkpoint.json",
+    "sample_interval_minutes": 60
+}
+
+
+# Profiling theo yêu cầu (mặc định tắt, không tốn chi phí)
+PROFILING = {
+    # Token cho header X-Profile / query ?profile=; để trống thì tắt profile request
+    "token": os.environ.get("PROFILE_TOKEN", ""),
+    # Profile N lượt cập nhật kế tiếp, ghi vào output_dir
+    "profile_next_runs": int(os.environ.get("PROFILE_NEXT_RUNS", "0")),
+    "output_dir": "data/profiles",
+    "text_top": 40,  # Số dòng của bảng pstats dạng text
+    "sample_interval_seconds": 0.001  # Chu kỳ lấy mẫu stack cho định dạng collapsed
+}
+
+
+# Cảnh báo: vùng trễ chống nhảy mức và nhật ký chuyển mức (/api/alerts/history)
+ALERTS = {
+    "db_file": "data/alerts.db",
+    "clear_margin_m": 0.05,  # Chỉ hạ mức khi mực nước xuống dưới ngưỡng của mức đang giữ ít nhất 5 cm
+    "min_hold_minutes": 60,  # Giữ mức tối thiểu 60 phút (theo thời điểm quan trắc) trước khi hạ
+    "retention_days": 365,  # Xóa chuyển mức cũ hơn
+    "history_limit": 100,  # Số chuyển mức mặc định mỗi lần gọi /api/alerts/history
+    "history_max_limit": 1000
+}
+
+# Webhook đẩy các lần chuyển mức cảnh báo tới hệ thống bên ngoài (outbox SQLite, gửi nền theo lô)
+WEBHOOKS = {
+    "enabled": True,  # Chạy dispatcher trên replica leader
+    "db_file": "data/webhooks.db",
+    "admin_token": os.environ.get("WEBHOOK_ADMIN_TOKEN", ""),  # Token cho /api/webhooks (để trống: tắt, dùng CLI)
+    "concurrency": 4,  # Số lô gửi song song tối đa
+    "batch_size": 50,  # Số chuyển mức tối đa trong một request
+    "timeout_seconds": 10,
+    "max_attempts": 12,  # Quá số lần này lô bị đánh dấu dead (xem lại qua GET /api/webhooks)
+    "backoff_base_seconds": 5,  # Lần thử lại thứ n chờ khoảng base * 2^(n-1) giây (có jitter)
+    "backoff_max_seconds": 1800,
+    "poll_interval_seconds": 5,  # Chu kỳ quét outbox khi không có chuyển mức mới
+    "fanout_batch": 500,  # Số chuyển mức đọc từ nhật ký mỗi lần đưa vào outbox
+    "dead_retention_days": 30  # Xóa bản ghi dead cũ hơn
+}
+
+# Delta cho /api/latest?since=<generation> (thế hệ = số lần scheduler ghi snapshot)
+LATEST_DELTA = {
+    "ring_size": 256,  # Số thế hệ gần nhất giữ tóm tắt trong bộ nhớ (vài chục byte mỗi trạm)
+    "cache_size": 64  # Số body delta đã serialize giữ lại cho thế hệ hiện tại
+}
+
+
+# Dữ liệu tổng hợp có seed để ước lượng quy mô triển khai (python synthetic_data.py)
+SYNTHETIC_DATA = {
+    "data_dir": "data/synthetic",  # Thư mục riêng, không ghi đè dữ liệu thật trong DATA_DIR
+    "seed": 7,
+    "stations": 300,
+    "days": 365,
+    "step_minutes": 60,  # Chu kỳ quan trắc
+    "write_batch_rows": 200000,  # Số dòng lịch sử mỗi transaction
+    "snapshot_hours": 24 * 7,  # Số giờ cuối đưa qua processor để tạo snapshot mới nhất
+    "noise_std": 0.02  # Độ lệch chuẩn nhiễu đo (mét)
+}
+
+# Load test API (python loadtest.py)
+LOAD_TEST = {
+    "url": "http://localhost:5000",
+    "mix": "dashboard",
+    "concurrency": 16,  # Số client đồng thời
+    "duration_seconds": 60,
+    "timeout_seconds": 30,
+    "hot_station_skew": 1.1  # Mũ phân bố Zipf: vài trạm được xem nhiều hơn hẳn
+}
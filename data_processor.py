@@ -3,20 +3,26 @@ Module xử lý dữ liệu mực nước
 Data processor for water level analysis and alert generation
 """
 
+import hashlib
+import json
 import logging
+import threading
 import pytz
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional
-import pandas as pd
 import numpy as np
 
 import config
+from log_setup import setup_logging
+from result_cache import ResultCache
+from station_batch import StationBatch
+from station_state import StationState
+from tide_model import TideModelStore
+from water_series import WaterLevelSeries, to_level
 
 # Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -25,10 +31,32 @@ class WaterLevelProcessor:
     Class xử lý và phân tích dữ liệu mực nước
     """
     
-    def __init__(self):
-        """Khởi tạo processor"""
+    def __init__(self, use_cache: bool = True):
+        """
+        Khởi tạo processor
+        
+        Args:
+            use_cache: Dùng cache kết quả theo nội dung (RESULT_CACHE)
+        """
         self.timezone = pytz.timezone(config.TIMEZONE)
         self.stations = config.STATIONS
+        
+        # Trạng thái streaming của từng trạm (ring buffer, thống kê, đỉnh triều)
+        self._states: Dict[str, StationState] = {}
+        self._states_lock = threading.Lock()
+        
+        # Cache kết quả theo hash nội dung dữ liệu thô + cấu hình ngưỡng
+        cache_config = config.RESULT_CACHE
+        self.result_cache = ResultCache(
+            max_entries=cache_config['max_entries'],
+            file_path=cache_config['file']
+        ) if cache_config['enabled'] and use_cache else None
+        self.last_cache_stats: Dict = {}
+        
+        # Mô hình triều điều hòa, tiếp tục cộng dồn từ file đã lưu
+        self.tide_models = TideModelStore(config.TIDE_MODEL) if config.TIDE_MODEL['enabled'] else None
+        if self.tide_models is not None:
+            self.tide_models.load()
     
     def process_station_data(self, raw_data: Dict) -> Dict:
         """
@@ -53,22 +81,123 @@ class WaterLevelProcessor:
             logger.warning(f"✗ Không có dữ liệu cho trạm {station_info['name']}")
             return {}
         
-        # Chuyển đổi dữ liệu sang DataFrame
-        df = self._convert_to_dataframe(data_points)
+        # Chuyển đổi dữ liệu sang chuỗi NumPy
+        series = self._convert_to_series(data_points)
         
-        if df.empty:
+        if not len(series):
             return {}
         
-        # Lấy thông tin hiện tại
-        current_level = df['water_level'].iloc[-1]
-        current_time = df['datetime'].iloc[-1]
+        state = self._get_state(station_id)
+        
+        with state.lock:
+            # Dữ liệu thô và trạng thái tích lũy không đổi (MRC chậm cập nhật) -> dùng lại kết quả
+            cache_key = self._cache_key(station_id, series.timestamps, series.levels, state.fingerprint())
+            cached = self._get_cached(cache_key)
+            if cached is not None:
+                logger.debug("✓ Dữ liệu trạm %s không đổi, dùng kết quả từ cache", station_info['name'],
+                             extra={"station_id": station_id})
+                return cached
+            
+            # Gộp các điểm mới vào trạng thái streaming của trạm
+            new_points = state.update(series)
+            logger.debug("✓ Đã gộp %d điểm mới vào trạng thái trạm %s", new_points, station_info['name'],
+                         extra={"station_id": station_id})
+            
+            if self.tide_models is not None:
+                self.tide_models.update(station_id, series)
+            
+            current_ms, current_level = state.latest()
+            peaks_high, peaks_low = state.peaks()
+            slope = state.trend_slope()
+            running_stats = state.statistics()
+            recent = state.window(config.STREAMING_STATE['data_points_limit'])
+            
+            # Gộp lại cùng cửa sổ vào trạng thái mới không thêm điểm nào, nên kết quả này cũng
+            # đúng cho lần gọi sau với cùng dữ liệu thô
+            settled_key = (
+                self._cache_key(station_id, series.timestamps, series.levels, state.fingerprint())
+                if new_points else None
+            )
+        
+        result = self._build_result(
+            station_id,
+            current_ms,
+            current_level,
+            peaks_high,
+            peaks_low,
+            slope,
+            running_stats,
+            self._format_data_points(recent)
+        )
+        self._put_cached(cache_key, result)
+        self._put_cached(settled_key, result)
+        
+        return result
+    
+    def _cache_key(self, station_id: str, timestamps: np.ndarray, levels: np.ndarray,
+                   state_fingerprint: bytes = b"batch") -> Optional[str]:
+        """
+        Hash nội dung chuỗi đã chuẩn hóa của trạm cùng cấu hình ảnh hưởng tới kết quả
+        
+        Chế độ streaming truyền state_fingerprint của StationState trước khi gộp: thống kê
+        và đỉnh phụ thuộc cả lịch sử đã tích lũy, không chỉ cửa sổ hiện tại. Chế độ theo lô
+        tính trên đúng cửa sổ nên dùng định danh cố định "batch".
+        """
+        if self.result_cache is None:
+            return None
+        
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self._config_fingerprint(station_id))
+        digest.update(state_fingerprint)
+        digest.update(np.ascontiguousarray(timestamps, dtype=np.int64).tobytes())
+        digest.update(np.ascontiguousarray(levels, dtype=np.float32).tobytes())
+        return digest.hexdigest()
+    
+    def _config_fingerprint(self, station_id: str) -> bytes:
+        return json.dumps(
+            [
+                station_id,
+                self.stations[station_id],
+                config.PEAK_DETECTION,
+                config.STREAMING_STATE
+            ],
+            sort_keys=True,
+            ensure_ascii=False
+        ).encode('utf-8')
+    
+    def _get_cached(self, cache_key: Optional[str]) -> Optional[Dict]:
+        """
+        Lấy kết quả từ cache, tính lại các trường phụ thuộc thời điểm hiện tại
+        """
+        if cache_key is None:
+            return None
+        
+        cached = self.result_cache.get(cache_key)
+        if cached is None:
+            return None
+        
+        return {**cached, "last_updated": datetime.now(self.timezone).isoformat()}
+    
+    def _put_cached(self, cache_key: Optional[str], result: Dict):
+        if cache_key is not None:
+            self.result_cache.put(cache_key, result)
+    
+    def _build_result(self, station_id: str, current_ms: int, current_level: float,
+                      peaks_high: WaterLevelSeries, peaks_low: WaterLevelSeries,
+                      slope: Optional[float], running_stats: Dict[str, float],
+                      data_points: List[Dict]) -> Dict:
+        """
+        Tạo dict kết quả của một trạm từ các đại lượng đã tính
+        """
+        station_info = self.stations[station_id]
         
-        # Tính toán đỉnh triều
-        peaks_high, peaks_low = self._find_tide_peaks(df)
+        # Lấy thông tin hiện tại
+        current_level = to_level(current_level)
+        current_time = self._to_datetime(current_ms)
         
         # Dự báo đỉnh triều tiếp theo
-        next_high_tide = self._predict_next_peak(df, peaks_high, peak_type='high')
-        next_low_tide = self._predict_next_peak(df, peaks_low, peak_type='low')
+        next_high_tide = self._predict_next_peak(peaks_high, peak_type='high')
+        next_low_tide = self._predict_next_peak(peaks_low, peak_type='low')
         
         # Kiểm tra cảnh báo
         alert_level, alert_message = self._check_alert(
@@ -77,10 +206,10 @@ class WaterLevelProcessor:
         )
         
         # Tính toán xu hướng
-        trend = self._calculate_trend(df)
+        trend = self._calculate_trend(slope)
         
         # Thống kê
-        stats = self._calculate_statistics(df)
+        stats = self._calculate_statistics(running_stats)
         
         return {
             "station_id": station_id,
@@ -105,96 +234,67 @@ class WaterLevelProcessor:
             },
             "trend": trend,
             "statistics": stats,
-            "data_points": self._format_data_points(df),
+            "data_points": data_points,
             "last_updated": datetime.now(self.timezone).isoformat()
         }
     
-    def _convert_to_dataframe(self, data_points: List[Dict]) -> pd.DataFrame:
+    def _convert_to_series(self, data_points: List[Dict]) -> WaterLevelSeries:
         """
-        Chuyển đổi data points thành DataFrame với timezone
+        Chuyển đổi data points thành chuỗi NumPy (epoch ms int64 + mực nước float32)
         """
         try:
-            df = pd.DataFrame(data_points)
-            
-            # Chuyển timestamp (milliseconds) sang datetime
-            df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-            
-            # Chuyển sang múi giờ Việt Nam (UTC+7)
-            df['datetime'] = df['datetime'].dt.tz_localize('UTC').dt.tz_convert(self.timezone)
-            
-            # Đổi tên cột value thành water_level
-            df['water_level'] = df['value']
-            
-            # Sắp xếp theo thời gian
-            df = df.sort_values('datetime').reset_index(drop=True)
-            
-            logger.info(f"✓ Đã chuyển đổi {len(df)} điểm dữ liệu")
-            return df
+            series = WaterLevelSeries.from_points(data_points)
+            logger.debug("✓ Đã chuyển đổi %d điểm dữ liệu", len(series))
+            return series
             
         except Exception as e:
-            logger.error(f"✗ Lỗi khi chuyển đổi DataFrame: {str(e)}")
-            return pd.DataFrame()
+            logger.error(f"✗ Lỗi khi chuyển đổi dữ liệu: {str(e)}")
+            return WaterLevelSeries.empty()
     
-    def _find_tide_peaks(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    def _get_state(self, station_id: str) -> StationState:
         """
-        Tìm các đỉnh triều cao và thấp
-        
-        Returns:
-            Tuple (peaks_high, peaks_low) - DataFrame chứa các đỉnh
+        Lấy (hoặc tạo mới) trạng thái streaming của một trạm
         """
-        try:
-            water_levels = df['water_level'].values
-            
-            # Tìm local maxima (đỉnh cao)
-            peaks_high_idx = []
-            for i in range(1, len(water_levels) - 1):
-                if water_levels[i] > water_levels[i-1] and water_levels[i] > water_levels[i+1]:
-                    peaks_high_idx.append(i)
-            
-            # Tìm local minima (đỉnh thấp)
-            peaks_low_idx = []
-            for i in range(1, len(water_levels) - 1):
-                if water_levels[i] < water_levels[i-1] and water_levels[i] < water_levels[i+1]:
-                    peaks_low_idx.append(i)
-            
-            peaks_high = df.iloc[peaks_high_idx] if peaks_high_idx else pd.DataFrame()
-            peaks_low = df.iloc[peaks_low_idx] if peaks_low_idx else pd.DataFrame()
-            
-            logger.info(f"✓ Tìm thấy {len(peaks_high)} đỉnh cao và {len(peaks_low)} đỉnh thấp")
-            
-            return peaks_high, peaks_low
-            
-        except Exception as e:
-            logger.error(f"✗ Lỗi khi tìm đỉnh triều: {str(e)}")
-            return pd.DataFrame(), pd.DataFrame()
+        with self._states_lock:
+            state = self._states.get(station_id)
+            if state is None:
+                state_config = config.STREAMING_STATE
+                peak_config = config.PEAK_DETECTION
+                state = StationState(
+                    capacity=state_config['window_points'],
+                    trend_window=state_config['trend_window'],
+                    min_prominence=peak_config['min_prominence'],
+                    min_separation=peak_config['min_separation_hours'] * 3600 * 1000
+                )
+                self._states[station_id] = state
+            return state
+    
+    def _to_datetime(self, timestamp_ms: int) -> datetime:
+        """
+        Chuyển epoch milliseconds sang datetime theo múi giờ Việt Nam
+        """
+        return datetime.fromtimestamp(timestamp_ms / 1000, tz=pytz.utc).astimezone(self.timezone)
     
-    def _predict_next_peak(self, df: pd.DataFrame, peaks: pd.DataFrame, peak_type: str) -> Optional[Dict]:
+    def _predict_next_peak(self, peaks: WaterLevelSeries, peak_type: str) -> Optional[Dict]:
         """
         Dự báo đỉnh triều tiếp theo dựa trên chu kỳ
         
         Args:
-            df: DataFrame chứa dữ liệu
-            peaks: DataFrame chứa các đỉnh đã tìm được
+            peaks: Chuỗi các đỉnh đã tìm được
             peak_type: 'high' hoặc 'low'
         """
-        if peaks.empty or len(peaks) < 2:
+        if len(peaks) < 2:
             return None
         
         try:
-            # Tính chu kỳ trung bình giữa các đỉnh (trong giờ)
-            time_diffs = peaks['datetime'].diff().dropna()
-            avg_cycle = time_diffs.mean()
-            
-            # Đỉnh gần nhất
-            last_peak = peaks.iloc[-1]
-            last_peak_time = last_peak['datetime']
-            last_peak_level = last_peak['water_level']
+            # Tính chu kỳ trung bình giữa các đỉnh
+            avg_cycle_ms = float(np.diff(peaks.timestamps).mean())
             
             # Dự báo thời gian đỉnh tiếp theo
-            next_peak_time = last_peak_time + avg_cycle
+            next_peak_time = self._to_datetime(int(peaks.timestamps[-1] + avg_cycle_ms))
             
             # Dự báo mực nước (trung bình của các đỉnh gần đây)
-            recent_peaks_level = peaks['water_level'].tail(3).mean()
+            recent_peaks_level = peaks.levels[-3:].astype(np.float64).mean()
             
             return {
                 "time": next_peak_time.isoformat(),
@@ -239,23 +339,17 @@ class WaterLevelProcessor:
                 f"(còn {distance_to_warning:.2f}m tới ngưỡng cảnh báo)."
             )
     
-    def _calculate_trend(self, df: pd.DataFrame) -> Dict:
+    def _calculate_trend(self, slope: Optional[float]) -> Dict:
         """
         Tính toán xu hướng mực nước (đang lên hay xuống)
+        
+        Args:
+            slope: Độ dốc hồi quy trên các điểm gần nhất (mét/giờ), None nếu chưa đủ dữ liệu
         """
         try:
-            # Lấy 6 giờ gần nhất
-            recent_df = df.tail(6)
-            
-            if len(recent_df) < 2:
+            if slope is None or np.isnan(slope):
                 return {"direction": "unknown", "rate": 0}
             
-            # Tính độ dốc (slope) bằng linear regression đơn giản
-            x = np.arange(len(recent_df))
-            y = recent_df['water_level'].values
-            
-            slope = np.polyfit(x, y, 1)[0]
-            
             # Phân loại xu hướng
             if slope > 0.05:
                 direction = "rising"
@@ -278,39 +372,22 @@ class WaterLevelProcessor:
             logger.error(f"✗ Lỗi khi tính xu hướng: {str(e)}")
             return {"direction": "unknown", "rate": 0}
     
-    def _calculate_statistics(self, df: pd.DataFrame) -> Dict:
+    def _calculate_statistics(self, running_stats: Dict[str, float]) -> Dict:
         """
-        Tính toán thống kê cơ bản
+        Làm tròn thống kê tích lũy (max, min, mean, std, range) của trạm
         """
         try:
-            return {
-                "max": round(float(df['water_level'].max()), 2),
-                "min": round(float(df['water_level'].min()), 2),
-                "mean": round(float(df['water_level'].mean()), 2),
-                "std": round(float(df['water_level'].std()), 2),
-                "range": round(float(df['water_level'].max() - df['water_level'].min()), 2)
-            }
+            return {key: round(float(value), 2) for key, value in running_stats.items()}
         except Exception as e:
             logger.error(f"✗ Lỗi khi tính thống kê: {str(e)}")
             return {}
     
-    def _format_data_points(self, df: pd.DataFrame, limit: int = 48) -> List[Dict]:
+    def _format_data_points(self, series: WaterLevelSeries) -> List[Dict]:
         """
-        Format data points để trả về API (giới hạn số lượng)
+        Format data points để trả về API (timestamp được format theo lô)
         """
         try:
-            # Lấy tối đa limit điểm gần nhất
-            df_limited = df.tail(limit)
-            
-            points = []
-            for _, row in df_limited.iterrows():
-                points.append({
-                    "timestamp": int(row['datetime'].timestamp() * 1000),
-                    "datetime": row['datetime'].isoformat(),
-                    "water_level": round(float(row['water_level']), 2)
-                })
-            
-            return points
+            return series.to_points(self.timezone)
             
         except Exception as e:
             logger.error(f"✗ Lỗi khi format data points: {str(e)}")
@@ -326,39 +403,263 @@ class WaterLevelProcessor:
         """
         Xử lý dữ liệu cho tất cả các trạm
         
+        Khi số trạm đạt ngưỡng BATCH_PROCESSING['min_stations'], dữ liệu được xử lý
+        theo lô trên một khối dạng cột thay vì từng trạm một. Khác biệt của chế độ lô:
+        thống kê, xu hướng và đỉnh triều trong kết quả tính trên đúng cửa sổ dữ liệu thô
+        vừa scrape (không phải ring buffer STREAMING_STATE['window_points'] điểm và các đỉnh
+        đã xác nhận từ các lượt trước). Sau khi tính, cửa sổ của từng trạm vẫn được gộp vào
+        StationState, nên ring buffer, đỉnh, xu hướng và mô hình triều tiếp tục tích lũy và
+        lượt chạy theo từng trạm kế tiếp dùng trạng thái đầy đủ.
+        
         Args:
             raw_data_dict: Dict chứa dữ liệu thô của tất cả các trạm
             
         Returns:
             Dict chứa dữ liệu đã xử lý của tất cả các trạm
         """
+        self.begin_run()
+        
+        if self.uses_batch(len(raw_data_dict)):
+            processed_data = self._process_all_batched(raw_data_dict)
+            self._advance_states(raw_data_dict)
+        else:
+            processed_data = self._process_all_sequential(raw_data_dict)
+        
+        self.finish_run()
+        
+        return processed_data
+    
+    def _advance_states(self, raw_data_dict: Dict[str, Dict]):
+        """
+        Gộp cửa sổ dữ liệu thô của từng trạm vào StationState sau khi xử lý theo lô, để
+        trạng thái streaming không bị bỏ qua khi lượt chạy chuyển sang chế độ lô
+        """
+        for station_id, raw_data in raw_data_dict.items():
+            if station_id not in self.stations:
+                continue
+            series = self._convert_to_series(raw_data.get('raw_data', {}).get('data', []))
+            if not len(series):
+                continue
+            state = self._get_state(station_id)
+            with state.lock:
+                state.update(series)
+    
+    @staticmethod
+    def uses_batch(station_count: int) -> bool:
+        """Số trạm của lượt này đủ lớn để xử lý theo lô (BATCH_PROCESSING['min_stations'])"""
+        batch_config = config.BATCH_PROCESSING
+        return batch_config['enabled'] and station_count >= batch_config['min_stations']
+    
+    def begin_run(self):
+        """
+        Bắt đầu một lượt cập nhật (đặt lại thống kê cache); dùng cùng finish_run khi
+        gọi process_station_data lần lượt từng trạm, ví dụ trong pipeline của scheduler
+        """
+        if self.result_cache is not None:
+            self.result_cache.reset_stats()
+    
+    def finish_run(self):
+        """
+        Kết thúc một lượt cập nhật: ghi nhận thống kê cache, lưu cache và mô hình triều
+        """
+        self._report_cache_stats()
+        
+        if self.tide_models is not None:
+            self.tide_models.save()
+    
+    def _process_all_sequential(self, raw_data_dict: Dict[str, Dict]) -> Dict[str, Dict]:
+        """
+        Xử lý lần lượt từng trạm trên trạng thái streaming
+        """
         processed_data = {}
         
         for station_id, raw_data in raw_data_dict.items():
-            logger.info(f"\nĐang xử lý dữ liệu trạm: {self.stations[station_id]['name']}")
+            logger.debug("Đang xử lý dữ liệu trạm: %s", self.stations[station_id]['name'])
             
             processed = self.process_station_data(raw_data)
             if processed:
                 processed_data[station_id] = processed
                 
-                # Log thông tin cảnh báo
+                # Log thông tin cảnh báo (trạm bình thường chỉ ở mức DEBUG)
                 alert = processed.get('alert', {})
-                logger.info(f"  → {alert.get('message', 'N/A')}")
+                logger.log(
+                    logging.DEBUG if alert.get('level') == 'NORMAL' else logging.INFO,
+                    "  → %s", alert.get('message', 'N/A'),
+                    extra={"station_id": station_id, "alert_level": alert.get('level')}
+                )
+        
+        return processed_data
+    
+    def _report_cache_stats(self):
+        """
+        Ghi nhận tỉ lệ hit cache của lần chạy và lưu cache xuống đĩa
+        """
+        if self.result_cache is None:
+            self.last_cache_stats = {}
+            return
+        
+        self.last_cache_stats = self.result_cache.stats()
+        self.result_cache.save()
+        
+        stats = self.last_cache_stats
+        logger.info(f"✓ Cache kết quả: {stats['hits']} hit / {stats['misses']} miss "
+                    f"(tỉ lệ hit {stats['hit_rate']:.0%})")
+    
+    def process_stations_batched(self, raw_data_dict: Dict[str, Dict]) -> Dict[str, Dict]:
+        """
+        Xử lý nhiều trạm theo lô: ghép toàn bộ điểm thành một khối dạng cột và tính
+        thống kê, xu hướng, đỉnh triều bằng các phép toán vector hóa theo nhóm
+        
+        Chế độ này không dùng trạng thái streaming: mỗi trạm được tính trên đúng cửa sổ
+        dữ liệu thô nhận được (phù hợp cho mạng trạm lớn, backfill và backtest).
+        """
+        invalid = [station_id for station_id in raw_data_dict if station_id not in self.stations]
+        if invalid:
+            logger.error(f"✗ Station ID không hợp lệ: {', '.join(invalid)}")
+        
+        batch = self._convert_to_batch({
+            station_id: raw_data for station_id, raw_data in raw_data_dict.items()
+            if station_id in self.stations
+        })
+        if not len(batch):
+            return {}
+        
+        peak_config = config.PEAK_DETECTION
+        state_config = config.STREAMING_STATE
+        
+        latest_times, latest_levels = batch.latest()
+        running_stats = batch.statistics()
+        slopes = batch.trend_slopes(state_config['trend_window'])
+        high_idx, low_idx = batch.peaks(
+            peak_config['min_prominence'],
+            peak_config['min_separation_hours'] * 3600 * 1000
+        )
+        peaks_high = batch.split(high_idx)
+        peaks_low = batch.split(low_idx)
+        
+        # Format data points của mọi trạm trong một lần
+        tail = batch.tail_indices(state_config['data_points_limit'])
+        all_points = WaterLevelSeries(batch.timestamps[tail], batch.levels[tail]).to_points(self.timezone)
+        bounds = np.searchsorted(tail, batch.offsets).tolist()
+        
+        processed_data = {}
+        for i, station_id in enumerate(batch.station_ids):
+            start, end = batch.offsets[i], batch.offsets[i + 1]
+            cache_key = self._cache_key(station_id, batch.timestamps[start:end], batch.levels[start:end])
+            cached = self._get_cached(cache_key)
+            if cached is not None:
+                processed_data[station_id] = cached
+                continue
+            
+            if self.tide_models is not None:
+                self.tide_models.update(
+                    station_id,
+                    WaterLevelSeries(batch.timestamps[start:end], batch.levels[start:end])
+                )
+            
+            processed_data[station_id] = self._build_result(
+                station_id,
+                int(latest_times[i]),
+                float(latest_levels[i]),
+                peaks_high[i],
+                peaks_low[i],
+                float(slopes[i]),
+                {key: values[i] for key, values in running_stats.items()},
+                all_points[bounds[i]:bounds[i + 1]]
+            )
+            self._put_cached(cache_key, processed_data[station_id])
+        
+        alerts = sum(1 for data in processed_data.values() if data['alert']['level'] != 'NORMAL')
+        logger.info(f"✓ Đã xử lý theo lô {len(processed_data)} trạm ({len(batch.timestamps)} điểm), "
+                    f"{alerts} trạm có cảnh báo")
+        
+        return processed_data
+    
+    def _convert_to_batch(self, raw_data_dict: Dict[str, Dict]) -> StationBatch:
+        """
+        Ghép dữ liệu thô của nhiều trạm thành khối dạng cột
+        """
+        try:
+            return StationBatch.from_raw(raw_data_dict)
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi ghép dữ liệu theo lô: {str(e)}")
+            return StationBatch.from_raw({})
+    
+    def _process_all_batched(self, raw_data_dict: Dict[str, Dict]) -> Dict[str, Dict]:
+        """
+        Xử lý theo lô, chia cho process pool khi số trạm rất lớn
+        """
+        batch_config = config.BATCH_PROCESSING
+        workers = batch_config['process_pool_workers']
+        
+        if len(raw_data_dict) < batch_config['process_pool_min_stations'] or workers == 1:
+            return self.process_stations_batched(raw_data_dict)
+        
+        station_ids = list(raw_data_dict.keys())
+        chunk_size = batch_config['process_pool_chunk_size']
+        chunks = [
+            {station_id: raw_data_dict[station_id] for station_id in station_ids[i:i + chunk_size]}
+            for i in range(0, len(station_ids), chunk_size)
+        ]
+        logger.info(f"Xử lý {len(station_ids)} trạm bằng process pool ({len(chunks)} lô)")
+        
+        # Process con cập nhật mô hình triều trên bản sao trạng thái rồi trả về cho process cha
+        model_states = [
+            self.tide_models.export_models(chunk) if self.tide_models is not None else None
+            for chunk in chunks
+        ]
+        
+        processed_data = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_result, chunk_models in executor.map(_process_batch_chunk, chunks, model_states):
+                processed_data.update(chunk_result)
+                if chunk_models:
+                    self.tide_models.import_models(chunk_models)
         
         return processed_data
 
 
+def _process_batch_chunk(raw_chunk: Dict[str, Dict],
+                         model_states: Optional[Dict[str, Dict]]) -> Tuple[Dict[str, Dict], Optional[Dict[str, Dict]]]:
+    """
+    Xử lý một lô trạm trong process con (phải ở cấp module để pickle được)
+    
+    Args:
+        model_states: Trạng thái mô hình triều hiện tại của các trạm trong lô (None nếu tắt)
+        
+    Returns:
+        (kết quả đã xử lý, trạng thái mô hình triều sau cập nhật để process cha nạp lại)
+    """
+    processor = WaterLevelProcessor(use_cache=False)
+    if model_states is None:
+        processor.tide_models = None
+        return processor.process_stations_batched(raw_chunk), None
+    
+    # Không đọc file mô hình: process cha có thể đang giữ trạng thái mới hơn file
+    processor.tide_models = TideModelStore(config.TIDE_MODEL)
+    processor.tide_models.import_models(model_states)
+    processed = processor.process_stations_batched(raw_chunk)
+    return processed, processor.tide_models.export_models(raw_chunk)
+
+
 def test_processor():
     """
     Hàm test data processor
     """
     import json
     from mrc_scraper import MRCWaterLevelScraper
+    from peak_detection import find_tide_extrema
     
     print("="*60)
     print("TESTING WATER LEVEL DATA PROCESSOR")
     print("="*60)
     
+    # Đỉnh sát nhau theo chuỗi a > b > c (a-b, b-c gần hơn min_separation, a-c đủ xa):
+    # b bị loại bởi a nên c phải được giữ
+    high_idx, _ = find_tide_extrema(np.array([0.0, 3.0, 0.0, 0.0, 2.0, 0.0, 0.0, 1.0, 0.0]), min_separation=4)
+    assert high_idx.tolist() == [1, 7], high_idx
+    print("✓ Giãn cách đỉnh theo thứ tự ưu tiên (chuỗi a > b > c)")
+    
     # Scrape dữ liệu
     scraper = MRCWaterLevelScraper()
     raw_data = scraper.scrape_all_stations()
@@ -0,0 +1,723 @@
+"""
+Module lưu trữ dữ liệu lịch sử mực nước bằng SQLite (WAL)
+Embedded SQLite time-series store for historical water levels
+
+Chạy migration từ CSV cũ:
+    python history_store.py migrate [đường_dẫn_csv]
+"""
+
+import csv
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pytz
+
+import config
+from log_setup import setup_logging
+from water_series import WaterLevelSeries, format_iso_timestamps, to_level
+
+logger = logging.getLogger(__name__)
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS water_levels (
+    station_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,        -- Thời điểm quan trắc (epoch ms, UTC)
+    water_level REAL NOT NULL,
+    alert_level TEXT,
+    trend_direction TEXT,
+    recorded_at INTEGER NOT NULL,      -- Thời điểm ghi vào store (epoch ms)
+    PRIMARY KEY (station_id, timestamp)
+) WITHOUT ROWID;
+
+-- Watermark export Parquet: tìm điểm thay đổi mà không quét cả bảng
+CREATE INDEX IF NOT EXISTS idx_water_levels_recorded_at ON water_levels (recorded_at);
+
+-- Tầng gộp: timestamp là thời điểm bắt đầu bucket (epoch ms)
+CREATE TABLE IF NOT EXISTS water_levels_hourly (
+    station_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    min_level REAL NOT NULL,
+    max_level REAL NOT NULL,
+    mean_level REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    PRIMARY KEY (station_id, timestamp)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS water_levels_daily (
+    station_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    min_level REAL NOT NULL,
+    max_level REAL NOT NULL,
+    mean_level REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    PRIMARY KEY (station_id, timestamp)
+) WITHOUT ROWID;
+
+-- Mốc nén của từng trạm/tầng: dữ liệu của tầng trước cutoff đã được gộp sang tầng kế tiếp,
+-- truy vấn chỉ đọc tầng này từ cutoff trở đi (dòng cũ hơn ghi muộn không che tầng thô hơn)
+CREATE TABLE IF NOT EXISTS tier_cutoffs (
+    station_id TEXT NOT NULL,
+    tier TEXT NOT NULL,
+    cutoff INTEGER NOT NULL,
+    PRIMARY KEY (station_id, tier)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Upsert theo (station_id, timestamp): bản ghi mới nhất thắng khi MRC sửa số liệu.
+# Điểm quan trắc thô không có alert/trend nên giữ giá trị đã có (COALESCE); dòng không
+# thay đổi bị bỏ qua (WHERE) nên cửa sổ dữ liệu chồng lấn giữa các lần chạy không sinh ghi.
+UPSERT_SQL = """
+INSERT INTO water_levels (station_id, timestamp, water_level, alert_level, trend_direction, recorded_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (station_id, timestamp) DO UPDATE SET
+    water_level = excluded.water_level,
+    alert_level = COALESCE(excluded.alert_level, water_levels.alert_level),
+    trend_direction = COALESCE(excluded.trend_direction, water_levels.trend_direction),
+    recorded_at = excluded.recorded_at
+WHERE water_levels.water_level != excluded.water_level
+   OR water_levels.alert_level IS NOT COALESCE(excluded.alert_level, water_levels.alert_level)
+   OR water_levels.trend_direction IS NOT COALESCE(excluded.trend_direction, water_levels.trend_direction)
+"""
+
+# Gắn cảnh báo/xu hướng cho điểm hiện tại; mực nước chỉ dùng khi điểm chưa có trong store
+# (giá trị trong kết quả xử lý đã làm tròn nên không ghi đè số liệu quan trắc gốc)
+ANNOTATE_SQL = """
+INSERT INTO water_levels (station_id, timestamp, water_level, alert_level, trend_direction, recorded_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (station_id, timestamp) DO UPDATE SET
+    alert_level = excluded.alert_level,
+    trend_direction = excluded.trend_direction,
+    recorded_at = excluded.recorded_at
+WHERE water_levels.alert_level IS NOT excluded.alert_level
+   OR water_levels.trend_direction IS NOT excluded.trend_direction
+"""
+
+# Gộp bucket mới vào bucket đã có (dữ liệu đến muộn): mean theo trọng số số mẫu
+_MERGE_AGGREGATE = """
+ON CONFLICT (station_id, timestamp) DO UPDATE SET
+    min_level = MIN({table}.min_level, excluded.min_level),
+    max_level = MAX({table}.max_level, excluded.max_level),
+    mean_level = ({table}.mean_level * {table}.samples + excluded.mean_level * excluded.samples)
+                 / ({table}.samples + excluded.samples),
+    samples = {table}.samples + excluded.samples
+"""
+
+# Nguồn dữ liệu không phải quan trắc thật (mrc_scraper sinh khi scrape lỗi): không ghi vào lịch sử
+SAMPLE_SOURCES = frozenset({"sample"})
+
+# Tham số: (offset múi giờ, offset, station_id, từ, đến)
+ROLLUP_RAW_SQL = """
+INSERT INTO water_levels_hourly (station_id, timestamp, min_level, max_level, mean_level, samples)
+SELECT station_id, ((timestamp + ?) / {bucket}) * {bucket} - ?,
+       MIN(water_level), MAX(water_level), AVG(water_level), COUNT(*)
+FROM water_levels
+WHERE station_id = ? AND timestamp >= ? AND timestamp < ?
+GROUP BY 1, 2
+""".format(bucket=HOUR_MS) + _MERGE_AGGREGATE.format(table="water_levels_hourly")
+
+ROLLUP_HOURLY_SQL = """
+INSERT INTO water_levels_daily (station_id, timestamp, min_level, max_level, mean_level, samples)
+SELECT station_id, ((timestamp + ?) / {bucket}) * {bucket} - ?,
+       MIN(min_level), MAX(max_level), SUM(mean_level * samples) / SUM(samples), SUM(samples)
+FROM water_levels_hourly
+WHERE station_id = ? AND timestamp >= ? AND timestamp < ?
+GROUP BY 1, 2
+""".format(bucket=DAY_MS) + _MERGE_AGGREGATE.format(table="water_levels_daily")
+
+# Các tầng từ mịn đến thô: (tên, bảng, độ rộng bucket ms)
+TIERS = (
+    ("raw", "water_levels", 0),
+    ("hourly", "water_levels_hourly", HOUR_MS),
+    ("daily", "water_levels_daily", DAY_MS),
+)
+
+_MIN_MS = -2 ** 62
+_MAX_MS = 2 ** 62
+
+# Một dòng lịch sử: (station_id, timestamp_ms, water_level, alert_level, trend_direction)
+HistoryRow = Tuple[str, int, float, Optional[str], Optional[str]]
+
+
+class HistoricalStore:
+    """
+    Store lịch sử dạng time-series trên SQLite ở chế độ WAL
+    
+    - Khóa chính (station_id, timestamp) -> không trùng lặp, đọc theo trạm dùng index
+    - Ghi theo lô trong một transaction (scheduler), nhiều reader đồng thời (API workers)
+    - Mỗi thread dùng một connection riêng
+    - Dữ liệu cũ được nén dần xuống tầng theo giờ/theo ngày (compact), truy vấn tự ghép các tầng
+    """
+    
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or config.HISTORICAL_DB_FILE
+        self.timezone = pytz.timezone(config.TIMEZONE)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        # LeaderElector khi chạy nhiều replica: mọi transaction ghi kiểm tra fencing token
+        self.fencing = None
+        
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+    
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            # auto_vacuum chỉ có hiệu lực với file DB mới, phải đặt trước journal_mode
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        if self.fencing is not None and not getattr(self._local, 'fenced', False):
+            self.fencing.attach(conn)
+            self._local.fenced = True
+        return conn
+    
+    def _begin_write(self, conn: sqlite3.Connection):
+        """
+        BEGIN IMMEDIATE rồi kiểm tra fencing token trong cùng transaction: leader cũ bị
+        từ chối (FencingError) ngay tại lúc ghi, không chỉ ở lần kiểm tra trước đó
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        if self.fencing is not None:
+            try:
+                self.fencing.assert_fencing(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    
+    def upsert_rows(self, rows: Iterable[HistoryRow]) -> int:
+        """
+        Ghi một lô dòng trong một transaction
+        
+        Returns:
+            Số dòng thực sự được thêm mới hoặc thay đổi
+        """
+        return self._write_batch(UPSERT_SQL, rows)
+    
+    def _write_batch(self, sql: str, rows: Iterable[HistoryRow]) -> int:
+        rows = list(rows)
+        if not rows:
+            return 0
+        
+        conn = self._connection()
+        with self._write_lock:
+            # recorded_at lấy trong lock nên tăng theo thứ tự commit (dùng làm watermark export)
+            recorded_at = int(time.time() * 1000)
+            params = [row + (recorded_at,) for row in rows]
+            changes_before = conn.total_changes
+            self._begin_write(conn)
+            try:
+                conn.executemany(sql, params)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return conn.total_changes - changes_before
+    
+    def upsert_observations(self, raw_data_dict: Dict[str, Dict]) -> int:
+        """
+        Ghi toàn bộ điểm quan trắc thô của các trạm (mỗi điểm một lần)
+        
+        Điểm trùng timestamp trong cùng lô giữ bản ghi cuối; điểm đã có trong store
+        với cùng giá trị không được ghi lại. Trạm mang dữ liệu mẫu (data_source thuộc
+        SAMPLE_SOURCES) bị bỏ qua để không ghi đè quan trắc thật.
+        
+        Returns:
+            Số dòng thực sự được thêm mới hoặc thay đổi
+        """
+        rows: List[HistoryRow] = []
+        for station_id, station_data in raw_data_dict.items():
+            if not is_observed(station_data):
+                logger.warning(
+                    f"✗ Bỏ qua trạm {station_id}: dữ liệu mẫu ({station_data.get('data_source')}), "
+                    f"không ghi vào lịch sử",
+                    extra={"station_id": station_id}
+                )
+                continue
+            points = station_data.get('raw_data', {}).get('data', [])
+            series = WaterLevelSeries.from_points(points)
+            rows.extend(
+                (station_id, timestamp, to_level(level), None, None)
+                for timestamp, level in zip(series.timestamps.tolist(), series.levels.tolist())
+            )
+        return self.upsert_rows(rows)
+    
+    def upsert_snapshots(self, processed_data: Dict[str, Dict]) -> int:
+        """
+        Gắn cảnh báo/xu hướng cho điểm hiện tại của các trạm, khóa theo thời điểm quan trắc
+        
+        Khi dữ liệu MRC chưa có điểm mới, dòng cũ được cập nhật thay vì thêm dòng trùng.
+        """
+        rows = []
+        for station_id, data in processed_data.items():
+            observed = datetime.fromisoformat(data['current']['timestamp'])
+            rows.append((
+                station_id,
+                int(observed.timestamp() * 1000),
+                data['current']['water_level'],
+                data['alert']['level'],
+                data['trend']['direction']
+            ))
+        return self._write_batch(ANNOTATE_SQL, rows)
+    
+    def read_recent(self, station_id: str, limit: int = 100) -> List[Dict]:
+        """
+        Lấy `limit` bản ghi gần nhất của một trạm, sắp xếp tăng dần theo thời gian
+        """
+        return self.read_range(station_id, limit=limit)
+    
+    def read_range(self, station_id: str, start_ms: Optional[int] = None,
+                   end_ms: Optional[int] = None, limit: Optional[int] = None) -> List[Dict]:
+        """
+        Lấy bản ghi của một trạm trong [start_ms, end_ms), tự chọn tầng mịn nhất có dữ liệu
+        
+        Duyệt từ mới đến cũ: dùng điểm thô trước, phần cũ hơn điểm thô sớm nhất lấy từ
+        tầng theo giờ, cũ hơn nữa lấy từ tầng theo ngày. Bucket gộp có "tier",
+        "min_level", "max_level", "samples"; water_level là giá trị trung bình.
+        
+        Returns:
+            Danh sách bản ghi tăng dần theo thời gian (tối đa `limit` bản ghi gần nhất)
+        """
+        return [
+            record
+            for tier, rows in self._read_tiers(station_id, start_ms, end_ms, limit)
+            for record in self._to_records(station_id, rows, tier)
+        ]
+    
+    def read_range_columns(self, station_id: str, start_ms: Optional[int] = None,
+                           end_ms: Optional[int] = None, limit: Optional[int] = None) -> Dict:
+        """
+        Như read_range nhưng dạng cột: timestamp int64 (epoch ms), water_level/min_level/max_level
+        float32 (min/max là NaN với điểm thô), samples int32 (1 với điểm thô), alert_level,
+        trend_direction (None với bucket gộp) và tier là list chuỗi
+        """
+        tiers = self._read_tiers(station_id, start_ms, end_ms, limit)
+        count = sum(len(rows) for _, rows in tiers)
+        columns = {
+            "timestamp": np.empty(count, dtype=np.int64),
+            "water_level": np.empty(count, dtype=np.float32),
+            "min_level": np.full(count, np.nan, dtype=np.float32),
+            "max_level": np.full(count, np.nan, dtype=np.float32),
+            "samples": np.ones(count, dtype=np.int32),
+            "alert_level": [],
+            "trend_direction": [],
+            "tier": []
+        }
+        
+        offset = 0
+        for tier, rows in tiers:
+            end = offset + len(rows)
+            if rows:
+                values = list(zip(*rows))
+                columns["timestamp"][offset:end] = values[0]
+                columns["water_level"][offset:end] = values[1]
+                if tier == "raw":
+                    columns["alert_level"].extend(values[2])
+                    columns["trend_direction"].extend(values[3])
+                else:
+                    columns["min_level"][offset:end] = values[2]
+                    columns["max_level"][offset:end] = values[3]
+                    columns["samples"][offset:end] = values[4]
+                    columns["alert_level"].extend([None] * len(rows))
+                    columns["trend_direction"].extend([None] * len(rows))
+                columns["tier"].extend([tier] * len(rows))
+            offset = end
+        return columns
+    
+    def _read_tiers(self, station_id: str, start_ms: Optional[int], end_ms: Optional[int],
+                    limit: Optional[int]) -> List[Tuple[str, List[tuple]]]:
+        """Các dòng (tầng, danh sách dòng) của read_range, tầng và dòng tăng dần theo thời gian"""
+        conn = self._connection()
+        start_ms = _MIN_MS if start_ms is None else start_ms
+        tiers_rows = []
+        remaining = limit
+        
+        for tier, table, width, lower, boundary in self._tier_plan(station_id, end_ms):
+            if remaining is not None and remaining <= 0:
+                break
+            
+            rows = conn.execute(
+                f"SELECT {_tier_columns(width)} FROM {table} "
+                f"WHERE station_id = ? AND timestamp > ? AND timestamp <= ? "
+                f"ORDER BY timestamp DESC LIMIT ?",
+                (station_id, max(start_ms - max(width, 1), lower - 1), boundary - max(width, 1),
+                 -1 if remaining is None else remaining)
+            ).fetchall()
+            rows.reverse()
+            tiers_rows.append((tier, rows))
+            if remaining is not None:
+                remaining -= len(rows)
+        
+        tiers_rows.reverse()
+        return tiers_rows
+    
+    def iter_range(self, station_id: str, start_ms: Optional[int] = None,
+                   end_ms: Optional[int] = None, chunk_size: int = 5000) -> Iterator[List[Dict]]:
+        """
+        Như read_range nhưng trả về từng khối `chunk_size` bản ghi, tăng dần theo thời gian
+        
+        Mỗi khối là một truy vấn keyset (timestamp > khóa cuối) trên index, nên bộ nhớ
+        không phụ thuộc độ dài khoảng thời gian và không giữ transaction đọc giữa các khối.
+        """
+        conn = self._connection()
+        start_ms = _MIN_MS if start_ms is None else start_ms
+        
+        for tier, table, width, lower, boundary in reversed(self._tier_plan(station_id, end_ms)):
+            after = max(start_ms - max(width, 1), lower - 1)
+            while True:
+                rows = conn.execute(
+                    f"SELECT {_tier_columns(width)} FROM {table} "
+                    f"WHERE station_id = ? AND timestamp > ? AND timestamp <= ? "
+                    f"ORDER BY timestamp LIMIT ?",
+                    (station_id, after, boundary - max(width, 1), chunk_size)
+                ).fetchall()
+                if not rows:
+                    break
+                yield self._to_records(station_id, rows, tier)
+                if len(rows) < chunk_size:
+                    break
+                after = rows[-1][0]
+    
+    def _tier_plan(self, station_id: str, end_ms: Optional[int]) -> List[Tuple[str, str, int, int, int]]:
+        """
+        Các tầng từ mịn đến thô kèm khoảng [mốc đầu, mốc kết thúc) mà tầng đó được dùng
+        
+        Mốc chia giữa hai tầng là cutoff mà compact đã ghi cho tầng mịn hơn (tier_cutoffs);
+        store chưa có cutoff (chưa nén lần nào kể từ khi có bảng) dùng dữ liệu sớm nhất của
+        tầng mịn hơn như trước.
+        """
+        conn = self._connection()
+        cutoffs = dict(conn.execute(
+            "SELECT tier, cutoff FROM tier_cutoffs WHERE station_id = ?", (station_id,)
+        ).fetchall())
+        boundary = _MAX_MS if end_ms is None else end_ms
+        plan = []
+        for tier, table, width in TIERS:
+            cutoff = cutoffs.get(tier)
+            lower = _MIN_MS if cutoff is None else cutoff
+            plan.append((tier, table, width, lower, boundary))
+            if cutoff is None:
+                cutoff = conn.execute(
+                    f"SELECT MIN(timestamp) FROM {table} WHERE station_id = ?", (station_id,)
+                ).fetchone()[0]
+            if cutoff is not None:
+                boundary = min(boundary, cutoff)
+        return plan
+    
+    def tier_cutoff(self, station_id: str, tier: str = "raw") -> Optional[int]:
+        """
+        Mốc (epoch ms) mà dữ liệu tầng `tier` của trạm trước đó đã được nén sang tầng kế tiếp,
+        None nếu chưa nén lần nào
+        """
+        row = self._connection().execute(
+            "SELECT cutoff FROM tier_cutoffs WHERE station_id = ? AND tier = ?", (station_id, tier)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def read_observations(self, station_id: str, start_ms: int, end_ms: int,
+                          recorded_after: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Điểm quan trắc thô của một trạm trong [start_ms, end_ms) dạng mảng (timestamps, levels)
+        
+        Args:
+            recorded_after: Chỉ lấy các điểm được thêm/sửa sau thời điểm này (epoch ms)
+        """
+        query = (
+            "SELECT timestamp, water_level FROM water_levels "
+            "WHERE station_id = ? AND timestamp >= ? AND timestamp < ?"
+        )
+        params = [station_id, start_ms, end_ms]
+        if recorded_after is not None:
+            query += " AND recorded_at > ?"
+            params.append(recorded_after)
+        rows = self._connection().execute(query + " ORDER BY timestamp", params).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        timestamps, levels = zip(*rows)
+        return np.array(timestamps, dtype=np.int64), np.array(levels, dtype=np.float64)
+    
+    def changed_partitions(self, recorded_after: int, utc_offset_ms: int) -> Tuple[List[Tuple[str, str]], Optional[int]]:
+        """
+        Các cặp (station_id, tháng 'YYYY-MM' theo giờ địa phương) có điểm thô được thêm/sửa sau
+        recorded_after, gom bằng DISTINCT trong SQL trên index recorded_at
+        
+        Returns:
+            (partitions, watermark): watermark là recorded_at lớn nhất đã xét, None nếu không có thay đổi
+        """
+        conn = self._connection()
+        (watermark,) = conn.execute(
+            "SELECT MAX(recorded_at) FROM water_levels WHERE recorded_at > ?", (recorded_after,)
+        ).fetchone()
+        if watermark is None:
+            return [], None
+        
+        # Chặn trên bằng watermark để điểm ghi xen giữa hai câu lệnh được export ở lần sau
+        partitions = conn.execute(
+            "SELECT DISTINCT station_id, strftime('%Y-%m', (timestamp + ?) / 1000, 'unixepoch') "
+            "FROM water_levels WHERE recorded_at > ? AND recorded_at <= ? ORDER BY 1, 2",
+            (utc_offset_ms, recorded_after, watermark)
+        ).fetchall()
+        return [tuple(row) for row in partitions], watermark
+    
+    def compact(self, now_ms: Optional[int] = None) -> Dict[str, int]:
+        """
+        Nén dữ liệu cũ xuống tầng thô hơn theo config.HISTORY_RETENTION và trả lại dung lượng
+        
+        Mỗi trạm được nén theo từng khối thời gian trong transaction ngắn, nên lượt ghi
+        của scheduler chỉ phải chờ một khối; reader (WAL) không bị chặn.
+        
+        Returns:
+            Số dòng đã nén của từng tầng và số trang đĩa đã trả lại
+        """
+        retention = config.HISTORY_RETENTION
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        offset_ms = int(datetime.now(self.timezone).utcoffset().total_seconds() * 1000)
+        chunk_ms = retention["compaction_chunk_days"] * DAY_MS
+        
+        raw_cutoff = _floor_bucket(now_ms - retention["raw_days"] * DAY_MS, HOUR_MS, offset_ms)
+        hourly_cutoff = _floor_bucket(now_ms - retention["hourly_days"] * DAY_MS, DAY_MS, offset_ms)
+        
+        result = {
+            "raw_rows": self._rollup("raw", "water_levels", ROLLUP_RAW_SQL, raw_cutoff, chunk_ms, offset_ms),
+            "hourly_rows": self._rollup("hourly", "water_levels_hourly", ROLLUP_HOURLY_SQL, hourly_cutoff,
+                                        chunk_ms, offset_ms),
+        }
+        result["pages_freed"] = self._reclaim_space(retention["vacuum_pages_per_step"])
+        return result
+    
+    def disk_size(self) -> int:
+        """Dung lượng trên đĩa (byte) của file DB cùng -wal và -shm (WAL mode giữ dữ liệu mới trong -wal)"""
+        return sum(
+            os.path.getsize(path)
+            for path in (self.db_path, f"{self.db_path}-wal", f"{self.db_path}-shm")
+            if os.path.exists(path)
+        )
+    
+    def tier_counts(self) -> Dict[str, int]:
+        conn = self._connection()
+        return {
+            tier: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for tier, table, _ in TIERS
+        }
+    
+    def _rollup(self, tier: str, source: str, rollup_sql: str, cutoff_ms: int, chunk_ms: int,
+                offset_ms: int) -> int:
+        """
+        Gộp các dòng cũ hơn cutoff_ms của bảng source sang tầng kế tiếp rồi xóa chúng,
+        đồng thời đẩy mốc nén (tier_cutoffs) của tầng trong cùng transaction
+        """
+        conn = self._connection()
+        station_ids = [row[0] for row in conn.execute(f"SELECT DISTINCT station_id FROM {source}")]
+        compacted = 0
+        
+        for station_id in station_ids:
+            while True:
+                earliest = conn.execute(
+                    f"SELECT MIN(timestamp) FROM {source} WHERE station_id = ? AND timestamp < ?",
+                    (station_id, cutoff_ms)
+                ).fetchone()[0]
+                if earliest is None:
+                    break
+                
+                # cutoff đã căn theo bucket nên chunk_end = cutoff không cắt ngang bucket
+                chunk_end = min(
+                    _floor_bucket(earliest + chunk_ms, DAY_MS, offset_ms),
+                    cutoff_ms
+                )
+                with self._write_lock:
+                    self._begin_write(conn)
+                    try:
+                        conn.execute(rollup_sql, (offset_ms, offset_ms, station_id, earliest, chunk_end))
+                        deleted = conn.execute(
+                            f"DELETE FROM {source} WHERE station_id = ? AND timestamp >= ? AND timestamp < ?",
+                            (station_id, earliest, chunk_end)
+                        ).rowcount
+                        conn.execute(
+                            "INSERT INTO tier_cutoffs (station_id, tier, cutoff) VALUES (?, ?, ?) "
+                            "ON CONFLICT (station_id, tier) DO UPDATE SET cutoff = MAX(cutoff, excluded.cutoff)",
+                            (station_id, tier, chunk_end)
+                        )
+                        conn.execute("COMMIT")
+                    except BaseException:
+                        conn.execute("ROLLBACK")
+                        raise
+                compacted += deleted
+        
+        return compacted
+    
+    def _reclaim_space(self, pages_per_step: int) -> int:
+        """
+        Trả các trang trống về hệ điều hành theo từng bước nhỏ (cần auto_vacuum=INCREMENTAL)
+        """
+        conn = self._connection()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        
+        initial = remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while remaining > 0:
+            with self._write_lock:
+                conn.execute(f"PRAGMA incremental_vacuum({pages_per_step})").fetchall()
+            left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if left >= remaining:
+                break
+            remaining = left
+        
+        # PASSIVE: chép WAL vào file DB mà không chờ reader đang mở
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        return initial - remaining
+    
+    def count(self, station_id: Optional[str] = None) -> int:
+        if station_id is None:
+            return self._connection().execute("SELECT COUNT(*) FROM water_levels").fetchone()[0]
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM water_levels WHERE station_id = ?", (station_id,)
+        ).fetchone()[0]
+    
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._connection().execute(
+            "SELECT value FROM store_meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def set_meta(self, key: str, value: str):
+        conn = self._connection()
+        with self._write_lock:
+            self._begin_write(conn)
+            try:
+                conn.execute(
+                    "INSERT INTO store_meta (key, value) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    (key, value)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    
+    def migrate_csv(self, csv_path: Optional[str] = None, batch_size: int = 5000) -> int:
+        """
+        Import file CSV lịch sử cũ vào store (chỉ chạy một lần cho mỗi file)
+        
+        CSV cũ không có thời điểm quan trắc nên cột timestamp (thời điểm chạy) được dùng làm khóa.
+        
+        Returns:
+            Số dòng đã import
+        """
+        csv_path = csv_path or config.HISTORICAL_DATA_FILE
+        meta_key = f"migrated_csv:{os.path.abspath(csv_path)}"
+        
+        if not os.path.exists(csv_path) or self.get_meta(meta_key):
+            return 0
+        
+        imported = 0
+        batch: List[HistoryRow] = []
+        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+            for record in csv.DictReader(f):
+                try:
+                    timestamp = datetime.fromisoformat(record['timestamp'])
+                    batch.append((
+                        record['station_id'],
+                        int(timestamp.timestamp() * 1000),
+                        float(record['water_level']),
+                        record.get('alert_level') or None,
+                        record.get('trend_direction') or None
+                    ))
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Bỏ qua dòng CSV không hợp lệ: {record} ({str(e)})")
+                    continue
+                
+                if len(batch) >= batch_size:
+                    imported += self.upsert_rows(batch)
+                    batch = []
+        
+        imported += self.upsert_rows(batch)
+        self.set_meta(meta_key, datetime.now(self.timezone).isoformat())
+        logger.info(f"✓ Đã import {imported} dòng từ {csv_path} vào {self.db_path}")
+        return imported
+    
+    def _to_records(self, station_id: str, rows: List[tuple], tier: str = "raw") -> List[Dict]:
+        station_name = config.STATIONS.get(station_id, {}).get('name', station_id)
+        iso_times = format_iso_timestamps([row[0] for row in rows], self.timezone)
+        
+        if tier == "raw":
+            return [
+                {
+                    "timestamp": iso,
+                    "station_id": station_id,
+                    "station_name": station_name,
+                    "water_level": water_level,
+                    "alert_level": alert_level,
+                    "trend_direction": trend_direction,
+                    "tier": tier
+                }
+                for iso, (_, water_level, alert_level, trend_direction) in zip(iso_times, rows)
+            ]
+        
+        return [
+            {
+                "timestamp": iso,
+                "station_id": station_id,
+                "station_name": station_name,
+                "water_level": to_level(mean_level),
+                "min_level": min_level,
+                "max_level": max_level,
+                "samples": samples,
+                "tier": tier
+            }
+            for iso, (_, mean_level, min_level, max_level, samples) in zip(iso_times, rows)
+        ]
+
+
+def is_observed(station_data: Dict) -> bool:
+    """Dữ liệu thô của trạm đến từ quan trắc thật, không phải dữ liệu mẫu khi scrape lỗi"""
+    return station_data.get('data_source') not in SAMPLE_SOURCES
+
+
+def _tier_columns(width: int) -> str:
+    if width == 0:
+        return "timestamp, water_level, alert_level, trend_direction"
+    return "timestamp, mean_level, min_level, max_level, samples"
+
+
+def _floor_bucket(timestamp_ms: int, width_ms: int, offset_ms: int) -> int:
+    """Làm tròn xuống đầu bucket theo giờ địa phương (offset_ms là offset múi giờ)"""
+    return ((timestamp_ms + offset_ms) // width_ms) * width_ms - offset_ms
+
+
+def main():
+    """
+    CLI: python history_store.py migrate [csv_path]
+    """
+    setup_logging()
+    
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("Cách dùng: python history_store.py migrate [csv_path]")
+        sys.exit(1)
+    
+    csv_path = sys.argv[2] if len(sys.argv) > 2 else config.HISTORICAL_DATA_FILE
+    store = HistoricalStore()
+    imported = store.migrate_csv(csv_path)
+    print(f"Đã import {imported} dòng. Tổng số dòng trong store: {store.count()}")
+
+
+if __name__ == "__main__":
+    main()
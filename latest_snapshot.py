@@ -0,0 +1,220 @@
+"""
+Module snapshot mới nhất phía API: nạp lại theo file, vòng các thế hệ gần đây và delta
+In-memory latest snapshot with a ring of recent generations for /api/latest?since= deltas
+
+Scheduler đánh số thế hệ (metadata.generation) tăng dần mỗi lần ghi snapshot và gắn vào
+mỗi trạm được ghi lần đó (station.generation). API giữ tóm tắt nhỏ của các thế hệ đã thấy
+(thế hệ trạm, timestamp điểm cuối, mức cảnh báo), đủ để tính delta cho client đang ở thế hệ cũ:
+
+- stations: trạm đổi sau thế hệ của client, bỏ data_points, thay bằng appended_points
+  (các điểm mới hơn điểm cuối client đã có)
+- alerts_changed: trạm đổi mức cảnh báo (from -> to)
+- removed: trạm không còn trong snapshot
+
+Mỗi delta (theo since và định dạng) được tính và serialize (ngoài lock) rồi cache cho thế hệ hiện tại. Client ở thế hệ
+replica này chưa thấy hoặc đã rơi khỏi vòng nhận lại toàn bộ snapshot (delta=false).
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import config
+
+
+class StationSummary(NamedTuple):
+    generation: int
+    last_timestamp: Optional[int]
+    alert_level: Optional[str]
+
+
+def summarize_station(station: Dict) -> StationSummary:
+    """Tóm tắt một trạm để so sánh giữa các thế hệ (timestamp điểm cuối là epoch ms)"""
+    points = station.get('data_points') or []
+    last_timestamp = points[-1]['timestamp'] if points else None
+    return StationSummary(
+        station.get('generation', 0),
+        last_timestamp,
+        station.get('alert', {}).get('level')
+    )
+
+
+def compute_delta(data: Dict, base: Dict[str, StationSummary], since: int) -> Dict:
+    """
+    Delta từ thế hệ `since` tới snapshot `data`, dựa trên tóm tắt `base` của một thế hệ
+    đã thấy không mới hơn `since`
+    
+    Nếu base cũ hơn since, appended_points có thể chứa điểm client đã có: client gộp theo timestamp.
+    """
+    metadata = data.get('metadata', {})
+    stations = data.get('stations', {})
+    changed = {}
+    alerts_changed = []
+    
+    for station_id, station in stations.items():
+        old = base.get(station_id)
+        if old is not None and station.get('generation', 0) <= since:
+            continue
+        
+        entry = {key: value for key, value in station.items() if key != 'data_points'}
+        points = station.get('data_points') or []
+        if old is None or old.last_timestamp is None:
+            entry['appended_points'] = points
+        else:
+            entry['appended_points'] = [p for p in points if p['timestamp'] > old.last_timestamp]
+        changed[station_id] = entry
+        
+        level = station.get('alert', {}).get('level')
+        if old is not None and old.alert_level != level:
+            alerts_changed.append({"station_id": station_id, "from": old.alert_level, "to": level})
+    
+    return {
+        "delta": True,
+        "since": since,
+        "generation": metadata.get('generation', 0),
+        "last_updated": data.get('last_updated'),
+        "stations": changed,
+        "alerts_changed": alerts_changed,
+        "removed": [station_id for station_id in base if station_id not in stations],
+        "metadata": metadata
+    }
+
+
+class LatestSnapshot:
+    """
+    Snapshot mới nhất trong bộ nhớ, nạp lại khi file đổi (mtime/size), kèm vòng tóm tắt
+    LATEST_DELTA['ring_size'] thế hệ gần nhất và cache body đã serialize của thế hệ hiện tại
+    
+    encoders: tên định dạng -> hàm serialize phần "data" (snapshot hoặc delta) thành body
+    """
+    
+    def __init__(self, encoders: Dict[str, Callable[[Dict], Union[str, bytes]]],
+                 file_path: Optional[str] = None, ring_size: Optional[int] = None,
+                 cache_size: Optional[int] = None):
+        delta_config = config.LATEST_DELTA
+        self.encoders = encoders
+        self.file_path = file_path or config.LATEST_DATA_FILE
+        self.ring_size = ring_size or delta_config['ring_size']
+        self.cache_size = cache_size or delta_config['cache_size']
+        self._lock = threading.Lock()
+        self._file_key: Optional[Tuple[int, int, int]] = None
+        self._data: Optional[Dict] = None
+        self._ring: 'OrderedDict[int, Dict[str, StationSummary]]' = OrderedDict()
+        self._bodies: 'OrderedDict[tuple, Union[str, bytes]]' = OrderedDict()
+    
+    def load(self) -> Optional[Dict]:
+        """
+        Snapshot hiện tại (dùng chung giữa các request, không được sửa) hoặc None nếu chưa có file
+        """
+        with self._lock:
+            return self._refresh()
+    
+    def _refresh(self) -> Optional[Dict]:
+        # Gọi khi đang giữ _lock: request đến trong lúc nạp lại chờ thay vì cùng parse file
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        file_key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if file_key != self._file_key:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._install(data)
+            self._file_key = file_key
+        return self._data
+    
+    def _install(self, data: Dict):
+        generation = data.get('metadata', {}).get('generation', 0)
+        
+        # Snapshot được tạo lại từ đầu (thế hệ lùi): tóm tắt cũ không còn đúng
+        if self._ring and generation < next(reversed(self._ring)):
+            self._ring.clear()
+        
+        self._ring[generation] = {
+            station_id: summarize_station(station)
+            for station_id, station in data.get('stations', {}).items()
+        }
+        self._ring.move_to_end(generation)
+        while len(self._ring) > self.ring_size:
+            self._ring.popitem(last=False)
+        
+        self._data = data
+        self._bodies.clear()
+    
+    def _cached_body(self, key: tuple, fmt: str,
+                     prepare: Callable[[Optional[Dict]], Optional[Callable[[], Dict]]]) -> Optional[Union[str, bytes]]:
+        """
+        Body đã serialize của thế hệ hiện tại, cache theo (fmt,) + key
+        
+        prepare(snapshot) chạy trong _lock và trả về hàm dựng dữ liệu cần encode (None nếu không
+        phục vụ được). Khi cache miss, việc dựng và encode chạy ngoài _lock để request khác và lần
+        nạp thế hệ mới không phải chờ; body chỉ được cache nếu thế hệ chưa đổi trong lúc encode.
+        """
+        key = (fmt,) + key
+        with self._lock:
+            build = prepare(self._refresh())
+            if build is None:
+                return None
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+                return body
+            file_key = self._file_key
+        
+        body = self.encoders[fmt](build())
+        
+        with self._lock:
+            if self._file_key == file_key:
+                self._bodies[key] = body
+                while len(self._bodies) > self.cache_size:
+                    self._bodies.popitem(last=False)
+        return body
+    
+    def full_body(self, delta_requested: bool = False, fmt: str = "json") -> Optional[Union[str, bytes]]:
+        """
+        Body (định dạng fmt) của toàn bộ snapshot, None nếu chưa có file; delta_requested
+        thêm "delta": false (client xin delta nhưng không tính được)
+        """
+        def prepare(data: Optional[Dict]) -> Optional[Callable[[], Dict]]:
+            if data is None:
+                return None
+            if delta_requested:
+                return lambda: {**data, "delta": False}
+            return lambda: data
+        
+        return self._cached_body(("full", delta_requested), fmt, prepare)
+    
+    def delta_body(self, since: int, fmt: str = "json") -> Optional[Union[str, bytes]]:
+        """
+        Body (định dạng fmt) của delta từ thế hệ `since`, hoặc None nếu không tính được (chưa có
+        snapshot, snapshot không đánh số thế hệ, since mới hơn thế hệ hiện tại hoặc cũ hơn mọi
+        thế hệ trong vòng)
+        """
+        def prepare(data: Optional[Dict]) -> Optional[Callable[[], Dict]]:
+            if data is None or 'generation' not in data.get('metadata', {}):
+                return None
+            if since > data['metadata']['generation']:
+                return None
+            base = self._base_for(since)
+            if base is None:
+                return None
+            # Snapshot và tóm tắt trong vòng không bị sửa sau khi nạp nên đọc ngoài _lock được
+            return lambda: compute_delta(data, base, since)
+        
+        return self._cached_body(("delta", since), fmt, prepare)
+    
+    def _base_for(self, since: int) -> Optional[Dict[str, StationSummary]]:
+        # Thế hệ đã thấy mới nhất không vượt since (chính since nếu replica này đã phục vụ nó)
+        if since in self._ring:
+            return self._ring[since]
+        candidates: List[int] = [generation for generation in self._ring if generation <= since]
+        if not candidates:
+            return None
+        return self._ring[max(candidates)]
+    
+    def generations(self) -> List[int]:
+        """Các thế hệ đang có tóm tắt trong vòng (cũ tới mới)"""
+        with self._lock:
+            return list(self._ring)
@@ -0,0 +1,466 @@
+"""
+Module bầu leader giữa nhiều replica bằng lease trên bảng SQLite dùng chung
+Lease-based leader election with fencing tokens over a shared SQLite table
+
+Chỉ replica giữ lease (leader) mới scrape và ghi dữ liệu; các replica khác (follower)
+chỉ phục vụ API đọc từ snapshot dùng chung trong DATA_DIR.
+
+- Lease hết hạn sau lease_seconds nếu leader không gia hạn (process chết, treo, mất mạng),
+  follower tiếp theo chiếm lease trong vòng tối đa lease_seconds + renew_interval_seconds
+- Mỗi lần lease đổi chủ, fencing token tăng 1; token được kiểm tra trong cùng transaction
+  với lệnh ghi (assert_fencing trên DB lease đã attach, hoặc fenced() cho file snapshot).
+  Transaction ghi giữ khóa DB lease nên leader mới không chiếm được lease giữa lúc kiểm tra
+  và lúc ghi; một leader cũ vừa "tỉnh lại" sau khi treo không ghi đè leader mới
+- Các replica phải dùng chung file DB (cùng volume, filesystem hỗ trợ khóa file) và
+  có đồng hồ được đồng bộ (lease so sánh theo giờ hệ thống)
+
+Chạy thử nhiều process trên máy local (dừng leader bằng Ctrl+C để xem follower lên thay):
+    python leader.py run
+    python leader.py status
+    python leader.py test     # kiểm tra nhanh với 2 process trên DB lease tạm
+"""
+
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import config
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leader_lease (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    token INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class FencingError(RuntimeError):
+    """Lease đã hết hạn hoặc thuộc leader khác: replica này không được ghi dữ liệu dùng chung"""
+
+
+def default_holder_id() -> str:
+    """ID duy nhất của replica: hostname:pid:ngẫu nhiên"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class LeaderElector:
+    """
+    Giữ/gia hạn lease "leader" trên bảng leader_lease bằng một thread nền
+    
+    Callback on_elected(token) được gọi khi replica trở thành leader, on_demoted() khi
+    mất lease (gia hạn thất bại hoặc dừng).
+    """
+    
+    def __init__(self, db_path: Optional[str] = None, name: Optional[str] = None,
+                 holder_id: Optional[str] = None, lease_seconds: Optional[float] = None,
+                 renew_interval: Optional[float] = None,
+                 on_elected: Optional[Callable[[int], None]] = None,
+                 on_demoted: Optional[Callable[[], None]] = None):
+        election_config = config.LEADER_ELECTION
+        self.db_path = db_path or election_config['db_file']
+        self.name = name or election_config['name']
+        self.holder_id = holder_id or default_holder_id()
+        self.lease_seconds = lease_seconds or election_config['lease_seconds']
+        self.renew_interval = renew_interval or election_config['renew_interval_seconds']
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        
+        # Token đang giữ (None nếu là follower) và hạn lease theo đồng hồ monotonic local
+        self.token: Optional[int] = None
+        self._valid_until = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+    
+    def _connect(self) -> sqlite3.Connection:
+        # Kết nối ngắn cho mỗi lần gọi: chỉ dùng vài giây một lần, không cần giữ theo thread
+        conn = sqlite3.connect(self.db_path, timeout=self.renew_interval, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.renew_interval * 1000)}")
+        return conn
+    
+    @property
+    def is_leader(self) -> bool:
+        """
+        Còn là leader theo lần gia hạn gần nhất (kiểm tra nhanh, không truy cập DB)
+        """
+        with self._lock:
+            return self.token is not None and time.monotonic() < self._valid_until
+    
+    def try_acquire(self) -> bool:
+        """
+        Chiếm lease nếu đang trống/hết hạn, hoặc gia hạn nếu đang giữ
+        
+        Returns:
+            True nếu replica đang là leader sau lần gọi này
+        """
+        started = time.monotonic()
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT holder, token, expires_at FROM leader_lease WHERE name = ?", (self.name,)
+                ).fetchone()
+                
+                if row is None:
+                    token = 1
+                elif row[0] == self.holder_id and row[1] == self.token:
+                    token = row[1]
+                elif row[2] <= now:
+                    token = row[1] + 1
+                else:
+                    token = None
+                
+                if token is not None:
+                    conn.execute(
+                        "INSERT INTO leader_lease (name, holder, token, expires_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, "
+                        "token = excluded.token, expires_at = excluded.expires_at",
+                        (self.name, self.holder_id, token, now + self.lease_seconds)
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        
+        if token is None:
+            self._set_follower()
+            return False
+        
+        with self._lock:
+            elected = self.token != token
+            self.token = token
+            # Tính hạn từ lúc bắt đầu gọi: an toàn kể cả khi transaction phải chờ khóa
+            self._valid_until = started + self.lease_seconds
+        
+        if elected:
+            logger.info(f"✓ {self.holder_id} trở thành leader '{self.name}' (fencing token {token})")
+            if self.on_elected:
+                self.on_elected(token)
+        return True
+    
+    def check_fencing(self, token: Optional[int] = None) -> bool:
+        """
+        Kiểm tra trên DB rằng lease vẫn thuộc replica này với đúng fencing token; chỉ để
+        bỏ qua sớm một lượt ghi, bản thân lệnh ghi phải dùng assert_fencing()/fenced()
+        """
+        token = self.token if token is None else token
+        if token is None or not self.is_leader:
+            return False
+        
+        conn = self._connect()
+        try:
+            return self._owns_lease(conn, "main", token)
+        finally:
+            conn.close()
+    
+    def attach(self, conn: sqlite3.Connection):
+        """Gắn DB lease (schema "lease") vào connection ghi của store khác để dùng assert_fencing"""
+        conn.execute("ATTACH DATABASE ? AS lease", (self.db_path,))
+    
+    def assert_fencing(self, conn: sqlite3.Connection, schema: str = "lease"):
+        """
+        Kiểm tra fencing token bên trong transaction ghi đang mở của conn (sau BEGIN IMMEDIATE);
+        transaction giữ khóa ghi trên DB lease tới lúc COMMIT nên lease không thể đổi chủ giữa chừng
+        
+        Raises:
+            FencingError: nếu replica này không còn giữ lease với đúng token
+        """
+        token = self.token
+        if token is None or not self.is_leader or not self._owns_lease(conn, schema, token):
+            raise FencingError(f"{self.holder_id} không còn giữ lease '{self.name}' (token {token})")
+    
+    @contextmanager
+    def fenced(self):
+        """
+        Giữ khóa ghi trên DB lease (đã kiểm tra token) trong lúc ghi dữ liệu ngoài SQLite,
+        ví dụ os.replace file snapshot
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.assert_fencing(conn, "main")
+                yield
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+    
+    def _owns_lease(self, conn: sqlite3.Connection, schema: str, token: int) -> bool:
+        row = conn.execute(
+            f"SELECT holder, token, expires_at FROM {schema}.leader_lease WHERE name = ?", (self.name,)
+        ).fetchone()
+        return row is not None and row[0] == self.holder_id and row[1] == token and row[2] > time.time()
+    
+    def release(self):
+        """
+        Trả lease ngay (cho hết hạn) để follower lên thay không phải chờ lease_seconds
+        """
+        token = self.token
+        if token is None:
+            return
+        
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE leader_lease SET expires_at = 0 WHERE name = ? AND holder = ? AND token = ?",
+                (self.name, self.holder_id, token)
+            )
+        finally:
+            conn.close()
+        self._set_follower()
+    
+    def start(self):
+        """
+        Thử chiếm lease ngay, sau đó chạy thread gia hạn/thử lại mỗi renew_interval giây
+        """
+        if self._thread is not None:
+            return
+        
+        self._stop.clear()
+        self._step()
+        self._thread = threading.Thread(target=self._run, name=f"leader-{self.name}", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Dừng thread và trả lease"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.release()
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi trả lease leader: {str(e)}")
+    
+    def status(self) -> Dict:
+        """Trạng thái lease (cho /api/status)"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT holder, token, expires_at FROM leader_lease WHERE name = ?", (self.name,)
+            ).fetchone()
+        finally:
+            conn.close()
+        
+        return {
+            "replica_id": self.holder_id,
+            "is_leader": self.is_leader,
+            "fencing_token": self.token,
+            "leader_id": row[0] if row and row[2] > time.time() else None,
+            "lease_expires_in_seconds": round(row[2] - time.time(), 1) if row and row[2] > time.time() else None
+        }
+    
+    def _run(self):
+        while not self._stop.wait(self.renew_interval):
+            self._step()
+    
+    def _step(self):
+        try:
+            self.try_acquire()
+        except Exception as e:
+            # Không truy cập được DB: không gia hạn được, tự hạ xuống khi lease local hết hạn
+            logger.error(f"✗ Lỗi khi gia hạn lease leader: {str(e)}")
+            if not self.is_leader:
+                self._set_follower()
+    
+    def _set_follower(self):
+        with self._lock:
+            demoted = self.token is not None
+            self.token = None
+            self._valid_until = 0.0
+        
+        if demoted:
+            logger.warning(f"✗ {self.holder_id} không còn là leader '{self.name}'")
+            if self.on_demoted:
+                self.on_demoted()
+
+
+# Lease ngắn cho test_leader để thấy tiếp quản trong vài giây
+TEST_LEASE_SECONDS = 1.0
+TEST_RENEW_SECONDS = 0.2
+
+
+def _test_write(elector: LeaderElector, data_path: str) -> bool:
+    """
+    Ghi một dòng vào DB dữ liệu tạm theo đúng cách của HistoricalStore (attach DB lease,
+    kiểm tra token trong transaction ghi)
+    
+    Returns:
+        True nếu đã ghi, False nếu bị chặn bởi fencing token
+    """
+    conn = sqlite3.connect(data_path, timeout=5, isolation_level=None)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS writes (holder TEXT NOT NULL, token INTEGER NOT NULL)")
+        elector.attach(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            elector.assert_fencing(conn)
+            conn.execute("INSERT INTO writes (holder, token) VALUES (?, ?)", (elector.holder_id, elector.token))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+    except FencingError:
+        return False
+    finally:
+        conn.close()
+
+
+def _test_replica(db_path: str, data_path: str, holder_id: str, pipe):
+    """
+    Một replica trong test_leader (process riêng), nhận lệnh qua pipe:
+    "status", "freeze" (giả lập process treo), "write", "stop"
+    """
+    elector = LeaderElector(db_path, name="test", holder_id=holder_id,
+                            lease_seconds=TEST_LEASE_SECONDS, renew_interval=TEST_RENEW_SECONDS)
+    elector.start()
+    while True:
+        command = pipe.recv()
+        if command == "status":
+            pipe.send(elector.is_leader)
+        elif command == "freeze":
+            # Dừng gia hạn nhưng giữ token, và coi như hạn lease local chưa hết (process treo
+            # không tự biết mình đã quá hạn): chỉ còn kiểm tra token trên DB chặn được lệnh ghi
+            elector._stop.set()
+            elector._thread.join()
+            with elector._lock:
+                elector._valid_until = float('inf')
+            pipe.send(elector.token)
+        elif command == "write":
+            pipe.send(_test_write(elector, data_path))
+        elif command == "stop":
+            elector.stop()
+            pipe.send(True)
+            return
+
+
+def test_leader():
+    """
+    Hàm test bầu leader với 2 process trên cùng DB lease tạm: đúng một leader, follower tiếp
+    quản khi lease hết hạn, lệnh ghi mang fencing token cũ bị từ chối
+    """
+    print("="*60)
+    print("TESTING LEADER ELECTION")
+    print("="*60)
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "leader.db")
+        data_path = os.path.join(tmp_dir, "data.db")
+        holder_ids = ["replica-0", "replica-1"]
+        replicas = []
+        for holder_id in holder_ids:
+            parent_pipe, child_pipe = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_test_replica, args=(db_path, data_path, holder_id, child_pipe), daemon=True
+            )
+            process.start()
+            replicas.append((process, parent_pipe))
+        
+        def ask(index: int, command: str):
+            pipe = replicas[index][1]
+            pipe.send(command)
+            if not pipe.poll(10):
+                raise RuntimeError(f"{holder_ids[index]} không phản hồi lệnh {command}")
+            return pipe.recv()
+        
+        try:
+            time.sleep(TEST_RENEW_SECONDS * 3)
+            leaders = [index for index in range(len(replicas)) if ask(index, "status")]
+            assert len(leaders) == 1, leaders
+            leader, follower = leaders[0], 1 - leaders[0]
+            print(f"✓ Đúng một leader: {holder_ids[leader]}")
+            
+            stale_token = ask(leader, "freeze")
+            time.sleep(TEST_LEASE_SECONDS + TEST_RENEW_SECONDS * 3)
+            assert ask(follower, "status"), "follower chưa tiếp quản"
+            print(f"✓ {holder_ids[follower]} tiếp quản sau khi lease của {holder_ids[leader]} hết hạn")
+            
+            assert ask(follower, "write"), "leader mới không ghi được"
+            assert not ask(leader, "write"), "lệnh ghi với token cũ không bị chặn"
+            conn = sqlite3.connect(data_path)
+            try:
+                writes = conn.execute("SELECT holder, token FROM writes").fetchall()
+            finally:
+                conn.close()
+            assert writes == [(holder_ids[follower], stale_token + 1)], writes
+            print(f"✓ Lệnh ghi với fencing token cũ ({stale_token}) bị từ chối, "
+                  f"chỉ leader mới (token {stale_token + 1}) ghi được")
+        finally:
+            for index, (process, _) in enumerate(replicas):
+                if process.is_alive():
+                    try:
+                        ask(index, "stop")
+                    except (RuntimeError, OSError):
+                        pass
+                process.join(5)
+                if process.is_alive():
+                    process.terminate()
+
+
+def main():
+    """
+    CLI:
+        python leader.py run      # tham gia bầu leader, in trạng thái khi thay đổi
+        python leader.py status   # xem leader hiện tại
+        python leader.py test     # kiểm tra nhanh với 2 process trên DB lease tạm
+    """
+    setup_logging()
+    
+    if len(sys.argv) >= 2 and sys.argv[1] == 'run':
+        elector = LeaderElector()
+        elector.start()
+        logger.info(f"Replica {elector.holder_id} đã tham gia bầu leader, nhấn Ctrl+C để dừng")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            elector.stop()
+        return
+    
+    if len(sys.argv) >= 2 and sys.argv[1] == 'test':
+        test_leader()
+        return
+    
+    if len(sys.argv) >= 2 and sys.argv[1] == 'status':
+        status = LeaderElector(holder_id="status").status()
+        print(f"Leader: {status['leader_id'] or '(chưa có)'}, "
+              f"lease còn {status['lease_expires_in_seconds']} giây")
+        return
+    
+    print(__doc__)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Module load test API: phát lại các hỗn hợp request thực tế, báo cáo throughput và độ trễ đuôi
+Load-test driver replaying realistic API request mixes against a running server
+
+- serve: chạy API trên dữ liệu của synthetic_data.py (không chạy scheduler, chỉ các trạm tổng hợp)
+- run:   nhiều client đồng thời gửi request theo hỗn hợp có trọng số trong một khoảng thời gian
+
+Chế độ mặc định là closed-loop (mỗi client gửi request kế tiếp ngay khi nhận xong). Với --rate,
+request được lên lịch theo nhịp cố định (open-loop) và độ trễ tính từ thời điểm lẽ ra phải gửi,
+nên server chậm làm tăng độ trễ đo được thay vì âm thầm giảm tải (coordinated omission).
+
+Chạy:
+    python synthetic_data.py --stations 300 --days 365
+    python loadtest.py serve --port 5050
+    python loadtest.py run --url http://localhost:5050 --mix dashboard --concurrency 32 --duration 60
+    python loadtest.py run --url http://localhost:5050 --mix analyst --rate 50 --json report.json
+    python loadtest.py run --mix-file my_mix.json      # [[trọng số, "đường dẫn"], ...]
+
+Client Python bị giới hạn bởi GIL ở tải cao: chạy loadtest trên máy/process khác với server
+và tăng --concurrency cho tới khi throughput không tăng thêm.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pytz
+import requests
+
+import config
+from log_setup import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Hỗn hợp request: [(trọng số, mẫu đường dẫn)]. {station} là trạm chọn theo phân bố Zipf
+# (vài trạm được xem nhiều hơn hẳn), {start_Nd} là thời điểm N ngày trước (giờ Việt Nam)
+MIXES = {
+    # App di động/dashboard: chủ yếu snapshot và cảnh báo, thỉnh thoảng mở biểu đồ một trạm
+    "dashboard": [
+        (40, "/api/latest"),
+        (15, "/api/alerts"),
+        (10, "/api/stations"),
+        (15, "/api/stations/{station}"),
+        (12, "/api/historical/{station}?limit=48"),
+        (8, "/api/forecast/{station}?hours=72")
+    ],
+    # Người dùng phân tích: truy vấn lịch sử dài, dự báo dài, export
+    "analyst": [
+        (35, "/api/historical/{station}?start={start_30d}"),
+        (15, "/api/historical/{station}?start={start_365d}"),
+        (20, "/api/forecast/{station}?hours=720&step=60"),
+        (15, "/api/export/{station}?format=ndjson&start={start_90d}"),
+        (10, "/api/latest"),
+        (5, "/api/status")
+    ]
+}
+# Lưu lượng production giả định: 90% dashboard, 10% phân tích
+MIXES["mixed"] = (
+    [(weight * 0.9, path) for weight, path in MIXES["dashboard"]]
+    + [(weight * 0.1, path) for weight, path in MIXES["analyst"]]
+)
+
+START_DAYS = (1, 7, 30, 90, 365)
+
+
+class RequestMix:
+    """
+    Sinh chuỗi đường dẫn request theo trọng số; mỗi client dùng một RNG có seed riêng
+    nên cùng seed cho cùng chuỗi request
+    """
+    
+    def __init__(self, entries: List[Tuple[float, str]], station_ids: List[str],
+                 skew: Optional[float] = None, seed: int = 0):
+        self.templates = [path for _, path in entries]
+        self.cum_weights = np.cumsum([weight for weight, _ in entries]).tolist()
+        skew = config.LOAD_TEST['hot_station_skew'] if skew is None else skew
+        
+        # Độ phổ biến theo Zipf trên thứ tự trạm đã xáo trộn (trạm "nóng" không phụ thuộc tên)
+        self.station_ids = list(station_ids)
+        random.Random(seed).shuffle(self.station_ids)
+        self.station_weights = np.cumsum(
+            1.0 / np.arange(1, len(self.station_ids) + 1) ** skew
+        ).tolist()
+        
+        now = datetime.now(pytz.timezone(config.TIMEZONE))
+        self.params = {
+            f"start_{days}d": (now - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S")
+            for days in START_DAYS
+        }
+    
+    def sample(self, rng: random.Random) -> Tuple[str, str]:
+        """(mẫu đường dẫn dùng làm nhãn thống kê, đường dẫn thực tế)"""
+        template = rng.choices(self.templates, cum_weights=self.cum_weights)[0]
+        station = rng.choices(self.station_ids, cum_weights=self.station_weights)[0]
+        return template, template.format(station=station, **self.params)
+
+
+class LoadTest:
+    """
+    Chạy `concurrency` client trên thread riêng trong `duration` giây, ghi nhận
+    (mẫu đường dẫn, độ trễ, mã trạng thái, số byte) của từng request
+    """
+    
+    def __init__(self, url: str, mix: RequestMix, concurrency: int, duration: float,
+                 rate: Optional[float] = None, warmup: float = 0.0,
+                 timeout: Optional[float] = None, seed: int = 0):
+        self.url = url.rstrip('/')
+        self.mix = mix
+        self.concurrency = concurrency
+        self.duration = duration
+        self.rate = rate
+        self.warmup = warmup
+        self.timeout = timeout or config.LOAD_TEST['timeout_seconds']
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._next_slot = 0
+        self.samples: List[Tuple[str, float, int, int]] = []
+    
+    def _take_slot(self) -> int:
+        with self._lock:
+            slot = self._next_slot
+            self._next_slot += 1
+            return slot
+    
+    def _client(self, index: int, started: float, deadline: float):
+        rng = random.Random(self.seed * 1000003 + index)
+        session = requests.Session()
+        samples = []
+        while True:
+            if self.rate:
+                # Open-loop: thời điểm gửi theo lịch chung, độ trễ tính từ thời điểm đó
+                scheduled = started + self._take_slot() / self.rate
+                if scheduled >= deadline:
+                    break
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+                if scheduled >= deadline:
+                    break
+            
+            template, path = self.mix.sample(rng)
+            try:
+                response = session.get(self.url + path, timeout=self.timeout)
+                status, size = response.status_code, len(response.content)
+            except requests.RequestException:
+                status, size = 0, 0
+            finished = time.perf_counter()
+            if scheduled >= started + self.warmup:
+                samples.append((template, finished - scheduled, status, size))
+        session.close()
+        with self._lock:
+            self.samples.extend(samples)
+    
+    def run(self) -> Dict:
+        started = time.perf_counter()
+        deadline = started + self.warmup + self.duration
+        threads = [
+            threading.Thread(target=self._client, args=(index, started, deadline), name=f"loadtest-{index}")
+            for index in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Request gửi trước deadline có thể kết thúc sau đó: tính thời gian thực tế
+        elapsed = max(time.perf_counter() - started - self.warmup, 1e-9)
+        return summarize(self.samples, elapsed)
+
+
+def summarize(samples: List[Tuple[str, float, int, int]], elapsed: float) -> Dict:
+    """Throughput, tỉ lệ lỗi và phân vị độ trễ (ms) tổng và theo mẫu đường dẫn"""
+    by_route: Dict[str, List[Tuple[float, int, int]]] = defaultdict(list)
+    for template, latency, status, size in samples:
+        by_route[template].append((latency, status, size))
+    
+    def stats(entries: List[Tuple[float, int, int]]) -> Dict:
+        latencies = np.array([latency for latency, _, _ in entries]) * 1000
+        statuses: Dict[str, int] = defaultdict(int)
+        for _, status, _ in entries:
+            statuses[str(status) if status else "error"] += 1
+        errors = sum(1 for _, status, _ in entries if not 200 <= status < 400)
+        result = {
+            "requests": len(entries),
+            "errors": errors,
+            "error_rate": round(errors / len(entries), 4),
+            "throughput_rps": round(len(entries) / elapsed, 1),
+            "bytes": sum(size for _, _, size in entries),
+            "status": dict(statuses),
+            "latency_ms": {
+                f"p{p:g}": round(float(value), 2)
+                for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))
+            }
+        }
+        result["latency_ms"]["max"] = round(float(latencies.max()), 2)
+        return result
+    
+    return {
+        "elapsed_seconds": round(elapsed, 2),
+        "total": stats([entry for entries in by_route.values() for entry in entries]) if samples else None,
+        "routes": {route: stats(entries) for route, entries in sorted(by_route.items())}
+    }
+
+
+def print_report(report: Dict):
+    total = report["total"]
+    if total is None:
+        print("Không có request nào hoàn thành")
+        return
+    
+    header = f"{'route':<52} {'req':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'p99.9':>8} {'max':>8}"
+    print(header)
+    print("-" * len(header))
+    for route, stats in list(report["routes"].items()) + [("TOTAL", total)]:
+        latency = stats["latency_ms"]
+        print(
+            f"{route[:52]:<52} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput_rps']:>8.1f} "
+            f"{latency['p50']:>8.2f} {latency['p90']:>8.2f} {latency['p99']:>8.2f} "
+            f"{latency['p99.9']:>8.2f} {latency['max']:>8.2f}"
+        )
+    print(f"\nThời gian đo: {report['elapsed_seconds']} giây, độ trễ tính bằng ms")
+    print(f"Throughput: {total['throughput_rps']} request/giây, {total['bytes'] / report['elapsed_seconds'] / 1024:,.0f} KiB/giây")
+    print(f"Lỗi: {total['errors']} ({total['error_rate'] * 100:.2f}%), mã trạng thái: {total['status']}")
+
+
+def load_mix(name: Optional[str], mix_file: Optional[str]) -> List[Tuple[float, str]]:
+    if mix_file:
+        with open(mix_file, 'r', encoding='utf-8') as f:
+            return [(float(weight), path) for weight, path in json.load(f)]
+    return MIXES[name]
+
+
+def discover_stations(url: str, timeout: float) -> List[str]:
+    """Danh sách trạm server đang phục vụ (GET /api/stations)"""
+    response = requests.get(f"{url.rstrip('/')}/api/stations", timeout=timeout)
+    response.raise_for_status()
+    return list(response.json()['data'])
+
+
+def serve(data_dir: str, host: str, port: int):
+    """
+    Chạy Flask API trên dữ liệu tổng hợp trong data_dir, không khởi động scheduler
+    (không scrape MRC, snapshot giữ nguyên như lúc sinh)
+    """
+    from synthetic_data import load_stations, register_stations, use_data_dir
+    
+    stations = load_stations(data_dir)
+    use_data_dir(data_dir)
+    register_stations(stations, replace=True)
+    config.LOGS_DIR = os.path.join(data_dir, "logs")
+    Path(config.LOGS_DIR).mkdir(parents=True, exist_ok=True)
+    
+    import app as app_module
+    
+    logger.info(f"Phục vụ API cho {len(stations)} trạm tổng hợp từ {data_dir} tại http://{host}:{port}")
+    app_module.app.run(host=host, port=port, debug=False, threaded=True, use_reloader=False)
+
+
+def main():
+    load_config = config.LOAD_TEST
+    parser = argparse.ArgumentParser(description="Load test API mực nước Mekong")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    serve_parser = subparsers.add_parser("serve", help="Chạy API trên dữ liệu tổng hợp")
+    serve_parser.add_argument('--data-dir', default=config.SYNTHETIC_DATA['data_dir'])
+    serve_parser.add_argument('--host', default="127.0.0.1")
+    serve_parser.add_argument('--port', type=int, default=5050)
+    
+    run_parser = subparsers.add_parser("run", help="Gửi tải tới API và báo cáo")
+    run_parser.add_argument('--url', default=load_config['url'])
+    run_parser.add_argument('--mix', choices=sorted(MIXES), default=load_config['mix'])
+    run_parser.add_argument('--mix-file', help='File JSON [[trọng số, "đường dẫn"], ...], ghi đè --mix')
+    run_parser.add_argument('--concurrency', type=int, default=load_config['concurrency'])
+    run_parser.add_argument('--duration', type=float, default=load_config['duration_seconds'], help='Giây')
+    run_parser.add_argument('--warmup', type=float, default=0.0, help='Giây đầu không tính vào kết quả')
+    run_parser.add_argument('--rate', type=float, help='Open-loop: tổng số request mỗi giây')
+    run_parser.add_argument('--skew', type=float, default=load_config['hot_station_skew'])
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--json', help='Ghi báo cáo JSON vào file này')
+    args = parser.parse_args()
+    
+    if args.command == "serve":
+        serve(args.data_dir, args.host, args.port)
+        return
+    
+    try:
+        station_ids = discover_stations(args.url, load_config['timeout_seconds'])
+    except (requests.RequestException, KeyError, ValueError) as e:
+        logger.error(f"✗ Không lấy được danh sách trạm từ {args.url}: {str(e)}")
+        sys.exit(1)
+    
+    mix = RequestMix(load_mix(args.mix, args.mix_file), station_ids, args.skew, args.seed)
+    mode = f"open-loop {args.rate:g} request/giây" if args.rate else "closed-loop"
+    logger.info(
+        f"Load test {args.url}: mix {args.mix_file or args.mix}, {args.concurrency} client, {mode}, "
+        f"{args.duration:g} giây (+{args.warmup:g} giây warmup), {len(station_ids)} trạm"
+    )
+    
+    report = LoadTest(
+        args.url, mix, args.concurrency, args.duration,
+        rate=args.rate, warmup=args.warmup, seed=args.seed
+    ).run()
+    report["config"] = {
+        "url": args.url,
+        "mix": args.mix_file or args.mix,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "duration_seconds": args.duration,
+        "stations": len(station_ids)
+    }
+    
+    print()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Đã ghi báo cáo vào {args.json}")
+
+
+if __name__ == "__main__":
+    main()
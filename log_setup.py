@@ -0,0 +1,164 @@
+"""
+Module cấu hình logging qua hàng đợi: một thread nền duy nhất format và ghi console/file
+Queue-backed logging with a single background writer, lazy formatting and size-based rotation
+
+Mọi logger ghi vào một QueueHandler trên root logger; việc format và ghi ra console/file do
+QueueListener làm trên thread riêng, nên đĩa chậm không làm request hay lượt scrape phải chờ.
+
+- Format lười: bản ghi vào hàng đợi nguyên trạng (msg + args), chỉ format trên thread ghi.
+  Ở đường nóng dùng logger.debug("... %s", x) thay vì f-string, và chỉ truyền args không bị
+  thay đổi sau lời gọi (chuỗi, số)
+- Hàng đợi có giới hạn: khi đầy, bản ghi mới bị bỏ và được đếm thay vì chặn thread gọi
+- File log xoay vòng theo dung lượng (RotatingFileHandler)
+- LOGGING['format'] = "json": mỗi dòng một object JSON, gồm các trường truyền qua extra={...}
+
+Dùng:
+    from log_setup import setup_logging
+    setup_logging()              # console (gọi lại nhiều lần không sao)
+    setup_logging("api.log")     # thêm file LOGS_DIR/api.log
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import config
+from metrics import LOG_RECORDS_DROPPED
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Thuộc tính chuẩn của LogRecord; thuộc tính khác là trường truyền qua extra
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_lock = threading.Lock()
+_listener: Optional["_QueueListener"] = None
+_file_handlers: Dict[str, logging.Handler] = {}
+
+
+class JsonFormatter(logging.Formatter):
+    """Mỗi bản ghi một dòng JSON: time, level, logger, message, thread và các trường extra"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler không format trên thread gọi và không bao giờ chặn khi hàng đợi đầy
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Cùng process nên không cần pickle: giữ msg/args để thread ghi format sau
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(record.levelname)
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Chờ chỗ trống (thread ghi vẫn đang xả hàng đợi) để không mất tín hiệu dừng khi đầy
+        self.queue.put(self._sentinel)
+    
+    def add_handler(self, handler: logging.Handler):
+        # handle() đọc self.handlers ở mỗi bản ghi: gán tuple mới là đủ an toàn
+        self.handlers = self.handlers + (handler,)
+
+
+def _formatter() -> logging.Formatter:
+    if config.LOGGING['format'] == 'json':
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def _install():
+    global _listener
+    log_config = config.LOGGING
+    
+    console = logging.StreamHandler()
+    console.setFormatter(_formatter())
+    log_queue: queue.Queue = queue.Queue(log_config['queue_size'])
+    _listener = _QueueListener(log_queue, console, respect_handler_level=True)
+    _file_handlers.clear()
+    
+    # Thay handler đồng bộ (basicConfig, lần cài trước trong process cha) bằng hàng đợi
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(NonBlockingQueueHandler(log_queue))
+    root.setLevel(str(log_config['level']).upper())
+    _listener.start()
+
+
+def setup_logging(log_file: Optional[str] = None):
+    """
+    Cài pipeline logging cho process (chỉ lần gọi đầu); log_file là tên file trong LOGS_DIR,
+    được thêm vào thread ghi nếu chưa có
+    """
+    with _lock:
+        if _listener is None:
+            _install()
+            atexit.register(shutdown_logging)
+        
+        if log_file and log_file not in _file_handlers:
+            log_config = config.LOGGING
+            Path(config.LOGS_DIR).mkdir(parents=True, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(config.LOGS_DIR, log_file),
+                maxBytes=log_config['max_bytes'],
+                backupCount=log_config['backup_count'],
+                encoding='utf-8',
+                delay=True
+            )
+            handler.setFormatter(_formatter())
+            _listener.add_handler(handler)
+            _file_handlers[log_file] = handler
+
+
+def shutdown_logging():
+    """Ghi hết các bản ghi còn trong hàng đợi rồi dừng thread ghi (tự gọi khi thoát)"""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _reset_after_fork():
+    # Process con (process pool) không có thread ghi của process cha và không được ghi chung
+    # file xoay vòng: cài lại khóa và hàng đợi mới, chỉ ghi console
+    global _listener, _lock
+    _lock = threading.Lock()
+    if _listener is not None:
+        _listener = None
+        _install()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
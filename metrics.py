@@ -0,0 +1,234 @@
+"""
+Module metrics theo định dạng Prometheus (counter, gauge, histogram có nhãn)
+Lightweight in-process Prometheus metrics registry and text exposition
+
+Mỗi lần ghi nhận chỉ tốn một lần khóa và một phép tìm nhị phân bucket, đủ nhẹ cho
+đường đọc của API. Toàn bộ metrics được định nghĩa ở cuối module và xuất qua GET /metrics.
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket mặc định (giây) cho độ trễ request và các bước cập nhật
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+LAG_BUCKETS = (60, 300, 600, 1800, 3600, 2 * 3600, 4 * 3600, 12 * 3600, 24 * 3600)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+    
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+    
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Giá trị chỉ tăng; nhãn truyền theo thứ tự labelnames"""
+    kind = "counter"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+    
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return self._header() + [
+            f"{self.name}{_label_text(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Gauge(Counter):
+    """Giá trị đặt trực tiếp"""
+    kind = "gauge"
+    
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = float(value)
+
+
+class CallbackGauge(_Metric):
+    """Gauge tính lúc xuất metrics: callback trả về {tuple nhãn: giá trị}"""
+    kind = "gauge"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[Tuple[str, ...], float]]):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+    
+    def render(self) -> List[str]:
+        try:
+            values = self.callback()
+        except Exception:
+            values = {}
+        return self._header() + [
+            f"{self.name}{_label_text(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Histogram bucket cố định; lưu số đếm từng bucket (không tích lũy), cộng dồn khi xuất"""
+    kind = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # tuple nhãn -> [đếm theo bucket (+Inf ở cuối), tổng, số lần]
+        self._series: Dict[Tuple[str, ...], list] = {}
+    
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    @contextmanager
+    def time(self, *labels: str):
+        """Đo thời gian của khối lệnh `with`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = {labels: (list(s[0]), s[1], s[2]) for labels, s in self._series.items()}
+        
+        lines = self._header()
+        for labels, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}")
+            label_text = _label_text(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Tập các metric của process, xuất theo định dạng text của Prometheus"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+    
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+    
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# API
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "mekong_http_request_duration_seconds", "Thời gian xử lý request theo route",
+    ("method", "route", "status")
+)
+HTTP_RESPONSE_SIZE = REGISTRY.histogram(
+    "mekong_http_response_size_bytes", "Kích thước response theo route (không tính response stream)",
+    ("method", "route"), SIZE_BUCKETS
+)
+
+# Cache (result: hit | miss)
+CACHE_REQUESTS = REGISTRY.counter(
+    "mekong_cache_requests_total", "Số lần tra cache theo loại cache và kết quả", ("cache", "result")
+)
+
+# Cập nhật dữ liệu
+UPDATE_STAGE_DURATION = REGISTRY.histogram(
+    "mekong_update_stage_duration_seconds",
+    "Thời gian mỗi bước cập nhật (pipeline: theo từng trạm; chế độ từng bước: cả lượt)",
+    ("stage",), STAGE_BUCKETS
+)
+UPDATE_RUN_DURATION = REGISTRY.histogram(
+    "mekong_update_run_duration_seconds", "Thời gian một lượt update_data", (), STAGE_BUCKETS
+)
+UPDATE_RUNS = REGISTRY.counter(
+    "mekong_update_runs_total", "Số lượt update_data theo kết quả", ("outcome",)
+)
+STATION_PUBLISH_LAG = REGISTRY.histogram(
+    "mekong_station_publish_lag_seconds",
+    "Độ trễ từ điểm quan trắc mới nhất tới lúc được công bố", ("station_id",), LAG_BUCKETS
+)
+STATION_LAST_PUBLISHED = REGISTRY.gauge(
+    "mekong_station_last_published_timestamp_seconds", "Thời điểm công bố gần nhất của trạm", ("station_id",)
+)
+ALERT_TRANSITIONS = REGISTRY.counter(
+    "mekong_alert_transitions_total", "Số lần chuyển mức cảnh báo (sau vùng trễ) theo mức mới", ("to_level",)
+)
+WEBHOOK_DELIVERIES = REGISTRY.counter(
+    "mekong_webhook_deliveries_total", "Số lô webhook đã gửi theo kết quả (delivered | retry | dead)", ("result",)
+)
+
+# Logging
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "mekong_log_records_dropped_total", "Số bản ghi log bị bỏ do hàng đợi log đầy", ("level",)
+)
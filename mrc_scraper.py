@@ -6,8 +6,8 @@ MRC Water Level Data Scraper using Selenium
 import time
 import json
 import logging
-from datetime import datetime
-from typing import Dict, List, Optional
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -19,12 +19,10 @@ from selenium.common.exceptions import TimeoutException, WebDriverException
 from webdriver_manager.chrome import ChromeDriverManager
 
 import config
+from log_setup import setup_logging
 
 # Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -102,7 +100,7 @@ class MRCWaterLevelScraper:
             
             # Tìm và click vào trạm cần lấy dữ liệu
             station_name = self.stations[station_id]['name_en']
-            logger.info(f"Đang tìm trạm {station_name}...")
+            logger.info("Đang tìm trạm %s...", station_name)
             
             # Execute JavaScript để lấy dữ liệu từ Highcharts
             # MRC sử dụng Highcharts để hiển thị dữ liệu
@@ -131,7 +129,7 @@ class MRCWaterLevelScraper:
             """)
             
             if chart_data and chart_data.get('data'):
-                logger.info(f"✓ Đã lấy {len(chart_data['data'])} điểm dữ liệu từ {station_name}")
+                logger.info("✓ Đã lấy %d điểm dữ liệu từ %s", len(chart_data['data']), station_name)
                 return chart_data
             else:
                 logger.warning(f"✗ Không tìm thấy dữ liệu chart cho {station_name}")
@@ -170,7 +168,7 @@ class MRCWaterLevelScraper:
                 try:
                     element = self.driver.find_element(By.XPATH, selector)
                     if element:
-                        logger.info(f"✓ Tìm thấy element cho {station_info['name']}")
+                        logger.info("✓ Tìm thấy element cho %s", station_info['name'])
                         break
                 except:
                     continue
@@ -204,7 +202,31 @@ class MRCWaterLevelScraper:
         Returns:
             Dict chứa dữ liệu của tất cả các trạm
         """
-        results = {}
+        return self.scrape_stations(list(self.stations.keys()))
+    
+    def scrape_stations(self, station_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Scrape dữ liệu của các trạm được chọn trong một phiên WebDriver
+        
+        Args:
+            station_ids: Danh sách ID trạm cần scrape
+            
+        Returns:
+            Dict chứa dữ liệu của các trạm
+        """
+        return dict(self.iter_stations(station_ids))
+    
+    def iter_stations(self, station_ids: List[str]) -> Iterator[Tuple[str, Dict]]:
+        """
+        Scrape lần lượt các trạm trong một phiên WebDriver, trả về từng trạm ngay khi xong
+        
+        Dùng cho pipeline cập nhật: trạm đã scrape được xử lý/công bố trong khi trạm
+        kế tiếp vẫn đang được lấy. Đóng generator giữa chừng sẽ đóng WebDriver.
+        
+        Yields:
+            Tuple (station_id, dữ liệu trạm)
+        """
+        scraped = 0
         
         try:
             # Khởi tạo driver
@@ -236,27 +258,28 @@ class MRCWaterLevelScraper:
                 
             except TimeoutException:
                 logger.error("✗ Timeout khi load trang MRC")
-                return results
+                return
             
             # Scrape từng trạm
-            for station_id in self.stations.keys():
+            for station_id in station_ids:
                 logger.info(f"\n{'='*50}")
-                logger.info(f"Đang scrape trạm: {self.stations[station_id]['name']}")
+                logger.info("Đang scrape trạm: %s", self.stations[station_id]['name'], extra={"station_id": station_id})
                 
                 station_data = self._parse_station_data(station_id)
                 
-                if station_data:
-                    results[station_id] = station_data
-                else:
+                if not station_data:
                     # Tạo dữ liệu mẫu nếu scrape thất bại (để test)
-                    logger.warning(f"Sử dụng dữ liệu mẫu cho {station_id}")
-                    results[station_id] = self._generate_sample_data(station_id)
+                    logger.warning("Sử dụng dữ liệu mẫu cho %s", station_id, extra={"station_id": station_id})
+                    station_data = self._generate_sample_data(station_id)
+                
+                scraped += 1
+                yield station_id, station_data
                 
                 # Delay giữa các request
                 time.sleep(config.REQUEST_DELAY)
             
             logger.info(f"\n{'='*50}")
-            logger.info(f"✓ Hoàn thành scrape {len(results)}/{len(self.stations)} trạm")
+            logger.info(f"✓ Hoàn thành scrape {scraped}/{len(station_ids)} trạm")
             
         except WebDriverException as e:
             logger.error(f"✗ Lỗi WebDriver: {str(e)}")
@@ -266,8 +289,6 @@ class MRCWaterLevelScraper:
             if self.driver:
                 self.driver.quit()
                 logger.info("WebDriver đã được đóng")
-        
-        return results
     
     def _generate_sample_data(self, station_id: str) -> Dict:
         """
@@ -333,6 +354,99 @@ class MRCWaterLevelScraper:
         finally:
             if self.driver:
                 self.driver.quit()
+    
+    def fetch_history(self, station_id: str, start_ms: int, end_ms: int) -> Optional[Dict]:
+        """
+        Lấy dữ liệu của một trạm trong [start_ms, end_ms) qua backend backfill
+        
+        Trang MRC (Highcharts) chỉ hiển thị cửa sổ hiện tại nên backfill dùng backend riêng
+        theo config.BACKFILL['backend']: "http" hoặc "sample".
+        
+        Returns:
+            Dict cùng dạng với kết quả scrape ({station_id, ..., raw_data: {data: [...]}})
+        """
+        if station_id not in self.stations:
+            logger.error(f"✗ Không tìm thấy trạm với ID: {station_id}")
+            return None
+        
+        backend = config.BACKFILL['backend']
+        if backend == 'http':
+            data_points = self._fetch_history_http(station_id, start_ms, end_ms)
+        elif backend == 'sample':
+            data_points = self._generate_sample_range(station_id, start_ms, end_ms)
+        else:
+            raise ValueError(f"Backend backfill không hợp lệ: {backend}")
+        
+        station_info = self.stations[station_id]
+        return {
+            "station_id": station_id,
+            "station_name": station_info['name'],
+            "station_name_en": station_info['name_en'],
+            "data_source": backend,
+            "raw_data": {
+                "name": station_info['name'],
+                "data": data_points,
+                "unit": "m"
+            }
+        }
+    
+    def _fetch_history_http(self, station_id: str, start_ms: int, end_ms: int) -> List[Dict]:
+        """
+        Gọi endpoint JSON theo khoảng thời gian; chấp nhận list điểm hoặc {"data": [...]},
+        timestamp dạng epoch ms hoặc chuỗi ISO 8601
+        """
+        import requests
+        
+        url_template = config.BACKFILL['http_url']
+        if not url_template:
+            raise ValueError("Chưa cấu hình BACKFILL['http_url'] cho backend http")
+        
+        station_info = self.stations[station_id]
+        url = url_template.format(station_id=station_id, station_name_en=station_info['name_en'])
+        response = requests.get(
+            url,
+            params={
+                "start": datetime.fromtimestamp(start_ms / 1000, tz=timezone.utc).isoformat(),
+                "end": datetime.fromtimestamp(end_ms / 1000, tz=timezone.utc).isoformat()
+            },
+            timeout=config.BACKFILL['http_timeout']
+        )
+        response.raise_for_status()
+        
+        payload = response.json()
+        points = payload.get('data', []) if isinstance(payload, dict) else payload
+        
+        data_points = []
+        for point in points:
+            timestamp = point.get('timestamp')
+            if isinstance(timestamp, str):
+                timestamp = int(datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp() * 1000)
+            if timestamp is None or not start_ms <= timestamp < end_ms:
+                continue
+            data_points.append({"timestamp": int(timestamp), "value": point.get('value')})
+        return data_points
+    
+    def _generate_sample_range(self, station_id: str, start_ms: int, end_ms: int) -> List[Dict]:
+        """
+        Tạo dữ liệu mẫu dạng triều cho một khoảng thời gian (xác định, chạy lại cho cùng kết quả)
+        """
+        import math
+        
+        station_info = self.stations[station_id]
+        base_level = station_info['warning_threshold'] - 0.5
+        step_ms = config.BACKFILL['sample_interval_minutes'] * 60 * 1000
+        first = -(-start_ms // step_ms) * step_ms
+        
+        data_points = []
+        for timestamp in range(first, end_ms, step_ms):
+            hours = timestamp / 3600000
+            water_level = (
+                base_level
+                + 0.4 * math.sin(2 * math.pi * hours / 12.42)
+                + 0.15 * math.sin(2 * math.pi * hours / 23.93)
+            )
+            data_points.append({"timestamp": timestamp, "value": round(water_level, 2)})
+        return data_points
 
 
 def test_scraper():
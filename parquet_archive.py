@@ -0,0 +1,253 @@
+"""
+Module kho lưu trữ Parquet dài hạn, phân vùng theo trạm/tháng
+Station/month-partitioned Parquet archive of observed water levels
+
+Cấu trúc thư mục (hive partitioning, tháng theo giờ Việt Nam):
+    data/archive/station_id=<id>/month=YYYY-MM/part-0.parquet
+
+Chạy:
+    python parquet_archive.py export
+    python parquet_archive.py query can_tho 2024-01-01 2024-02-01 [output.csv|output.parquet]
+"""
+
+import logging
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pytz
+
+import config
+from log_setup import setup_logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow là dependency tùy chọn
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Watermark recorded_at của lần export gần nhất (lưu trong store_meta của HistoricalStore)
+EXPORT_META_KEY = "parquet_archive_exported_at"
+
+PART_FILE = "part-0.parquet"
+
+
+def is_available() -> bool:
+    """pyarrow đã được cài hay chưa"""
+    return pa is not None
+
+
+class ParquetArchive:
+    """
+    Kho Parquet chỉ chứa điểm quan trắc thô, mỗi (trạm, tháng) là một file
+    
+    - Export tăng dần từ HistoricalStore: chỉ ghi lại các tháng có điểm mới/sửa,
+      gộp với file đã có nên điểm thô vẫn còn sau khi store đã nén xuống tầng theo giờ
+    - Truy vấn chỉ mở file của trạm/tháng cần đọc; điều kiện thời gian được đẩy xuống
+      thống kê min/max của từng row group, chỉ đọc các cột được yêu cầu
+    """
+    
+    def __init__(self, root: Optional[str] = None, row_group_size: Optional[int] = None,
+                 compression: Optional[str] = None):
+        if pa is None:
+            raise ImportError("Cần cài pyarrow để dùng Parquet archive: pip install pyarrow")
+        
+        archive_config = config.PARQUET_ARCHIVE
+        self.root = root or archive_config["dir"]
+        self.row_group_size = row_group_size or archive_config["row_group_size"]
+        self.compression = compression or archive_config["compression"]
+        self.timezone = pytz.timezone(config.TIMEZONE)
+        self.schema = pa.schema([
+            ("timestamp", pa.timestamp("ms", tz="UTC")),
+            ("water_level", pa.float64())
+        ])
+        self._partitioning = ds.partitioning(
+            pa.schema([("station_id", pa.string()), ("month", pa.string())]),
+            flavor="hive"
+        )
+    
+    def export_from_store(self, store) -> int:
+        """
+        Ghi các partition có điểm thô được thêm/sửa kể từ lần export trước
+        
+        Returns:
+            Số partition (trạm, tháng) đã ghi
+        """
+        watermark = int(store.get_meta(EXPORT_META_KEY) or 0)
+        partitions, new_watermark = store.changed_partitions(watermark, self._utc_offset_ms())
+        if not partitions:
+            return 0
+        
+        # Chỉ đọc các điểm đã đổi; write_partition gộp chúng với file hiện có của tháng
+        for station_id, month in partitions:
+            start_ms, end_ms = self._month_bounds(month)
+            self.write_partition(
+                station_id, month, *store.read_observations(station_id, start_ms, end_ms, recorded_after=watermark)
+            )
+        
+        store.set_meta(EXPORT_META_KEY, str(new_watermark))
+        logger.info(f"✓ Đã ghi {len(partitions)} partition Parquet vào {self.root}")
+        return len(partitions)
+    
+    def write_partition(self, station_id: str, month: str, timestamps: np.ndarray, levels: np.ndarray):
+        """
+        Gộp điểm mới vào partition (trạm, tháng); trùng timestamp thì điểm mới thắng
+        """
+        path = self._partition_path(station_id, month)
+        
+        if os.path.exists(path):
+            existing = pq.read_table(path, columns=["timestamp", "water_level"])
+            timestamps = np.concatenate([
+                existing.column("timestamp").cast(pa.int64()).to_numpy(), timestamps
+            ])
+            levels = np.concatenate([existing.column("water_level").to_numpy(), levels])
+        
+        # Sắp xếp ổn định rồi giữ bản ghi cuối của mỗi timestamp (bản ghi mới đứng sau)
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, levels = timestamps[order], levels[order]
+        keep = np.r_[timestamps[1:] != timestamps[:-1], True] if timestamps.size else np.ones(0, dtype=bool)
+        
+        table = pa.table(
+            {
+                "timestamp": pa.array(timestamps[keep], type=pa.int64()).cast(self.schema.field("timestamp").type),
+                "water_level": pa.array(levels[keep], type=pa.float64())
+            },
+            schema=self.schema
+        )
+        
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        pq.write_table(table, tmp_path, row_group_size=self.row_group_size, compression=self.compression)
+        os.replace(tmp_path, path)
+    
+    def query(self, station_id: str, start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+              columns: Optional[List[str]] = None) -> "pa.Table":
+        """
+        Đọc điểm quan trắc của một trạm trong [start_ms, end_ms)
+        
+        Args:
+            columns: Cột cần đọc (mặc định timestamp, water_level, station_id)
+        """
+        paths = [
+            self._partition_path(station_id, month)
+            for month in self._months(station_id, start_ms, end_ms)
+        ]
+        paths = [path for path in paths if os.path.exists(path)]
+        columns = columns or ["timestamp", "water_level", "station_id"]
+        if not paths:
+            return pa.table(
+                {name: pa.array([], type=self._column_type(name)) for name in columns}
+            )
+        
+        dataset = ds.dataset(
+            paths,
+            schema=self.schema.append(pa.field("station_id", pa.string())).append(pa.field("month", pa.string())),
+            format="parquet",
+            partitioning=self._partitioning,
+            partition_base_dir=self.root
+        )
+        
+        condition = None
+        time_type = self.schema.field("timestamp").type
+        if start_ms is not None:
+            condition = ds.field("timestamp") >= pa.scalar(start_ms, type=pa.int64()).cast(time_type)
+        if end_ms is not None:
+            before_end = ds.field("timestamp") < pa.scalar(end_ms, type=pa.int64()).cast(time_type)
+            condition = before_end if condition is None else condition & before_end
+        
+        return dataset.to_table(columns=columns, filter=condition)
+    
+    def _months(self, station_id: str, start_ms: Optional[int], end_ms: Optional[int]) -> List[str]:
+        """Các tháng của trạm giao với khoảng thời gian (cắt tỉa partition trước khi mở file)"""
+        station_dir = os.path.join(self.root, f"station_id={station_id}")
+        if not os.path.isdir(station_dir):
+            return []
+        
+        months = sorted(
+            name.split("=", 1)[1] for name in os.listdir(station_dir) if name.startswith("month=")
+        )
+        if start_ms is not None:
+            first = self._month_keys(np.array([start_ms], dtype=np.int64))[0]
+            months = [month for month in months if month >= first]
+        if end_ms is not None:
+            last = self._month_keys(np.array([end_ms - 1], dtype=np.int64))[0]
+            months = [month for month in months if month <= last]
+        return months
+    
+    def _month_keys(self, timestamps_ms: np.ndarray) -> List[str]:
+        """Khóa tháng 'YYYY-MM' theo giờ địa phương của một mảng epoch ms"""
+        if timestamps_ms.size == 0:
+            return []
+        local = (timestamps_ms + self._utc_offset_ms()).astype("datetime64[ms]").astype("datetime64[M]")
+        return np.datetime_as_string(local).tolist()
+    
+    def _utc_offset_ms(self) -> int:
+        return int(datetime.now(self.timezone).utcoffset().total_seconds() * 1000)
+    
+    def _month_bounds(self, month: str) -> Tuple[int, int]:
+        """Khoảng [đầu tháng, đầu tháng sau) theo giờ địa phương, dạng epoch ms"""
+        year, month_number = (int(part) for part in month.split("-"))
+        next_year, next_month = (year + 1, 1) if month_number == 12 else (year, month_number + 1)
+        start = self.timezone.localize(datetime(year, month_number, 1))
+        end = self.timezone.localize(datetime(next_year, next_month, 1))
+        return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+    
+    def _partition_path(self, station_id: str, month: str) -> str:
+        return os.path.join(self.root, f"station_id={station_id}", f"month={month}", PART_FILE)
+    
+    def _column_type(self, name: str):
+        if name in self.schema.names:
+            return self.schema.field(name).type
+        return pa.string()
+
+
+def _parse_cli_time(value: str) -> int:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = pytz.timezone(config.TIMEZONE).localize(parsed)
+    return int(parsed.timestamp() * 1000)
+
+
+def main():
+    """
+    CLI:
+        python parquet_archive.py export
+        python parquet_archive.py query <station_id> <start> <end> [output.csv|output.parquet]
+    """
+    setup_logging()
+    
+    if len(sys.argv) >= 2 and sys.argv[1] == 'export':
+        from history_store import HistoricalStore
+        
+        written = ParquetArchive().export_from_store(HistoricalStore())
+        print(f"Đã ghi {written} partition vào {config.PARQUET_ARCHIVE['dir']}")
+        return
+    
+    if len(sys.argv) >= 5 and sys.argv[1] == 'query':
+        station_id = sys.argv[2]
+        table = ParquetArchive().query(station_id, _parse_cli_time(sys.argv[3]), _parse_cli_time(sys.argv[4]))
+        
+        if len(sys.argv) >= 6:
+            output = sys.argv[5]
+            if output.endswith('.parquet'):
+                pq.write_table(table, output)
+            else:
+                pa_csv.write_csv(table, output)
+            print(f"Đã ghi {table.num_rows} dòng vào {output}")
+        else:
+            print(table.to_pandas().to_string(index=False))
+        return
+    
+    print(__doc__)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Module phát hiện đỉnh triều vector hóa bằng NumPy
+Vectorized tide peak (high/low water) detection
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+# Dung sai so sánh độ nổi bật: 1.67 - 1.65 có thể ra 0.01999... do biểu diễn float
+_PROMINENCE_TOLERANCE = 1e-6
+
+
+def find_tide_extrema(values, times=None, min_prominence: float = 0.0,
+                      min_separation: float = 0, groups=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Tìm chỉ số các đỉnh triều cao/thấp bằng NumPy (vector hóa, không vòng lặp Python)
+    
+    Các đoạn bằng nhau liên tiếp (plateau, thường gặp khi làm tròn 1 cm) được gộp
+    thành một "run"; đỉnh nằm ở giữa plateau. Dao động nhỏ hơn min_prominence (vd: đỉnh
+    có khấc 1.80, 1.79, 1.80) được gộp vào đỉnh/chân thật thay vì làm mất cả hai đỉnh,
+    xem _prominent_extrema.
+    
+    Args:
+        values: Mảng mực nước (đã sắp xếp theo thời gian)
+        times: Mảng thời gian tương ứng (vd: epoch ms). Nếu None dùng chỉ số mẫu
+        min_prominence: Độ nổi bật tối thiểu (cùng đơn vị với values)
+        min_separation: Khoảng cách tối thiểu giữa hai đỉnh cùng loại
+            (cùng đơn vị với times)
+        groups: Mã nhóm (vd: trạm) của từng điểm, không giảm. Khi có, nhiều chuỗi được
+            ghép liền nhau và xử lý trong cùng một lượt mà không có đỉnh nào vắt qua ranh giới
+    
+    Returns:
+        Tuple (high_idx, low_idx) - mảng chỉ số int64 tăng dần
+    """
+    v = np.asarray(values, dtype=np.float64)
+    n = v.size
+    empty = np.empty(0, dtype=np.int64)
+    if n < 3:
+        return empty, empty
+    
+    # Gộp plateau: mỗi run là một đoạn giá trị bằng nhau liên tiếp (không vắt qua nhóm)
+    boundary = v[1:] != v[:-1]
+    if groups is not None:
+        g = np.asarray(groups)
+        boundary |= g[1:] != g[:-1]
+    run_starts = np.flatnonzero(np.r_[True, boundary])
+    if run_starts.size < 3:
+        return empty, empty
+    run_ends = np.r_[run_starts[1:] - 1, n - 1]
+    run_vals = v[run_starts]
+    
+    # Cực trị là run có hướng đổi dấu hai bên (NaN cho sign NaN -> bị loại)
+    step = np.sign(np.diff(run_vals))
+    if groups is not None:
+        run_groups = g[run_starts]
+        step[run_groups[1:] != run_groups[:-1]] = 0
+    is_high = (step[:-1] > 0) & (step[1:] < 0)
+    is_low = (step[:-1] < 0) & (step[1:] > 0)
+    
+    turning = np.flatnonzero(is_high | is_low) + 1
+    if turning.size == 0:
+        return empty, empty
+    turning_high = is_high[turning - 1]
+    
+    if min_prominence > 0:
+        if groups is not None:
+            # Hai đầu chuỗi của nhóm chứa cực trị
+            turning_groups = run_groups[turning]
+            first_run = np.searchsorted(run_groups, turning_groups, side='left')
+            last_run = np.searchsorted(run_groups, turning_groups, side='right') - 1
+        else:
+            turning_groups = np.zeros(turning.size, dtype=np.int64)
+            first_run = np.zeros(turning.size, dtype=np.int64)
+            last_run = np.full(turning.size, run_vals.size - 1)
+        keep = _prominent_extrema(
+            run_vals[turning], turning_groups, run_vals[first_run], run_vals[last_run], min_prominence
+        )
+        turning = turning[keep]
+        turning_high = turning_high[keep]
+    
+    # Vị trí đỉnh là giữa plateau
+    peak_idx = (run_starts[turning] + run_ends[turning]) // 2
+    high_idx = peak_idx[turning_high].astype(np.int64)
+    low_idx = peak_idx[~turning_high].astype(np.int64)
+    
+    if min_separation > 0:
+        positions = np.arange(n) if times is None else np.asarray(times)
+        point_groups = None if groups is None else g
+        high_idx = _enforce_peak_separation(high_idx, v, positions, min_separation, point_groups)
+        low_idx = _enforce_peak_separation(low_idx, -v, positions, min_separation, point_groups)
+    
+    return high_idx, low_idx
+
+
+def _prominent_extrema(values: np.ndarray, groups: np.ndarray, start_values: np.ndarray,
+                       end_values: np.ndarray, min_prominence: float) -> np.ndarray:
+    """
+    Mask các cực trị (xen kẽ cao/thấp) còn lại sau khi loại dao động nhỏ hơn min_prominence
+    
+    Lặp gộp cặp cực trị liền kề có biên độ dao động (swing) nhỏ nhất: bỏ cả cặp thì hai cực
+    trị hai bên nối trực tiếp với biên độ lớn hơn, nên trong cặp đỉnh (hoặc chân) cách nhau
+    bởi một khấc nhỏ, đỉnh cao hơn (chân thấp hơn) được giữ - tương đương đo độ nổi bật
+    theo chân thật của đỉnh. Sau đó bỏ cực trị đầu/cuối mỗi nhóm còn cách đầu/cuối chuỗi
+    ít hơn min_prominence.
+    
+    Mỗi vòng gộp đồng thời mọi swing nhỏ nhất cục bộ (các cặp này không chung cực trị),
+    nên số vòng phụ thuộc độ sâu các cụm nhiễu, không phụ thuộc độ dài chuỗi.
+    
+    Args:
+        values: Giá trị các cực trị theo thời gian
+        groups: Nhóm của từng cực trị (không giảm)
+        start_values, end_values: Giá trị đầu/cuối chuỗi của nhóm chứa từng cực trị
+    """
+    keep = np.ones(values.size, dtype=bool)
+    threshold = min_prominence - _PROMINENCE_TOLERANCE
+    
+    while True:
+        idx = np.flatnonzero(keep)
+        if idx.size < 2:
+            break
+        swing = np.abs(np.diff(values[idx]))
+        swing[groups[idx[1:]] != groups[idx[:-1]]] = np.inf
+        left = np.r_[np.inf, swing[:-1]]
+        right = np.r_[swing[1:], np.inf]
+        candidate = (swing < threshold) & (swing <= left) & (swing <= right)
+        if not candidate.any():
+            break
+        # Các swing ứng viên liền nhau (bằng nhau) chung cực trị: lấy xen kẽ trong mỗi dãy
+        positions = np.arange(swing.size)
+        run_start = candidate & ~np.r_[False, candidate[:-1]]
+        offset = positions - np.maximum.accumulate(np.where(run_start, positions, 0))
+        merge = np.flatnonzero(candidate & (offset % 2 == 0))
+        keep[idx[merge]] = False
+        keep[idx[merge + 1]] = False
+    
+    while True:
+        idx = np.flatnonzero(keep)
+        if idx.size == 0:
+            break
+        idx_groups = groups[idx]
+        first = np.r_[True, idx_groups[1:] != idx_groups[:-1]]
+        last = np.r_[idx_groups[1:] != idx_groups[:-1], True]
+        drop = (
+            (first & (np.abs(values[idx] - start_values[idx]) < threshold))
+            | (last & (np.abs(values[idx] - end_values[idx]) < threshold))
+        )
+        if not drop.any():
+            break
+        keep[idx[drop]] = False
+    
+    return keep
+
+
+def _enforce_peak_separation(idx: np.ndarray, score: np.ndarray, positions: np.ndarray,
+                             min_separation: float, groups=None) -> np.ndarray:
+    """
+    Loại các đỉnh quá gần nhau theo thứ tự ưu tiên (như scipy find_peaks(distance=))
+    
+    Duyệt đỉnh từ score cao xuống thấp: đỉnh chưa bị loại được giữ và chỉ loại các đỉnh
+    cách nó dưới min_separation. Với chuỗi a > b > c (a sát b, b sát c, a xa c), b bị loại
+    nên c được giữ. Chỉ các đỉnh nằm trong cụm đỉnh sát nhau mới phải duyệt tuần tự.
+    """
+    if idx.size < 2:
+        return idx
+    
+    peak_positions = positions[idx]
+    close = np.diff(peak_positions) < min_separation
+    if groups is not None:
+        peak_groups = groups[idx]
+        close &= peak_groups[1:] == peak_groups[:-1]
+    if not close.any():
+        return idx
+    
+    keep = np.ones(idx.size, dtype=bool)
+    in_cluster = np.r_[close, False] | np.r_[False, close]
+    cluster = np.flatnonzero(in_cluster)
+    # Ưu tiên score cao; bằng nhau thì đỉnh đứng trước
+    order = cluster[np.argsort(-score[idx[cluster]], kind='stable')]
+    
+    for i in order.tolist():
+        if not keep[i]:
+            continue
+        j = i - 1
+        while j >= 0 and peak_positions[i] - peak_positions[j] < min_separation \
+                and (groups is None or peak_groups[j] == peak_groups[i]):
+            keep[j] = False
+            j -= 1
+        j = i + 1
+        while j < idx.size and peak_positions[j] - peak_positions[i] < min_separation \
+                and (groups is None or peak_groups[j] == peak_groups[i]):
+            keep[j] = False
+            j += 1
+    return idx[keep]
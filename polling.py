@@ -0,0 +1,129 @@
+"""
+Module lập lịch cập nhật thích ứng theo từng trạm
+Adaptive per-station polling cadence driven by water level and trend
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import config
+
+
+class AdaptivePollingPolicy:
+    """
+    Tính khoảng cách tới lần cập nhật kế tiếp của một trạm
+    
+    - Mực nước cách ngưỡng cảnh báo dưới warning_margin (hoặc đã vượt): nhịp nhanh nhất
+    - Đang lên/xuống nhanh: rút ngắn theo tốc độ; đang lên thì cập nhật ít nhất
+      1/lead_fraction lần trước thời điểm dự kiến chạm ngưỡng cảnh báo
+    - Ổn định: giãn dần nhịp theo stable_growth
+    Kết quả luôn nằm trong [min_interval_seconds, max_interval_seconds].
+    """
+    
+    def __init__(self, polling_config: Optional[Dict] = None, base_interval: Optional[float] = None):
+        polling_config = polling_config or config.ADAPTIVE_POLLING
+        self.min_interval = polling_config['min_interval_seconds']
+        self.max_interval = polling_config['max_interval_seconds']
+        self.warning_margin = polling_config['warning_margin']
+        self.rate_scale = polling_config['rate_scale']
+        self.stable_growth = polling_config['stable_growth']
+        self.lead_fraction = polling_config['lead_fraction']
+        self.base_interval = base_interval or config.UPDATE_INTERVAL
+    
+    def next_interval(self, result: Dict, station_info: Dict,
+                      previous: Optional[float] = None) -> Tuple[float, str]:
+        """
+        Args:
+            result: Kết quả xử lý của trạm (WaterLevelProcessor)
+            station_info: Cấu hình trạm (config.STATIONS)
+            previous: Khoảng cách đã dùng ở lần trước (giây)
+        
+        Returns:
+            Tuple (số giây tới lần cập nhật kế tiếp, lý do)
+        """
+        level = result['current']['water_level']
+        rate = result.get('trend', {}).get('rate') or 0.0
+        distance = station_info['warning_threshold'] - level
+        
+        if distance <= self.warning_margin:
+            return float(self.min_interval), "near_warning"
+        
+        if abs(rate) < self.rate_scale:
+            interval = (previous or self.base_interval) * self.stable_growth
+            return self._clamp(interval), "stable"
+        
+        interval = self.base_interval / (1 + abs(rate) / self.rate_scale)
+        reason = "changing"
+        if rate > 0:
+            # Thời gian (giây) dự kiến chạm ngưỡng cảnh báo nếu giữ tốc độ hiện tại
+            seconds_to_warning = distance / rate * 3600
+            if self.lead_fraction * seconds_to_warning < interval:
+                interval = self.lead_fraction * seconds_to_warning
+                reason = "rising_to_warning"
+        return self._clamp(interval), reason
+    
+    def _clamp(self, interval: float) -> float:
+        return float(min(max(interval, self.min_interval), self.max_interval))
+
+
+class PollingSchedule:
+    """
+    Thời điểm đến hạn cập nhật của từng trạm (thread-safe)
+    
+    Trạm chưa từng cập nhật đến hạn ngay. Trạm lỗi được thử lại sau nhịp nhanh nhất.
+    """
+    
+    def __init__(self, station_ids: Iterable[str], policy: Optional[AdaptivePollingPolicy] = None,
+                 batch_window: Optional[float] = None):
+        self.policy = policy or AdaptivePollingPolicy()
+        self.batch_window = (
+            config.ADAPTIVE_POLLING['batch_window_seconds'] if batch_window is None else batch_window
+        )
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {
+            station_id: {"next_due": 0.0, "interval": None, "reason": "initial", "last_polled": None}
+            for station_id in station_ids
+        }
+    
+    def due_stations(self, now: Optional[float] = None) -> List[str]:
+        """
+        Các trạm đã đến hạn; nếu có, gom thêm các trạm sắp đến hạn trong batch_window
+        để dùng chung một phiên scrape
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if not any(entry["next_due"] <= now for entry in self._entries.values()):
+                return []
+            return [
+                station_id for station_id, entry in self._entries.items()
+                if entry["next_due"] <= now + self.batch_window
+            ]
+    
+    def record(self, processed_data: Dict[str, Dict], requested: Optional[Iterable[str]] = None,
+               now: Optional[float] = None):
+        """
+        Cập nhật lịch sau một lượt xử lý; trạm được yêu cầu nhưng không có kết quả coi như lỗi
+        """
+        now = time.time() if now is None else now
+        requested = list(processed_data.keys()) if requested is None else list(requested)
+        
+        with self._lock:
+            for station_id in requested:
+                entry = self._entries.setdefault(
+                    station_id, {"next_due": 0.0, "interval": None, "reason": "initial", "last_polled": None}
+                )
+                result = processed_data.get(station_id)
+                if result is None:
+                    interval, reason = float(self.policy.min_interval), "retry"
+                else:
+                    interval, reason = self.policy.next_interval(
+                        result, config.STATIONS[station_id], entry["interval"]
+                    )
+                    entry["last_polled"] = now
+                entry.update(next_due=now + interval, interval=interval, reason=reason)
+    
+    def snapshot(self) -> Dict[str, Dict]:
+        """Lịch hiện tại của từng trạm (cho /api/status)"""
+        with self._lock:
+            return {station_id: dict(entry) for station_id, entry in self._entries.items()}
@@ -0,0 +1,145 @@
+"""
+Module profiling theo yêu cầu: profile một request API hoặc N lượt cập nhật kế tiếp
+Opt-in cProfile / sampling profiles for API requests and scheduler runs
+
+Không có chi phí khi tắt: API chỉ kiểm tra token đã cấu hình hay chưa, scheduler chỉ
+kiểm tra bộ đếm số lượt còn phải profile.
+
+Định dạng kết quả:
+    pstats     file cProfile nhị phân (snakeviz, python -m pstats, flameprof)
+    text       bảng pstats sắp theo thời gian tích lũy
+    collapsed  stack gộp từ sampling (flamegraph.pl, speedscope, inferno)
+"""
+
+import cProfile
+import hmac
+import io
+import logging
+import marshal
+import pstats
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("pstats", "text", "collapsed")
+
+
+def token_matches(supplied: Optional[str]) -> bool:
+    """So sánh token (thời gian hằng) với PROFILING['token']; luôn False nếu chưa cấu hình token"""
+    expected = config.PROFILING['token']
+    if not expected or not supplied:
+        return False
+    return hmac.compare_digest(supplied.encode('utf-8'), expected.encode('utf-8'))
+
+
+def stats_bytes(profile: cProfile.Profile) -> bytes:
+    """Nội dung file .prof (giống Profile.dump_stats) để trả về qua HTTP"""
+    profile.create_stats()
+    return marshal.dumps(profile.stats)
+
+
+def stats_text(profile: cProfile.Profile, limit: Optional[int] = None) -> str:
+    """Bảng pstats sắp theo cumulative time, giới hạn `limit` dòng"""
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit or config.PROFILING['text_top'])
+    return stream.getvalue()
+
+
+class SamplingProfiler:
+    """
+    Lấy mẫu stack của một thread mỗi `interval` giây bằng một thread nền, gộp thành
+    định dạng collapsed ("frame;frame;frame số_mẫu") cho flame graph
+    """
+    
+    def __init__(self, thread_id: Optional[int] = None, interval: Optional[float] = None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval or config.PROFILING['sample_interval_seconds']
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> str:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.collapsed()
+    
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+
+class RunProfiler:
+    """
+    Profile N lượt cập nhật kế tiếp (PROFILING['profile_next_runs']), ghi ra output_dir:
+    <thời điểm>-<nhãn>.prof và .txt cho mỗi lượt
+    """
+    
+    def __init__(self, remaining: Optional[int] = None, output_dir: Optional[str] = None):
+        profiling_config = config.PROFILING
+        self.remaining = profiling_config['profile_next_runs'] if remaining is None else remaining
+        self.output_dir = output_dir or profiling_config['output_dir']
+        self._lock = threading.Lock()
+    
+    def _take(self) -> bool:
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+    
+    @contextmanager
+    def maybe_profile(self, label: str):
+        """
+        Profile khối lệnh nếu còn lượt cần profile; ngược lại không làm gì
+        
+        Chỉ profile thread gọi: trong pipeline đó là thread xử lý/ghi, thread scrape
+        (chủ yếu chờ WebDriver) không nằm trong profile.
+        """
+        if self.remaining <= 0 or not self._take():
+            yield
+            return
+        
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._write(profile, label)
+    
+    def _write(self, profile: cProfile.Profile, label: str):
+        try:
+            Path(self.output_dir).mkdir(parents=True, exist_ok=True)
+            stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+            base = Path(self.output_dir) / f"{stamp}-{label}"
+            profile.dump_stats(f"{base}.prof")
+            with open(f"{base}.txt", 'w', encoding='utf-8') as f:
+                f.write(stats_text(profile))
+            logger.info(f"✓ Đã ghi profile lượt cập nhật vào {base}.prof (còn {self.remaining} lượt)")
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi ghi profile: {str(e)}")
@@ -0,0 +1,217 @@
+"""
+Module định dạng response nhị phân dạng cột (MessagePack, Arrow IPC) chọn theo header Accept
+Columnar MessagePack / Arrow IPC response encodings negotiated from the Accept header
+
+Chuỗi điểm {timestamp, datetime, water_level} được chuyển thành khối cột: timestamp int64
+(epoch ms), water_level float32; cột datetime bỏ đi vì suy ra được từ timestamp.
+
+- application/msgpack: cùng cấu trúc document như JSON, mỗi danh sách điểm thay bằng
+  {"length": n, "dtypes": {...}, "columns": {...}}; cột số là bytes little-endian
+  (numpy.frombuffer(columns["timestamp"], "<i8")), cột chuỗi là mảng chuỗi
+- application/vnd.apache.arrow.stream: một bảng dạng dài gồm mọi điểm (thêm cột station_id
+  dictionary khi có nhiều trạm); phần còn lại của document là JSON trong schema metadata
+  "document" (pyarrow.ipc.open_stream(body).read_all())
+
+Cả hai thư viện là tùy chọn: định dạng thiếu thư viện không được chọn, client chỉ chấp nhận
+định dạng đó nhận 406.
+"""
+
+import json
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # msgpack là dependency tùy chọn
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow là dependency tùy chọn
+    pa = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+# Thứ tự ưu tiên khi client chấp nhận nhiều loại (*/* hoặc cùng q): JSON trước để giữ hành vi cũ
+MEDIA_TYPES = {
+    JSON: "json",
+    MSGPACK: "msgpack",
+    "application/x-msgpack": "msgpack",
+    ARROW: "arrow"
+}
+
+Column = Union[np.ndarray, List[Optional[str]]]
+
+
+def is_available(fmt: str) -> bool:
+    if fmt == "msgpack":
+        return msgpack is not None
+    if fmt == "arrow":
+        return pa is not None
+    return fmt == "json"
+
+
+def negotiate(accept) -> Optional[str]:
+    """
+    Chọn định dạng theo header Accept (werkzeug MIMEAccept)
+    
+    Returns:
+        "json", "msgpack", "arrow", hoặc None nếu client chỉ nhận định dạng thiếu thư viện (406)
+    """
+    best = accept.best_match(list(MEDIA_TYPES))
+    if best is None:
+        return "json"
+    if is_available(MEDIA_TYPES[best]):
+        return MEDIA_TYPES[best]
+    
+    available = [media_type for media_type, fmt in MEDIA_TYPES.items() if is_available(fmt)]
+    best = accept.best_match(available)
+    return MEDIA_TYPES[best] if best is not None else None
+
+
+def mimetype(fmt: str) -> str:
+    return {"json": JSON, "msgpack": MSGPACK, "arrow": ARROW}[fmt]
+
+
+class ColumnBlock:
+    """Các cột cùng độ dài: mảng NumPy (số) hoặc list chuỗi có thể None"""
+    
+    def __init__(self, columns: Dict[str, Column]):
+        self.columns = columns
+    
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()), ()))
+
+
+def points_block(points: List[Dict]) -> ColumnBlock:
+    """Danh sách điểm {timestamp, datetime, water_level} -> cột timestamp int64, water_level float32"""
+    count = len(points)
+    return ColumnBlock({
+        "timestamp": np.fromiter((p['timestamp'] for p in points), dtype=np.int64, count=count),
+        "water_level": np.fromiter((p['water_level'] for p in points), dtype=np.float32, count=count)
+    })
+
+
+def _dtype_name(column: Column) -> str:
+    return column.dtype.name if isinstance(column, np.ndarray) else "string"
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, ColumnBlock):
+        return {
+            "length": len(obj),
+            "dtypes": {name: _dtype_name(column) for name, column in obj.columns.items()},
+            "columns": {
+                name: column.astype(column.dtype.newbyteorder('<'), copy=False).tobytes()
+                if isinstance(column, np.ndarray) else column
+                for name, column in obj.columns.items()
+            }
+        }
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Không encode được kiểu {type(obj).__name__}")
+
+
+def encode_msgpack(data: Dict) -> bytes:
+    """{"success": true, "data": data}; data chứa ColumnBlock ở vị trí các danh sách điểm"""
+    return msgpack.packb({"success": True, "data": data}, default=_msgpack_default, use_bin_type=True)
+
+
+def _decode_block(obj: Dict):
+    if obj.keys() == {"length", "dtypes", "columns"}:
+        return {
+            name: np.frombuffer(column, dtype=np.dtype(obj["dtypes"][name]).newbyteorder('<'))
+            if isinstance(column, bytes) else column
+            for name, column in obj["columns"].items()
+        }
+    return obj
+
+
+def decode_msgpack(body: bytes) -> Dict:
+    """Giải mã body MessagePack phía client Python: mỗi khối cột thành dict tên cột -> mảng NumPy"""
+    return msgpack.unpackb(body, object_hook=_decode_block, raw=False)
+
+
+def _arrow_column(column: Column):
+    if isinstance(column, np.ndarray):
+        return pa.array(column)
+    return pa.array(column, type=pa.string()).dictionary_encode()
+
+
+def encode_arrow(document: Dict, blocks: Dict[str, ColumnBlock], key: Optional[str] = None) -> bytes:
+    """
+    Một stream Arrow IPC: các khối nối thành một bảng (cột `key` ghi tên khối nếu có),
+    document {"success": true, "data": ...} nằm trong schema metadata "document"
+    """
+    names = list(blocks)
+    lengths = [len(blocks[name]) for name in names]
+    column_names = list(blocks[names[0]].columns) if names else ["timestamp", "water_level"]
+    
+    arrays, fields = [], []
+    if key is not None:
+        indices = np.repeat(np.arange(len(names), dtype=np.int32), lengths)
+        arrays.append(pa.DictionaryArray.from_arrays(indices, pa.array(names, type=pa.string())))
+        fields.append(key)
+    for name in column_names:
+        parts = [blocks[block].columns[name] for block in names]
+        if parts and isinstance(parts[0], np.ndarray):
+            column = np.concatenate(parts)
+        elif parts:
+            column = [value for part in parts for value in part]
+        else:
+            column = np.empty(0, dtype=np.int64 if name == "timestamp" else np.float32)
+        arrays.append(_arrow_column(column))
+        fields.append(name)
+    
+    table = pa.Table.from_arrays(arrays, names=fields).replace_schema_metadata({
+        "document": json.dumps({"success": True, "data": document}, ensure_ascii=False)
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_stations(fmt: str, data: Dict) -> bytes:
+    """
+    Snapshot /api/latest (toàn bộ hoặc delta): điểm của từng trạm (data_points, hoặc
+    appended_points với delta) thành khối cột, khóa theo station_id
+    """
+    points_key = 'appended_points' if data.get('delta') else 'data_points'
+    stations = data.get('stations', {})
+    blocks = {
+        station_id: points_block(station.get(points_key) or [])
+        for station_id, station in stations.items()
+    }
+    
+    if fmt == "msgpack":
+        return encode_msgpack({**data, "stations": {
+            station_id: {**station, points_key: blocks[station_id]}
+            for station_id, station in stations.items()
+        }})
+    
+    document = {**data, "stations": {
+        station_id: {key: value for key, value in station.items() if key != points_key}
+        for station_id, station in stations.items()
+    }}
+    return encode_arrow(document, blocks, key="station_id")
+
+
+def encode_station(fmt: str, station: Dict) -> bytes:
+    """Dữ liệu một trạm (/api/stations/<id>): data_points thành khối cột"""
+    block = points_block(station.get('data_points') or [])
+    if fmt == "msgpack":
+        return encode_msgpack({**station, "data_points": block})
+    document = {key: value for key, value in station.items() if key != 'data_points'}
+    return encode_arrow(document, {station.get('station_id', ''): block})
+
+
+def encode_history(fmt: str, document: Dict, columns: Dict[str, Column]) -> bytes:
+    """Lịch sử một trạm (/api/historical/<id>): document kèm khối cột records"""
+    block = ColumnBlock(columns)
+    if fmt == "msgpack":
+        return encode_msgpack({**document, "records": block})
+    return encode_arrow(document, {document.get('station_id', ''): block})
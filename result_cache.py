@@ -0,0 +1,107 @@
+"""
+Module cache kết quả xử lý theo nội dung (content-addressed LRU, lưu được xuống đĩa)
+Content-addressed LRU cache of processed station results
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    LRU giới hạn số phần tử, key là hash nội dung dữ liệu đầu vào
+    
+    Cache được nạp lại từ file JSON khi khởi động nên vẫn có hiệu lực sau restart.
+    """
+    
+    def __init__(self, max_entries: int, file_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.file_path = file_path
+        self._entries: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        
+        if file_path:
+            self._load()
+    
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        CACHE_REQUESTS.inc("result", "miss" if value is None else "hit")
+        return value
+    
+    def put(self, key: str, value: Dict):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+    
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self) -> Dict:
+        """Số lần hit/miss và tỉ lệ hit kể từ lần reset_stats gần nhất"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self._entries)
+            }
+    
+    def save(self):
+        """
+        Ghi cache xuống file (ghi file tạm rồi os.replace để không làm hỏng file khi lỗi)
+        """
+        if not self.file_path:
+            return
+        
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = list(self._entries.items())
+            self._dirty = False
+        
+        try:
+            Path(self.file_path).parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = f"{self.file_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.file_path)
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi lưu cache kết quả: {str(e)}")
+    
+    def _load(self):
+        if not os.path.exists(self.file_path):
+            return
+        
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+            for key, value in items[-self.max_entries:]:
+                self._entries[key] = value
+            logger.info(f"✓ Đã nạp {len(self._entries)} kết quả từ cache {self.file_path}")
+        except Exception as e:
+            logger.warning(f"✗ Không đọc được cache {self.file_path}, bỏ qua: {str(e)}")
+            self._entries.clear()
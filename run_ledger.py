@@ -0,0 +1,275 @@
+"""
+Module sổ ghi các lượt cập nhật dữ liệu (run ledger) và thống kê phân vị
+Bounded on-disk ledger of update runs with stage timings and percentile summaries
+
+Mỗi lượt update_data là một dòng JSON trong data/run_ledger.jsonl:
+    run_id, mode, started_at, finished_at, duration_seconds, outcome, error,
+    requested, published, stages {stage: giây}, stations {station_id: {stage: giây, source, points}},
+    sources {nguồn: số trạm}, points_ingested, rows_written
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pytz
+
+import config
+from metrics import UPDATE_STAGE_DURATION
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 95, 99)
+
+
+class RunRecorder:
+    """
+    Thu thập thời gian từng bước (tổng và theo trạm), nguồn dữ liệu, số điểm của một lượt cập nhật
+    
+    Thread-safe: thread scrape và thread xử lý của pipeline cùng ghi vào một recorder.
+    Mọi thời gian bước cũng được đưa vào histogram mekong_update_stage_duration_seconds.
+    """
+    
+    def __init__(self, mode: str, requested: Iterable[str]):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = defaultdict(float)
+        self.stations: Dict[str, Dict] = defaultdict(dict)
+        self.published: List[str] = []
+        self.error: Optional[str] = None
+        self.record = {
+            "run_id": uuid.uuid4().hex[:12],
+            "mode": mode,
+            "requested": list(requested),
+            "points_ingested": 0,
+            "rows_written": 0
+        }
+    
+    @contextmanager
+    def stage(self, name: str, station_id: Optional[str] = None):
+        """Đo thời gian một bước (của một trạm nếu có station_id)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start, station_id)
+    
+    def add_stage(self, name: str, seconds: float, station_id: Optional[str] = None):
+        UPDATE_STAGE_DURATION.observe(seconds, name)
+        with self._lock:
+            self.stages[name] += seconds
+            if station_id is not None:
+                station = self.stations[station_id]
+                station[name] = station.get(name, 0.0) + seconds
+    
+    def add_station_data(self, station_id: str, raw_data: Dict):
+        """Ghi nhận nguồn dữ liệu và số điểm thô đã lấy của một trạm"""
+        points = len(raw_data.get('raw_data', {}).get('data', []))
+        with self._lock:
+            station = self.stations[station_id]
+            station["source"] = raw_data.get('data_source', 'unknown')
+            station["points"] = points
+            self.record["points_ingested"] += points
+    
+    def add_rows_written(self, rows: int):
+        with self._lock:
+            self.record["rows_written"] += rows
+    
+    def mark_published(self, station_ids: Iterable[str]):
+        with self._lock:
+            self.published.extend(station_ids)
+    
+    def finish(self) -> Dict:
+        """
+        Kết thúc lượt cập nhật; outcome là success (mọi trạm), partial hoặc failure
+        """
+        published = list(self.published)
+        requested = self.record["requested"]
+        if not published:
+            outcome = "failure"
+        elif len(published) < len(requested):
+            outcome = "partial"
+        else:
+            outcome = "success"
+        
+        sources: Dict[str, int] = defaultdict(int)
+        with self._lock:
+            stations = {
+                station_id: {
+                    key: round(value, 4) if isinstance(value, float) else value
+                    for key, value in station.items()
+                }
+                for station_id, station in self.stations.items()
+            }
+            stages = {name: round(seconds, 4) for name, seconds in self.stages.items()}
+        for station in stations.values():
+            if "source" in station:
+                sources[station["source"]] += 1
+        
+        self.record.update(
+            started_at=round(self.started_at, 3),
+            finished_at=round(time.time(), 3),
+            duration_seconds=round(time.perf_counter() - self._start, 4),
+            outcome=outcome,
+            error=self.error,
+            published=published,
+            stages=stages,
+            stations=stations,
+            sources=dict(sources)
+        )
+        return self.record
+
+
+class RunLedger:
+    """
+    File JSONL chỉ ghi nối, giới hạn max_records dòng gần nhất
+    
+    Khi số dòng vượt max_records + compact_slack, file được viết lại chỉ giữ max_records dòng
+    cuối (ghi file tạm rồi os.replace). Lúc đọc, file chỉ được nạp lại khi đã thay đổi,
+    nên replica follower cũng thấy các lượt do leader ghi.
+    """
+    
+    def __init__(self, file_path: Optional[str] = None, max_records: Optional[int] = None,
+                 compact_slack: Optional[int] = None):
+        ledger_config = config.RUN_LEDGER
+        self.file_path = file_path or ledger_config['file']
+        self.max_records = max_records or ledger_config['max_records']
+        self.compact_slack = compact_slack or ledger_config['compact_slack']
+        self._lock = threading.Lock()
+        self._records: List[Dict] = []
+        self._file_state = None
+        self._line_count = None
+    
+    def append(self, record: Dict):
+        with self._lock:
+            Path(self.file_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.file_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            
+            if self._line_count is None:
+                self._line_count = len(self._read_file())
+            else:
+                self._line_count += 1
+            if self._line_count > self.max_records + self.compact_slack:
+                self._compact()
+    
+    def records(self, since: Optional[float] = None) -> List[Dict]:
+        """Các lượt (cũ tới mới), chỉ lấy lượt bắt đầu từ `since` (epoch giây) nếu có"""
+        with self._lock:
+            self._reload_if_changed()
+            records = self._records
+        if since is None:
+            return list(records)
+        return [record for record in records if record.get('started_at', 0) >= since]
+    
+    def summary(self, windows_hours: Optional[Iterable[float]] = None) -> Dict:
+        """
+        Thống kê p50/p95/p99 thời gian lượt chạy, từng bước và từng trạm theo các cửa sổ thời gian
+        """
+        windows_hours = list(windows_hours or config.RUN_LEDGER['summary_windows_hours'])
+        records = self.records()
+        now = time.time()
+        timezone = pytz.timezone(config.TIMEZONE)
+        
+        last_run = None
+        if records:
+            last = records[-1]
+            last_run = {
+                "run_id": last.get('run_id'),
+                "started_at": datetime.fromtimestamp(last['started_at'], tz=timezone).isoformat(),
+                "duration_seconds": last.get('duration_seconds'),
+                "outcome": last.get('outcome'),
+                "sources": last.get('sources'),
+                "points_ingested": last.get('points_ingested')
+            }
+        
+        return {
+            "records": len(records),
+            "last_run": last_run,
+            "windows": {
+                f"{hours:g}h": self._summarize(
+                    [record for record in records if record.get('started_at', 0) >= now - hours * 3600]
+                )
+                for hours in windows_hours
+            }
+        }
+    
+    @staticmethod
+    def _summarize(records: List[Dict]) -> Dict:
+        outcomes: Dict[str, int] = defaultdict(int)
+        stage_values: Dict[str, List[float]] = defaultdict(list)
+        station_values: Dict[str, List[float]] = defaultdict(list)
+        for record in records:
+            outcomes[record.get('outcome', 'unknown')] += 1
+            for stage, seconds in record.get('stages', {}).items():
+                stage_values[stage].append(seconds)
+            for station_id, station in record.get('stations', {}).items():
+                total = sum(value for key, value in station.items()
+                            if key not in ('source', 'points') and isinstance(value, (int, float)))
+                if total:
+                    station_values[station_id].append(total)
+        
+        return {
+            "runs": len(records),
+            "outcomes": dict(outcomes),
+            "success_rate": round(outcomes.get('success', 0) / len(records), 4) if records else None,
+            "points_ingested": sum(record.get('points_ingested', 0) for record in records),
+            "duration_seconds": _percentiles([record.get('duration_seconds', 0.0) for record in records]),
+            "stages": {stage: _percentiles(values) for stage, values in sorted(stage_values.items())},
+            "stations": {station_id: _percentiles(values) for station_id, values in sorted(station_values.items())}
+        }
+    
+    def _reload_if_changed(self):
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            self._records, self._file_state = [], None
+            return
+        
+        file_state = (stat.st_mtime_ns, stat.st_size)
+        if file_state != self._file_state:
+            self._records = self._read_file()
+            self._file_state = file_state
+    
+    def _read_file(self) -> List[Dict]:
+        if not os.path.exists(self.file_path):
+            return []
+        
+        records = []
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Dòng cuối ghi dở (process bị dừng giữa chừng)
+                    continue
+        return records[-self.max_records:]
+    
+    def _compact(self):
+        records = self._read_file()
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.file_path)
+        self._line_count = len(records)
+        logger.info(f"✓ Đã thu gọn run ledger còn {len(records)} lượt gần nhất")
+
+
+def _percentiles(values: List[float]) -> Optional[Dict]:
+    if not values:
+        return None
+    result = np.percentile(np.asarray(values, dtype=np.float64), PERCENTILES)
+    summary = {f"p{p}": round(float(value), 4) for p, value in zip(PERCENTILES, result)}
+    summary["max"] = round(float(max(values)), 4)
+    return summary
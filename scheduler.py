@@ -6,10 +6,12 @@ Scheduler for periodic data updates
 import os
 import json
 import logging
+import queue
+import threading
 import time
-import csv
 from datetime import datetime
-from typing import Dict
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -18,19 +20,29 @@ import pytz
 
 from mrc_scraper import MRCWaterLevelScraper
 from data_processor import WaterLevelProcessor
+from alerts import AlertTracker, build_index
+from webhooks import WebhookDispatcher
+from history_store import HistoricalStore, is_observed
+from water_series import WaterLevelSeries
+from leader import LeaderElector
+from log_setup import setup_logging
+from metrics import (
+    ALERT_TRANSITIONS, STATION_LAST_PUBLISHED, STATION_PUBLISH_LAG, UPDATE_RUN_DURATION, UPDATE_RUNS,
+    UPDATE_STAGE_DURATION
+)
+from run_ledger import RunLedger, RunRecorder
+from polling import PollingSchedule
+from profiling import RunProfiler
+import parquet_archive
 import config
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f"{config.LOGS_DIR}/scheduler.log"),
-        logging.StreamHandler()
-    ]
-)
+# Setup logging (file logs/scheduler.log chỉ khi chạy scheduler standalone)
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Đánh dấu thread scrape của pipeline đã kết thúc
+_PIPELINE_DONE = object()
+
 
 class DataUpdateScheduler:
     """
@@ -43,16 +55,311 @@ class DataUpdateScheduler:
         self.scraper = MRCWaterLevelScraper()
         self.processor = WaterLevelProcessor()
         self.is_running = False
+        self._update_lock = threading.Lock()
+        # Bảo vệ latest_stations/generation và việc ghi file snapshot
+        self._snapshot_lock = threading.Lock()
+        
+        # Lịch cập nhật thích ứng theo trạm và dữ liệu mới nhất đã gộp của mọi trạm
+        self.polling = PollingSchedule(config.STATIONS.keys())
+        self.latest_stations, self.generation = self._load_latest_stations()
         
         # Tạo thư mục nếu chưa tồn tại
         Path(config.DATA_DIR).mkdir(parents=True, exist_ok=True)
         Path(config.LOGS_DIR).mkdir(parents=True, exist_ok=True)
         
+        # Store lịch sử SQLite, import CSV cũ ở lần chạy đầu tiên
+        self.history_store = HistoricalStore()
+        try:
+            self.history_store.migrate_csv()
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi import CSV lịch sử cũ: {str(e)}")
+        
+        # Kho Parquet dài hạn (tùy chọn, cần pyarrow)
+        self.archive = None
+        if config.PARQUET_ARCHIVE["enabled"]:
+            if parquet_archive.is_available():
+                self.archive = parquet_archive.ParquetArchive()
+            else:
+                logger.warning("✗ Chưa cài pyarrow, bỏ qua Parquet archive")
+        
+        # Vùng trễ cảnh báo và nhật ký chuyển mức (DB dùng chung với các replica API)
+        self.alerts = AlertTracker()
+        
+        # Gửi nền các lần chuyển mức tới webhook đã đăng ký (chỉ chạy khi là leader)
+        self.webhooks = (
+            WebhookDispatcher(self.alerts, is_active=self.is_leader) if config.WEBHOOKS["enabled"] else None
+        )
+        
+        # Sổ ghi các lượt cập nhật (thời gian từng bước/trạm, kết quả) và lượt đang chạy
+        self.run_ledger = RunLedger()
+        self._run: Optional[RunRecorder] = None
+        
+        # Profile N lượt cập nhật kế tiếp (PROFILING['profile_next_runs'], mặc định 0)
+        self.profiler = RunProfiler()
+        
+        # Bầu leader giữa các replica: follower không scrape, chỉ phục vụ đọc snapshot dùng chung
+        self.leader = LeaderElector(on_elected=self._on_elected) if config.LEADER_ELECTION["enabled"] else None
+        # Đặt bởi thread gia hạn lease khi vừa lên leader; việc tiếp quản chạy dưới _update_lock
+        self._promotion_pending = threading.Event()
+        # Mọi transaction ghi lịch sử kiểm tra fencing token trên DB lease đã attach
+        self.history_store.fencing = self.leader
+        
         logger.info("✓ DataUpdateScheduler đã được khởi tạo")
     
-    def update_data(self):
+    def _bootstrap_tide_models(self):
+        """
+        Fit mô hình triều của từng trạm từ lịch sử thô đã lưu khi khởi động (hoặc vừa lên leader),
+        để sau mỗi lần deploy không phải chờ ~15 ngày scrape mới tách được M2/S2
+        """
+        tide_models = self.processor.tide_models
+        if tide_models is None:
+            return
+        
+        end_ms = int(time.time() * 1000) + 1
+        start_ms = end_ms - config.TIDE_MODEL['bootstrap_days'] * 24 * 3600 * 1000
+        fitted = 0
+        for station_id in config.STATIONS:
+            try:
+                timestamps, levels = self.history_store.read_observations(station_id, start_ms, end_ms)
+                if tide_models.bootstrap(station_id, WaterLevelSeries(timestamps, levels)):
+                    fitted += 1
+            except Exception as e:
+                logger.error(f"✗ Lỗi khi fit mô hình triều từ lịch sử: {str(e)}", extra={"station_id": station_id})
+        
+        if fitted:
+            tide_models.save()
+            logger.info("✓ Đã fit mô hình triều từ lịch sử cho %d trạm", fitted)
+    
+    def is_leader(self) -> bool:
+        """Replica này được phép scrape và ghi dữ liệu (luôn đúng khi tắt bầu leader)"""
+        return self.leader is None or self.leader.is_leader
+    
+    def _holds_lease(self) -> bool:
+        """
+        Kiểm tra nhanh fencing token trước một lượt ghi để bỏ qua sớm; lệnh ghi tự kiểm tra
+        lại token trong cùng transaction (HistoricalStore.fencing, _fenced)
+        """
+        if self.leader is None:
+            return True
+        if self.leader.check_fencing():
+            return True
+        logger.warning("✗ Không còn giữ lease leader, bỏ qua ghi dữ liệu")
+        return False
+    
+    def _fenced(self):
+        """
+        Giữ khóa lease (đã kiểm tra token) trong lúc thay file snapshot; raise FencingError
+        nếu lease đã đổi chủ
+        """
+        return self.leader.fenced() if self.leader is not None else nullcontext()
+    
+    def _on_elected(self, token: int):
+        """
+        Vừa trở thành leader (gọi từ thread gia hạn lease): chỉ đánh dấu, việc tiếp quản
+        chạy ở đầu lượt cập nhật kế tiếp để không chặn gia hạn lease và không tranh với update_data
+        """
+        self._promotion_pending.set()
+    
+    def _finish_promotion(self):
+        """
+        Tiếp quản sau khi lên leader (gọi khi đang giữ _update_lock): nạp lại snapshot dùng chung
+        do leader trước ghi và mô hình triều; mọi trạm đến hạn ngay vì lịch của replica này
+        chưa từng cập nhật
+        """
+        if not self._promotion_pending.is_set():
+            return
+        self._promotion_pending.clear()
+        
+        with self._snapshot_lock:
+            self.latest_stations, self.generation = self._load_latest_stations()
+        if self.processor.tide_models is not None:
+            self.processor.tide_models.load()
+        self._bootstrap_tide_models()
+        logger.info(f"✓ Đã tiếp quản dữ liệu của leader trước (generation {self.generation})")
+    
+    def update_data(self, station_ids: Optional[List[str]] = None):
         """
         Hàm chính để cập nhật dữ liệu từ MRC
+        
+        Args:
+            station_ids: Chỉ cập nhật các trạm này (mặc định: tất cả các trạm)
+        """
+        if not self.is_leader():
+            logger.info("Replica này không phải leader, bỏ qua cập nhật")
+            return False
+        
+        with self._update_lock:
+            self._finish_promotion()
+            requested = list(config.STATIONS.keys()) if station_ids is None else list(station_ids)
+            mode = "pipeline" if self._use_pipeline(requested) else "staged"
+            self._run = RunRecorder(mode, requested)
+            try:
+                with self.profiler.maybe_profile(f"run-{self._run.record['run_id']}"):
+                    return self._update_data(station_ids, requested)
+            finally:
+                record, self._run = self._run.finish(), None
+                self._record_run(record)
+    
+    def poll_due_stations(self):
+        """
+        Job tick của nhịp thích ứng: cập nhật các trạm đã đến hạn
+        """
+        if not self.is_leader():
+            return
+        
+        due = self.polling.due_stations()
+        if due:
+            logger.info(f"Các trạm đến hạn cập nhật: {', '.join(due)}")
+            self.update_data(due)
+    
+    def _record_run(self, record: Dict):
+        """Ghi lượt cập nhật vào run ledger và metrics"""
+        UPDATE_RUN_DURATION.observe(record['duration_seconds'])
+        UPDATE_RUNS.inc(record['outcome'])
+        try:
+            self.run_ledger.append(record)
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi ghi run ledger: {str(e)}")
+    
+    def _stage(self, name: str, station_ids: List[str]):
+        """
+        Đo thời gian một bước của lượt đang chạy; gắn với trạm nếu bước chỉ xử lý một trạm
+        """
+        if self._run is None:
+            return UPDATE_STAGE_DURATION.time(name)
+        return self._run.stage(name, station_ids[0] if len(station_ids) == 1 else None)
+    
+    def _update_data(self, station_ids: Optional[List[str]], requested: List[str]) -> bool:
+        if self._use_pipeline(requested):
+            return self._run_pipeline(requested)
+        return self._run_staged(station_ids, requested)
+    
+    def _use_pipeline(self, requested: List[str]) -> bool:
+        """
+        Pipeline xử lý từng trạm một; lượt đủ nhiều trạm để xử lý theo lô (BATCH_PROCESSING)
+        chạy theo từng bước để processor nhận cả lô một lần
+        """
+        return config.UPDATE_PIPELINE["enabled"] and not self.processor.uses_batch(len(requested))
+    
+    def _run_pipeline(self, requested: List[str]) -> bool:
+        """
+        Cập nhật dạng pipeline: thread scrape đẩy từng trạm vào hàng đợi, thread hiện tại
+        xử lý, công bố vào dữ liệu mới nhất và ghi lịch sử ngay khi trạm đó sẵn sàng,
+        trong lúc trạm kế tiếp vẫn đang được scrape
+        
+        Mỗi trạm công bố là một thế hệ snapshot riêng và trạm mang số thế hệ của mình, nên
+        /api/latest?since= vẫn chỉ trả các trạm đổi sau thế hệ client đã có.
+        """
+        logger.info("="*60)
+        logger.info("BẮT ĐẦU CẬP NHẬT DỮ LIỆU MỰC NƯỚC (PIPELINE)")
+        logger.info("="*60)
+        
+        start_time = time.time()
+        stations_queue = queue.Queue(maxsize=config.UPDATE_PIPELINE["queue_size"])
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._scrape_into_queue,
+            args=(requested, stations_queue, stop, self._run),
+            name="update-pipeline-scraper",
+            daemon=True
+        )
+        published = {}
+        
+        self.processor.begin_run()
+        producer.start()
+        try:
+            while True:
+                item = stations_queue.get()
+                if item is _PIPELINE_DONE:
+                    break
+                
+                station_id, raw_data = item
+                station_name = config.STATIONS[station_id]['name']
+                try:
+                    with self._stage("process", [station_id]):
+                        processed = self.processor.process_station_data(raw_data)
+                    if not processed:
+                        logger.error(f"✗ Không xử lý được dữ liệu trạm {station_name}")
+                        continue
+                    
+                    # Công bố trước, ghi lịch sử sau: dữ liệu mới nhất có sẵn sớm nhất có thể
+                    self.polling.record({station_id: processed}, [station_id])
+                    processed = self._track_alerts({station_id: processed})[station_id]
+                    self._save_latest_data({station_id: processed})
+                    self._save_historical_data({station_id: raw_data}, {station_id: processed})
+                    published[station_id] = processed
+                except Exception as e:
+                    # Lỗi của một trạm không chặn các trạm còn lại trong hàng đợi
+                    logger.error(f"✗ Lỗi khi cập nhật trạm {station_name}: {str(e)}", exc_info=True)
+                    self._run.error = f"{station_id}: {str(e)}"
+                    continue
+                
+                alert = processed.get('alert', {})
+                logger.info(
+                    "✓ Đã công bố trạm %s sau %.2f giây → %s",
+                    station_name, time.time() - start_time, alert.get('message', 'N/A'),
+                    extra={"station_id": station_id, "alert_level": alert.get('level')}
+                )
+        finally:
+            stop.set()
+            producer.join()
+            self.processor.finish_run()
+        
+        # Metadata cấp lượt: danh sách trạm đã công bố cho run ledger
+        self._run.mark_published(list(published))
+        
+        failed = [station_id for station_id in requested if station_id not in published]
+        if failed:
+            self.polling.record({}, failed)
+            logger.error(f"✗ Không cập nhật được {len(failed)} trạm: {', '.join(failed)}")
+        
+        elapsed_time = time.time() - start_time
+        logger.info(f"\n{'='*60}")
+        logger.info(
+            f"{'✓' if published else '✗'} CẬP NHẬT HOÀN TẤT trong {elapsed_time:.2f} giây "
+            f"({len(published)}/{len(requested)} trạm)"
+        )
+        logger.info(f"{'='*60}\n")
+        
+        return bool(published)
+    
+    def _scrape_into_queue(self, station_ids: List[str], stations_queue: queue.Queue,
+                           stop: threading.Event, run: RunRecorder):
+        """
+        Thread scrape của pipeline; dừng (và đóng WebDriver) khi bên xử lý báo lỗi
+        """
+        stations = self.scraper.iter_stations(station_ids)
+        try:
+            scrape_start = time.perf_counter()
+            for item in stations:
+                station_id, raw_data = item
+                run.add_stage("scrape", time.perf_counter() - scrape_start, station_id)
+                run.add_station_data(station_id, raw_data)
+                if not self._put_until_stopped(stations_queue, item, stop):
+                    return
+                scrape_start = time.perf_counter()
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi scrape dữ liệu: {str(e)}", exc_info=True)
+            run.error = f"scrape: {str(e)}"
+        finally:
+            stations.close()
+            self._put_until_stopped(stations_queue, _PIPELINE_DONE, stop)
+    
+    @staticmethod
+    def _put_until_stopped(stations_queue: queue.Queue, item, stop: threading.Event) -> bool:
+        """Đưa item vào hàng đợi, bỏ cuộc nếu bên xử lý đã dừng"""
+        while not stop.is_set():
+            try:
+                stations_queue.put(item, timeout=config.UPDATE_PIPELINE["put_timeout_seconds"])
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run_staged(self, station_ids: Optional[List[str]], requested: List[str]) -> bool:
+        """
+        Cập nhật theo từng bước: scrape mọi trạm, xử lý mọi trạm, rồi mới lưu
+        (dùng khi tắt UPDATE_PIPELINE hoặc khi lượt đủ lớn để xử lý theo lô BATCH_PROCESSING)
         """
         try:
             logger.info("="*60)
@@ -63,31 +370,44 @@ class DataUpdateScheduler:
             
             # Bước 1: Scrape dữ liệu từ MRC
             logger.info("\n[1/4] Đang scrape dữ liệu từ MRC...")
-            raw_data = self.scraper.scrape_all_stations()
+            with self._stage("scrape", requested):
+                if station_ids is None:
+                    raw_data = self.scraper.scrape_all_stations()
+                else:
+                    raw_data = self.scraper.scrape_stations(requested)
             
             if not raw_data:
                 logger.error("✗ Không lấy được dữ liệu từ MRC")
+                self.polling.record({}, requested)
                 return False
             
+            for station_id, station_data in raw_data.items():
+                self._run.add_station_data(station_id, station_data)
+            
             logger.info(f"✓ Đã scrape {len(raw_data)} trạm")
             
             # Bước 2: Xử lý dữ liệu
             logger.info("\n[2/4] Đang xử lý dữ liệu...")
-            processed_data = self.processor.process_all_stations(raw_data)
+            with self._stage("process", list(raw_data)):
+                processed_data = self.processor.process_all_stations(raw_data)
             
             if not processed_data:
                 logger.error("✗ Không xử lý được dữ liệu")
+                self.polling.record({}, requested)
                 return False
             
             logger.info(f"✓ Đã xử lý {len(processed_data)} trạm")
+            self.polling.record(processed_data, requested)
+            processed_data = self._track_alerts(processed_data)
             
             # Bước 3: Lưu dữ liệu mới nhất vào JSON
             logger.info("\n[3/4] Đang lưu dữ liệu vào JSON...")
             self._save_latest_data(processed_data)
             
-            # Bước 4: Append vào file CSV lịch sử
-            logger.info("\n[4/4] Đang cập nhật dữ liệu lịch sử CSV...")
-            self._append_to_historical_data(processed_data)
+            # Bước 4: Ghi vào store lịch sử
+            logger.info("\n[4/4] Đang cập nhật dữ liệu lịch sử...")
+            self._save_historical_data(raw_data, processed_data)
+            self._run.mark_published(processed_data.keys())
             
             elapsed_time = time.time() - start_time
             logger.info(f"\n{'='*60}")
@@ -98,71 +418,162 @@ class DataUpdateScheduler:
             
         except Exception as e:
             logger.error(f"✗ Lỗi khi cập nhật dữ liệu: {str(e)}", exc_info=True)
+            self._run.error = str(e)
+            self.polling.record({}, requested)
             return False
     
+    def _load_latest_stations(self) -> Tuple[Dict, int]:
+        """
+        Nạp dữ liệu mới nhất đã lưu để các lượt cập nhật một phần gộp vào, cùng thế hệ
+        snapshot để đánh số tiếp (kể cả khi leader mới tiếp quản)
+        """
+        if not os.path.exists(config.LATEST_DATA_FILE):
+            return {}, 0
+        try:
+            with open(config.LATEST_DATA_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data.get('stations', {}), data.get('metadata', {}).get('generation', 0)
+        except Exception as e:
+            logger.warning(f"✗ Không đọc được {config.LATEST_DATA_FILE}: {str(e)}")
+            return {}, 0
+    
+    def _track_alerts(self, processed_data: Dict) -> Dict:
+        """
+        Áp dụng vùng trễ cho mức cảnh báo trước khi công bố và ghi các lần chuyển mức
+        
+        Lỗi ở bước này không chặn công bố: dùng mức cảnh báo thô của processor.
+        """
+        if not self._holds_lease():
+            return processed_data
+        
+        try:
+            with self._stage("alerts", list(processed_data)):
+                published, transitions = self.alerts.apply(processed_data)
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi cập nhật trạng thái cảnh báo: {str(e)}")
+            return processed_data
+        
+        for transition in transitions:
+            ALERT_TRANSITIONS.inc(transition['to_level'])
+            logger.warning(
+                "Chuyển mức cảnh báo trạm %s: %s → %s (%sm)",
+                transition['station_name'], transition['from_level'], transition['to_level'],
+                transition['water_level'],
+                extra={"station_id": transition['station_id'], "alert_level": transition['to_level']}
+            )
+        if transitions and self.webhooks is not None:
+            # Chỉ đánh thức dispatcher: việc gửi chạy trên thread riêng, không chờ mạng ở đây
+            self.webhooks.notify()
+        return published
+    
     def _save_latest_data(self, processed_data: Dict):
         """
-        Lưu dữ liệu mới nhất vào file JSON
+        Lưu dữ liệu mới nhất vào file JSON (gộp với các trạm không được cập nhật lượt này)
+        
+        Mỗi lần ghi là một thế hệ mới; trạm được ghi lần này mang số thế hệ đó để API
+        tính delta cho /api/latest?since=<generation>.
         """
+        if not self._holds_lease():
+            return
+        
         try:
-            # Thêm metadata
-            output_data = {
-                "last_updated": datetime.now(pytz.timezone(config.TIMEZONE)).isoformat(),
-                "stations": processed_data,
-                "metadata": {
-                    "total_stations": len(processed_data),
-                    "data_source": "Mekong River Commission (MRC)",
-                    "update_interval_seconds": config.UPDATE_INTERVAL
+            with self._stage("save_json", list(processed_data)), self._snapshot_lock:
+                generation = self.generation + 1
+                # Bản sao: kết quả có thể đang nằm trong ResultCache của processor
+                self.latest_stations.update(
+                    (station_id, {**result, "generation": generation})
+                    for station_id, result in processed_data.items()
+                )
+                
+                # Thêm metadata
+                output_data = {
+                    "last_updated": datetime.now(pytz.timezone(config.TIMEZONE)).isoformat(),
+                    "stations": self.latest_stations,
+                    # Chỉ mục cảnh báo sắp theo mức độ cho /api/alerts
+                    "alerts": build_index(self.latest_stations),
+                    "metadata": {
+                        "total_stations": len(self.latest_stations),
+                        "data_source": "Mekong River Commission (MRC)",
+                        "update_interval_seconds": config.UPDATE_INTERVAL,
+                        "fencing_token": self.leader.token if self.leader is not None else None,
+                        "generation": generation
+                    }
                 }
-            }
-            
-            # Lưu file
-            with open(config.LATEST_DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(output_data, f, indent=2, ensure_ascii=False)
+                
+                # Lưu file (ghi file tạm rồi os.replace: API không bao giờ đọc phải file ghi dở);
+                # chỉ bước thay file cần giữ khóa lease
+                tmp_path = f"{config.LATEST_DATA_FILE}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(output_data, f, indent=2, ensure_ascii=False)
+                with self._fenced():
+                    os.replace(tmp_path, config.LATEST_DATA_FILE)
+                self.generation = generation
+            self._record_publication(processed_data)
             
             logger.info(f"✓ Đã lưu dữ liệu vào {config.LATEST_DATA_FILE}")
             
         except Exception as e:
             logger.error(f"✗ Lỗi khi lưu JSON: {str(e)}")
     
-    def _append_to_historical_data(self, processed_data: Dict):
+    @staticmethod
+    def _record_publication(processed_data: Dict):
+        """
+        Metrics độ trễ công bố: từ điểm quan trắc mới nhất của trạm tới lúc ghi snapshot
+        """
+        now = time.time()
+        for station_id, result in processed_data.items():
+            observed_at = datetime.fromisoformat(result['current']['timestamp']).timestamp()
+            STATION_PUBLISH_LAG.observe(max(now - observed_at, 0.0), station_id)
+            STATION_LAST_PUBLISHED.set(now, station_id)
+    
+    def _save_historical_data(self, raw_data: Dict, processed_data: Dict):
         """
-        Append dữ liệu vào file CSV lịch sử
+        Ghi toàn bộ điểm quan trắc thô vào store lịch sử, sau đó gắn cảnh báo/xu hướng
+        cho điểm hiện tại của từng trạm (bỏ qua trạm chỉ có dữ liệu mẫu do scrape lỗi)
         """
+        if not self._holds_lease():
+            return
+        
         try:
-            file_exists = os.path.exists(config.HISTORICAL_DATA_FILE)
+            with self._stage("save_history", list(processed_data)):
+                observed = self.history_store.upsert_observations(raw_data)
+                annotated = self.history_store.upsert_snapshots({
+                    station_id: result for station_id, result in processed_data.items()
+                    if is_observed(raw_data.get(station_id, {}))
+                })
+            if self._run is not None:
+                self._run.add_rows_written(observed)
+            logger.info(
+                f"✓ Đã cập nhật lịch sử vào {self.history_store.db_path}: "
+                f"{observed} điểm mới/sửa đổi, {annotated} điểm hiện tại được gắn cảnh báo"
+            )
             
-            with open(config.HISTORICAL_DATA_FILE, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                
-                # Viết header nếu file mới
-                if not file_exists:
-                    writer.writerow([
-                        'timestamp',
-                        'station_id',
-                        'station_name',
-                        'water_level',
-                        'alert_level',
-                        'trend_direction'
-                    ])
-                
-                # Viết dữ liệu cho từng trạm
-                timestamp = datetime.now(pytz.timezone(config.TIMEZONE)).isoformat()
-                
-                for station_id, data in processed_data.items():
-                    writer.writerow([
-                        timestamp,
-                        station_id,
-                        data['station_name'],
-                        data['current']['water_level'],
-                        data['alert']['level'],
-                        data['trend']['direction']
-                    ])
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi lưu dữ liệu lịch sử: {str(e)}")
+    
+    def compact_history(self):
+        """
+        Job nền: export điểm thô sang Parquet archive, sau đó nén dữ liệu lịch sử cũ
+        xuống tầng theo giờ/theo ngày
+        """
+        if not self.is_leader():
+            return
+        
+        try:
+            start_time = time.time()
             
-            logger.info(f"✓ Đã cập nhật dữ liệu lịch sử vào {config.HISTORICAL_DATA_FILE}")
+            # Export trước khi nén để archive giữ được mọi điểm thô
+            if self.archive is not None:
+                self.archive.export_from_store(self.history_store)
             
+            result = self.history_store.compact()
+            logger.info(
+                f"✓ Đã nén lịch sử trong {time.time() - start_time:.2f} giây: "
+                f"{result['raw_rows']} điểm thô -> theo giờ, {result['hourly_rows']} bucket giờ -> theo ngày, "
+                f"trả lại {result['pages_freed']} trang đĩa"
+            )
         except Exception as e:
-            logger.error(f"✗ Lỗi khi lưu CSV: {str(e)}")
+            logger.error(f"✗ Lỗi khi nén dữ liệu lịch sử: {str(e)}", exc_info=True)
     
     def start(self, immediate: bool = True):
         """
@@ -179,27 +590,66 @@ class DataUpdateScheduler:
         logger.info("KHỞI ĐỘNG SCHEDULER")
         logger.info("="*60)
         
+        # Tham gia bầu leader trước khi chạy lần đầu; follower vẫn giữ các job để
+        # tự tiếp quản khi leader dừng
+        if self.leader is not None:
+            self.leader.start()
+            logger.info(
+                f"  → Replica {self.leader.holder_id}: "
+                f"{'leader' if self.leader.is_leader else 'follower (chỉ phục vụ đọc)'}"
+            )
+        else:
+            self._bootstrap_tide_models()
+        
         # Chạy ngay lần đầu nếu immediate=True
-        if immediate:
+        if immediate and self.is_leader():
             logger.info("\nChạy cập nhật dữ liệu ban đầu...")
             self.update_data()
         
         # Thiết lập job định kỳ
         interval_minutes = config.UPDATE_INTERVAL // 60
+        polling_config = config.ADAPTIVE_POLLING
+        
+        if polling_config["enabled"]:
+            # Tick ngắn, mỗi lần chỉ scrape các trạm đã đến hạn theo nhịp riêng
+            self.scheduler.add_job(
+                func=self.poll_due_stations,
+                trigger=IntervalTrigger(seconds=polling_config["tick_seconds"]),
+                id='update_water_level',
+                name='Cập nhật mực nước từ MRC (nhịp thích ứng theo trạm)',
+                replace_existing=True
+            )
+        else:
+            self.scheduler.add_job(
+                func=self.update_data,
+                trigger=IntervalTrigger(seconds=config.UPDATE_INTERVAL),
+                id='update_water_level',
+                name='Cập nhật mực nước từ MRC',
+                replace_existing=True
+            )
         
+        # Job nén lịch sử chạy trên thread riêng của APScheduler, không chặn job cập nhật
         self.scheduler.add_job(
-            func=self.update_data,
-            trigger=IntervalTrigger(seconds=config.UPDATE_INTERVAL),
-            id='update_water_level',
-            name='Cập nhật mực nước từ MRC',
+            func=self.compact_history,
+            trigger=IntervalTrigger(seconds=config.HISTORY_RETENTION["compaction_interval_seconds"]),
+            id='compact_history',
+            name='Nén dữ liệu lịch sử theo tầng',
             replace_existing=True
         )
         
         self.scheduler.start()
+        if self.webhooks is not None:
+            self.webhooks.start()
         self.is_running = True
         
         logger.info(f"\n✓ Scheduler đã khởi động")
-        logger.info(f"  → Cập nhật mỗi {interval_minutes} phút ({config.UPDATE_INTERVAL} giây)")
+        if polling_config["enabled"]:
+            logger.info(
+                f"  → Nhịp thích ứng theo trạm: {polling_config['min_interval_seconds'] // 60}-"
+                f"{polling_config['max_interval_seconds'] // 60} phút (cơ sở {interval_minutes} phút)"
+            )
+        else:
+            logger.info(f"  → Cập nhật mỗi {interval_minutes} phút ({config.UPDATE_INTERVAL} giây)")
         logger.info(f"  → Múi giờ: {config.TIMEZONE}")
         logger.info(f"  → Dữ liệu lưu tại: {config.DATA_DIR}")
         logger.info(f"{'='*60}\n")
@@ -213,12 +663,21 @@ class DataUpdateScheduler:
             return
         
         self.scheduler.shutdown()
+        if self.webhooks is not None:
+            self.webhooks.stop()
+        if self.leader is not None:
+            # Trả lease ngay để replica khác tiếp quản không phải chờ hết hạn
+            self.leader.stop()
         self.is_running = False
         logger.info("✓ Scheduler đã dừng")
     
-    def get_status(self) -> Dict:
+    def get_status(self, windows_hours: Optional[List[float]] = None) -> Dict:
         """
         Lấy trạng thái của scheduler
+        
+        Args:
+            windows_hours: Các cửa sổ (giờ) để tính p50/p95/p99 của các lượt cập nhật
+                (mặc định RUN_LEDGER['summary_windows_hours'])
         """
         jobs = []
         if self.is_running:
@@ -229,10 +688,25 @@ class DataUpdateScheduler:
                     "next_run": job.next_run_time.isoformat() if job.next_run_time else None
                 })
         
+        timezone = pytz.timezone(config.TIMEZONE)
+        station_polling = {
+            station_id: {
+                "next_due": datetime.fromtimestamp(entry["next_due"], tz=timezone).isoformat(),
+                "interval_seconds": round(entry["interval"]) if entry["interval"] else None,
+                "reason": entry["reason"]
+            }
+            for station_id, entry in self.polling.snapshot().items()
+        }
+        
         return {
             "is_running": self.is_running,
             "jobs": jobs,
             "update_interval_seconds": config.UPDATE_INTERVAL,
+            "adaptive_polling": config.ADAPTIVE_POLLING["enabled"],
+            "update_pipeline": config.UPDATE_PIPELINE["enabled"],
+            "leader": self.leader.status() if self.leader is not None else None,
+            "runs": self.run_ledger.summary(windows_hours),
+            "station_polling": station_polling,
             "data_dir": config.DATA_DIR,
             "latest_data_file": config.LATEST_DATA_FILE
         }
@@ -242,6 +716,8 @@ def run_scheduler_standalone():
     """
     Chạy scheduler như một standalone service
     """
+    setup_logging("scheduler.log")
+    
     logger.info("="*70)
     logger.info("MEKONG RIVER WATER LEVEL MONITORING - SCHEDULER SERVICE")
     logger.info("="*70)
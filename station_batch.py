@@ -0,0 +1,168 @@
+"""
+Module xử lý theo lô nhiều trạm trên một khối dữ liệu dạng cột
+Columnar multi-station batch: grouped statistics, trend and peak detection
+"""
+
+from itertools import chain
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from peak_detection import find_tide_extrema
+from water_series import WaterLevelSeries
+
+
+class StationBatch:
+    """
+    Khối dữ liệu dạng cột của nhiều trạm: điểm của trạm thứ i nằm trong
+    [offsets[i], offsets[i+1]), đã sắp xếp theo thời gian trong từng trạm.
+    """
+    
+    __slots__ = ('station_ids', 'offsets', 'groups', 'timestamps', 'levels')
+    
+    def __init__(self, station_ids: List[str], offsets: np.ndarray, groups: np.ndarray,
+                 timestamps: np.ndarray, levels: np.ndarray):
+        self.station_ids = station_ids
+        self.offsets = offsets
+        self.groups = groups
+        self.timestamps = timestamps
+        self.levels = levels
+    
+    @classmethod
+    def from_raw(cls, raw_data_dict: Dict[str, Dict]) -> 'StationBatch':
+        """
+        Ghép data points thô của tất cả các trạm thành một khối
+        
+        Điểm thiếu giá trị bị loại, trùng timestamp giữ bản ghi cuối, trạm không còn
+        điểm nào bị bỏ khỏi khối.
+        """
+        station_ids = list(raw_data_dict.keys())
+        point_lists = [
+            raw_data_dict[station_id].get('raw_data', {}).get('data', [])
+            for station_id in station_ids
+        ]
+        lengths = np.array([len(points) for points in point_lists], dtype=np.int64)
+        total = int(lengths.sum())
+        
+        points = list(chain.from_iterable(point_lists))
+        timestamps = np.fromiter((p['timestamp'] for p in points), dtype=np.float64, count=total)
+        levels = np.fromiter(
+            (np.nan if p.get('value') is None else p['value'] for p in points),
+            dtype=np.float64,
+            count=total
+        )
+        groups = np.repeat(np.arange(len(station_ids), dtype=np.int64), lengths)
+        
+        valid = np.isfinite(timestamps) & np.isfinite(levels)
+        timestamps = timestamps[valid].astype(np.int64)
+        levels = levels[valid]
+        groups = groups[valid]
+        
+        # lexsort ổn định: trong mỗi nhóm trùng (trạm, timestamp) điểm đến sau đứng cuối
+        order = np.lexsort((timestamps, groups))
+        timestamps, levels, groups = timestamps[order], levels[order], groups[order]
+        if timestamps.size:
+            keep = np.r_[(timestamps[1:] != timestamps[:-1]) | (groups[1:] != groups[:-1]), True]
+            timestamps, levels, groups = timestamps[keep], levels[keep], groups[keep]
+        
+        # Đánh lại mã nhóm liên tục sau khi bỏ các trạm rỗng
+        present, groups = np.unique(groups, return_inverse=True)
+        counts = np.bincount(groups, minlength=present.size)
+        offsets = np.r_[0, np.cumsum(counts)].astype(np.int64)
+        
+        return cls(
+            [station_ids[i] for i in present.tolist()],
+            offsets,
+            groups.astype(np.int64),
+            timestamps,
+            levels.astype(np.float32)
+        )
+    
+    def __len__(self) -> int:
+        return len(self.station_ids)
+    
+    @property
+    def starts(self) -> np.ndarray:
+        return self.offsets[:-1]
+    
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+    
+    def latest(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Điểm mới nhất của từng trạm (timestamps, levels)"""
+        last = self.offsets[1:] - 1
+        return self.timestamps[last], self.levels[last]
+    
+    def statistics(self) -> Dict[str, np.ndarray]:
+        """
+        Thống kê theo nhóm bằng ufunc.reduceat (std dùng ddof=1 như pandas)
+        """
+        levels = self.levels.astype(np.float64)
+        lengths = self.lengths
+        maximum = np.maximum.reduceat(levels, self.starts)
+        minimum = np.minimum.reduceat(levels, self.starts)
+        mean = np.add.reduceat(levels, self.starts) / lengths
+        squared = np.add.reduceat((levels - mean[self.groups]) ** 2, self.starts)
+        variance = np.where(lengths > 1, squared / np.maximum(lengths - 1, 1), 0.0)
+        return {
+            "max": maximum,
+            "min": minimum,
+            "mean": mean,
+            "std": np.sqrt(variance),
+            "range": maximum - minimum
+        }
+    
+    def trend_slopes(self, window: int) -> np.ndarray:
+        """
+        Độ dốc hồi quy tuyến tính trên `window` điểm cuối của từng trạm (NaN nếu < 2 điểm)
+        """
+        rank_from_end = self._rank_from_end()
+        mask = rank_from_end < window
+        groups = self.groups[mask]
+        count = np.minimum(self.lengths, window).astype(np.float64)
+        x = count[groups] - 1 - rank_from_end[mask]
+        y = self.levels[mask].astype(np.float64)
+        
+        n_groups = len(self)
+        sx = np.bincount(groups, weights=x, minlength=n_groups)
+        sy = np.bincount(groups, weights=y, minlength=n_groups)
+        sxx = np.bincount(groups, weights=x * x, minlength=n_groups)
+        sxy = np.bincount(groups, weights=x * y, minlength=n_groups)
+        
+        denominator = count * sxx - sx * sx
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = (count * sxy - sx * sy) / denominator
+        return np.where(count >= 2, slopes, np.nan)
+    
+    def peaks(self, min_prominence: float, min_separation: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Chỉ số toàn cục các đỉnh cao/thấp, phát hiện cho mọi trạm trong một lượt
+        """
+        return find_tide_extrema(
+            self.levels,
+            times=self.timestamps,
+            min_prominence=min_prominence,
+            min_separation=min_separation,
+            groups=self.groups
+        )
+    
+    def tail_indices(self, limit: int) -> np.ndarray:
+        """Chỉ số toàn cục của `limit` điểm cuối mỗi trạm"""
+        return np.flatnonzero(self._rank_from_end() < limit)
+    
+    def split(self, indices: np.ndarray) -> List[WaterLevelSeries]:
+        """
+        Tách các điểm tại `indices` (tăng dần) thành chuỗi riêng cho từng trạm
+        """
+        bounds = np.searchsorted(indices, self.offsets)
+        return [
+            WaterLevelSeries(
+                self.timestamps[indices[bounds[i]:bounds[i + 1]]],
+                self.levels[indices[bounds[i]:bounds[i + 1]]]
+            )
+            for i in range(len(self))
+        ]
+    
+    def _rank_from_end(self) -> np.ndarray:
+        return self.offsets[1:][self.groups] - np.arange(self.timestamps.size) - 1
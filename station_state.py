@@ -0,0 +1,311 @@
+"""
+Module trạng thái streaming cho từng trạm quan trắc
+Per-station streaming state: ring buffer, running statistics, online peaks and trend
+"""
+
+import threading
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from peak_detection import find_tide_extrema
+from water_series import WaterLevelSeries
+
+
+class StationState:
+    """
+    Trạng thái tích lũy của một trạm, cập nhật với chi phí O(số điểm mới)
+    
+    - Ring buffer giữ `capacity` điểm gần nhất (epoch ms int64 + mực nước float32)
+    - Thống kê Welford (mean/std) trượt theo cửa sổ, min/max bằng monotonic deque
+    - Hồi quy xu hướng tăng dần trên `trend_window` điểm cuối
+    - Phát hiện đỉnh triều online: chỉ quét đoạn từ đỉnh đã xác nhận gần nhất
+    """
+    
+    def __init__(self, capacity: int, trend_window: int = 6,
+                 min_prominence: float = 0.0, min_separation: float = 0):
+        """
+        Args:
+            capacity: Số điểm tối đa giữ trong ring buffer
+            trend_window: Số điểm gần nhất dùng để tính xu hướng
+            min_prominence: Độ nổi bật tối thiểu của đỉnh (mét)
+            min_separation: Khoảng cách tối thiểu giữa hai đỉnh cùng loại (ms)
+        """
+        self.capacity = capacity
+        self.trend_window = trend_window
+        self.min_prominence = min_prominence
+        self.min_separation = min_separation
+        self.lock = threading.Lock()
+        
+        # Ring buffer: điểm có số thứ tự seq nằm ở vị trí seq % capacity
+        self._times = np.empty(capacity, dtype=np.int64)
+        self._levels = np.empty(capacity, dtype=np.float32)
+        self._total = 0
+        self._size = 0
+        self.last_timestamp: Optional[int] = None
+        
+        # Welford trên cửa sổ ring buffer
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._max_deque = deque()  # (seq, level) giảm dần
+        self._min_deque = deque()  # (seq, level) tăng dần
+        
+        # Hồi quy tuyến tính y = a + b*x với x = 0..n-1 trên cửa sổ trượt
+        self._trend_values = deque()
+        self._trend_sy = 0.0
+        self._trend_sxy = 0.0
+        
+        # Đỉnh đã xác nhận: (timestamp, level); anchor là seq của cực trị xác nhận cuối
+        self._confirmed_highs = deque()
+        self._confirmed_lows = deque()
+        self._tentative_highs = []
+        self._tentative_lows = []
+        self._anchor_seq: Optional[int] = None
+        self._last_confirmed_time: Optional[int] = None
+    
+    @property
+    def size(self) -> int:
+        """Số điểm hiện có trong ring buffer"""
+        return self._size
+    
+    def update(self, series: WaterLevelSeries) -> int:
+        """
+        Gộp các điểm mới (timestamp lớn hơn điểm cuối đã thấy) vào trạng thái
+        
+        Args:
+            series: Chuỗi mực nước đã sắp xếp tăng dần theo thời gian
+        
+        Returns:
+            Số điểm mới đã được gộp
+        """
+        times, levels = series.timestamps, series.levels
+        if self.last_timestamp is not None:
+            start = int(np.searchsorted(times, self.last_timestamp, side='right'))
+            times, levels = times[start:], levels[start:]
+        
+        if times.size == 0:
+            return 0
+        
+        # Chỉ những điểm cuối cùng còn nằm trong cửa sổ mới có ý nghĩa
+        if times.size > self.capacity:
+            times, levels = times[-self.capacity:], levels[-self.capacity:]
+        
+        new_count = int(times.size)
+        evict_count = max(0, self._size + new_count - self.capacity)
+        oldest_seq = self._total - self._size
+        
+        if evict_count:
+            evicted = self._take(oldest_seq, min(evict_count, self._size))
+            self._remove_moments(evicted)
+        
+        positions = np.arange(self._total, self._total + new_count) % self.capacity
+        self._times[positions] = times
+        self._levels[positions] = levels
+        self._add_moments(levels)
+        
+        for offset, level in enumerate(levels.tolist()):
+            seq = self._total + offset
+            self._push_extreme_deques(seq, level)
+            self._push_trend(level)
+        
+        self._total += new_count
+        self._size = min(self.capacity, self._size + new_count)
+        self.last_timestamp = int(times[-1])
+        
+        self._expire_old_extremes()
+        self._update_peaks()
+        
+        return new_count
+    
+    def fingerprint(self) -> bytes:
+        """
+        Định danh trạng thái tích lũy (điểm cuối, số điểm đã gộp, tổng Welford, đỉnh đã xác
+        nhận) để cache kết quả theo cả trạng thái chứ không chỉ theo cửa sổ dữ liệu thô
+        """
+        return np.array(
+            [
+                -1 if self.last_timestamp is None else self.last_timestamp,
+                self._total,
+                self._size,
+                -1 if self._anchor_seq is None else self._anchor_seq,
+                -1 if self._last_confirmed_time is None else self._last_confirmed_time,
+                len(self._confirmed_highs),
+                len(self._confirmed_lows)
+            ],
+            dtype=np.int64
+        ).tobytes() + np.array([self._mean, self._m2], dtype=np.float64).tobytes()
+    
+    def window(self, limit: Optional[int] = None) -> WaterLevelSeries:
+        """
+        Lấy `limit` điểm gần nhất (mặc định toàn bộ ring buffer) theo thứ tự thời gian
+        """
+        count = self._size if limit is None else min(limit, self._size)
+        first_seq = self._total - count
+        positions = np.arange(first_seq, self._total) % self.capacity
+        return WaterLevelSeries(self._times[positions], self._levels[positions])
+    
+    def latest(self) -> Tuple[int, float]:
+        """Điểm dữ liệu mới nhất (timestamp ms, mực nước)"""
+        position = (self._total - 1) % self.capacity
+        return int(self._times[position]), float(self._levels[position])
+    
+    def statistics(self) -> Dict[str, float]:
+        """
+        Thống kê trên cửa sổ hiện tại (std dùng ddof=1 như pandas)
+        """
+        maximum = self._max_deque[0][1]
+        minimum = self._min_deque[0][1]
+        variance = self._m2 / (self._count - 1) if self._count > 1 else 0.0
+        return {
+            "max": maximum,
+            "min": minimum,
+            "mean": self._mean,
+            "std": float(np.sqrt(max(variance, 0.0))),
+            "range": maximum - minimum
+        }
+    
+    def trend_slope(self) -> Optional[float]:
+        """
+        Độ dốc hồi quy tuyến tính (mét/điểm) trên `trend_window` điểm cuối
+        """
+        n = len(self._trend_values)
+        if n < 2:
+            return None
+        sx = n * (n - 1) / 2
+        sxx = (n - 1) * n * (2 * n - 1) / 6
+        return (n * self._trend_sxy - sx * self._trend_sy) / (n * sxx - sx * sx)
+    
+    def peaks(self) -> Tuple[WaterLevelSeries, WaterLevelSeries]:
+        """
+        Các đỉnh cao/thấp trong cửa sổ (đã xác nhận + tạm thời ở cuối chuỗi)
+        
+        Returns:
+            Tuple (peaks_high, peaks_low)
+        """
+        return (
+            self._peak_arrays(self._confirmed_highs, self._tentative_highs),
+            self._peak_arrays(self._confirmed_lows, self._tentative_lows)
+        )
+    
+    def _take(self, first_seq: int, count: int) -> np.ndarray:
+        positions = np.arange(first_seq, first_seq + count) % self.capacity
+        return self._levels[positions]
+    
+    def _add_moments(self, levels: np.ndarray):
+        """Gộp một lô điểm vào Welford (công thức song song của Chan)"""
+        levels = levels.astype(np.float64)
+        batch_count = levels.size
+        batch_mean = float(levels.mean())
+        batch_m2 = float(((levels - batch_mean) ** 2).sum())
+        total = self._count + batch_count
+        delta = batch_mean - self._mean
+        self._m2 += batch_m2 + delta * delta * self._count * batch_count / total
+        self._mean += delta * batch_count / total
+        self._count = total
+    
+    def _remove_moments(self, levels: np.ndarray):
+        """Loại một lô điểm cũ khỏi Welford (đảo ngược công thức của Chan)"""
+        batch_count = levels.size
+        remaining = self._count - batch_count
+        if remaining <= 0:
+            self._count, self._mean, self._m2 = 0, 0.0, 0.0
+            return
+        levels = levels.astype(np.float64)
+        batch_mean = float(levels.mean())
+        batch_m2 = float(((levels - batch_mean) ** 2).sum())
+        new_mean = (self._count * self._mean - batch_count * batch_mean) / remaining
+        delta = batch_mean - new_mean
+        self._m2 -= batch_m2 + delta * delta * remaining * batch_count / self._count
+        self._m2 = max(self._m2, 0.0)
+        self._mean = new_mean
+        self._count = remaining
+    
+    def _push_extreme_deques(self, seq: int, level: float):
+        while self._max_deque and self._max_deque[-1][1] <= level:
+            self._max_deque.pop()
+        self._max_deque.append((seq, level))
+        while self._min_deque and self._min_deque[-1][1] >= level:
+            self._min_deque.pop()
+        self._min_deque.append((seq, level))
+    
+    def _push_trend(self, level: float):
+        n = len(self._trend_values)
+        if n < self.trend_window:
+            self._trend_sxy += n * level
+            self._trend_sy += level
+        else:
+            # Trượt cửa sổ: mọi x giảm 1, điểm cũ nhất (x=0) bị loại
+            oldest = self._trend_values.popleft()
+            self._trend_sxy = self._trend_sxy - (self._trend_sy - oldest) + (n - 1) * level
+            self._trend_sy += level - oldest
+        self._trend_values.append(level)
+    
+    def _expire_old_extremes(self):
+        """Loại min/max và đỉnh đã rơi ra khỏi ring buffer"""
+        oldest_seq = self._total - self._size
+        while self._max_deque and self._max_deque[0][0] < oldest_seq:
+            self._max_deque.popleft()
+        while self._min_deque and self._min_deque[0][0] < oldest_seq:
+            self._min_deque.popleft()
+        
+        oldest_time = int(self._times[oldest_seq % self.capacity])
+        for peaks in (self._confirmed_highs, self._confirmed_lows):
+            while peaks and peaks[0][0] < oldest_time:
+                peaks.popleft()
+        if self._anchor_seq is not None and self._anchor_seq < oldest_seq:
+            self._anchor_seq = None
+    
+    def _update_peaks(self):
+        """
+        Quét đỉnh trên đoạn từ cực trị đã xác nhận cuối cùng tới điểm mới nhất
+        
+        Mọi cực trị trừ cái cuối cùng đều đã có cực trị ngược loại phía sau nên được
+        xác nhận; cực trị cuối giữ ở trạng thái tạm thời và được quét lại lần sau.
+        """
+        oldest_seq = self._total - self._size
+        first_seq = self._anchor_seq if self._anchor_seq is not None else oldest_seq
+        count = self._total - first_seq
+        positions = np.arange(first_seq, self._total) % self.capacity
+        times = self._times[positions]
+        levels = self._levels[positions]
+        
+        high_idx, low_idx = find_tide_extrema(
+            levels,
+            times=times,
+            min_prominence=self.min_prominence,
+            min_separation=self.min_separation
+        )
+        
+        extrema = sorted(
+            [(int(i), True) for i in high_idx] + [(int(i), False) for i in low_idx]
+        )
+        self._tentative_highs = []
+        self._tentative_lows = []
+        if not extrema or count < 3:
+            return
+        
+        *confirmed, last = extrema
+        for index, is_high in confirmed:
+            peak_time = int(times[index])
+            # Khi anchor rơi khỏi ring buffer, đoạn quét lại có thể chứa đỉnh đã xác nhận
+            if self._last_confirmed_time is not None and peak_time <= self._last_confirmed_time:
+                continue
+            target = self._confirmed_highs if is_high else self._confirmed_lows
+            target.append((peak_time, float(levels[index])))
+            self._last_confirmed_time = peak_time
+        if confirmed:
+            self._anchor_seq = first_seq + confirmed[-1][0]
+        
+        index, is_high = last
+        target = self._tentative_highs if is_high else self._tentative_lows
+        target.append((int(times[index]), float(levels[index])))
+    
+    @staticmethod
+    def _peak_arrays(confirmed, tentative) -> WaterLevelSeries:
+        peaks = list(confirmed) + tentative
+        return WaterLevelSeries(
+            np.array([p[0] for p in peaks], dtype=np.int64),
+            np.array([p[1] for p in peaks], dtype=np.float32)
+        )
@@ -0,0 +1,385 @@
+"""
+Module sinh dữ liệu mực nước tổng hợp có seed: triều bán nhật/nhật triều và lũ theo mùa
+Deterministic synthetic water-level generator for sizing and load tests
+
+Mỗi trạm có một vị trí giả định dọc sông, từ cửa biển (triều mạnh, lũ yếu) lên thượng
+nguồn (triều yếu, lũ mạnh) như ở ĐBSCL:
+    
+    mực nước = mực nền
+             + các thành phần triều M2, S2, N2, K1, O1, M4 (bị lũ lớn làm suy giảm)
+             + lũ theo mùa (thấp nhất khoảng tháng 4, đỉnh khoảng đầu tháng 10) × độ lớn lũ của năm
+             + nước dâng ngẫu nhiên biến đổi chậm + nhiễu đo, làm tròn 1 cm như dữ liệu MRC
+
+Cùng seed, số trạm, khoảng thời gian và chu kỳ luôn cho đúng cùng dữ liệu. Độ lớn lũ từng
+năm dùng chung cho mọi trạm (năm lũ lớn ảnh hưởng cả vùng).
+
+Dữ liệu được ghi thẳng vào store lịch sử, snapshot mới nhất và mô hình triều trong một thư
+mục riêng (mặc định data/synthetic), kèm stations.json mô tả mạng trạm.
+
+Chạy:
+    python synthetic_data.py                                     # 300 trạm, 365 ngày, theo giờ
+    python synthetic_data.py --stations 500 --days 1825 --seed 11
+    python synthetic_data.py --stations 50 --days 30 --step-minutes 15 --data-dir /tmp/mekong_synth
+    python synthetic_data.py --end 2025-01-01T00:00:00           # cố định mốc cuối để tái lập
+    python loadtest.py serve                                     # phục vụ API trên dữ liệu vừa sinh
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pytz
+
+import config
+from alerts import build_index
+from log_setup import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+DAY_MS = 24 * HOUR_MS
+YEAR_DAYS = 365.2425
+
+STATIONS_FILE = "stations.json"
+
+# Thành phần triều: (tên, chu kỳ giờ, biên độ ở cửa biển m, pha rad, hệ số suy giảm theo khoảng cách)
+CONSTITUENTS = (
+    ("M2", 12.4206012, 0.75, 1.90, 2.2),
+    ("S2", 12.0, 0.30, 2.60, 2.2),
+    ("N2", 12.6583482, 0.15, 1.30, 2.2),
+    ("K1", 23.9344697, 0.60, 0.40, 1.8),
+    ("O1", 25.8193417, 0.45, 5.80, 1.8),
+)
+# Triều nước nông (M4) sinh ra khi sóng triều đi vào sông: nhỏ ở cửa biển, lớn nhất ở trung lưu
+SHALLOW_WATER = ("M4", 6.2103006, 0.12, 3.10)
+
+# Thời gian triều truyền từ cửa biển lên trạm xa nhất (giờ)
+TIDE_TRAVEL_HOURS = 9.0
+# Ngày thấp nhất của chu kỳ lũ tính từ 1/1 (khoảng giữa tháng 4); đỉnh lũ sau đó nửa năm
+FLOOD_LOW_DAY = 95
+FLOOD_SHAPE_POWER = 2.0
+# Khoảng cách giữa các nút nước dâng (biến đổi chậm theo gió, mưa)
+SURGE_KNOT_HOURS = 12
+
+# Đoạn sông giả định: cửa biển -> thượng nguồn (lat, lon)
+RIVER_MOUTH = (9.45, 106.55)
+RIVER_UPSTREAM = (10.85, 105.10)
+
+
+def use_data_dir(data_dir: str):
+    """
+    Chuyển mọi file dữ liệu trong config sang data_dir; gọi trước khi tạo store/scheduler/app
+    """
+    data_dir = str(data_dir)
+    config.DATA_DIR = data_dir
+    config.LATEST_DATA_FILE = os.path.join(data_dir, "latest_water_levels.json")
+    config.HISTORICAL_DATA_FILE = os.path.join(data_dir, "historical_data.csv")
+    config.HISTORICAL_DB_FILE = os.path.join(data_dir, "historical.db")
+    config.RESULT_CACHE['file'] = os.path.join(data_dir, "processed_cache.json")
+    config.TIDE_MODEL['file'] = os.path.join(data_dir, "tide_models.json")
+    config.LEADER_ELECTION['db_file'] = os.path.join(data_dir, "leader.db")
+    config.ALERTS['db_file'] = os.path.join(data_dir, "alerts.db")
+    config.WEBHOOKS['db_file'] = os.path.join(data_dir, "webhooks.db")
+    config.RUN_LEDGER['file'] = os.path.join(data_dir, "run_ledger.jsonl")
+    config.PARQUET_ARCHIVE['dir'] = os.path.join(data_dir, "archive")
+    config.BACKFILL['checkpoint_file'] = os.path.join(data_dir, "backfill_checkpoint.json")
+    config.PROFILING['output_dir'] = os.path.join(data_dir, "profiles")
+
+
+def synthetic_stations(count: int, seed: int) -> Dict[str, Dict]:
+    """
+    Mạng `count` trạm theo định dạng config.STATIONS, trải đều từ cửa biển lên thượng nguồn
+    
+    Khóa "synthetic" chứa tham số sinh dữ liệu của trạm; ngưỡng cảnh báo/báo động được đặt
+    theo đỉnh lũ và biên độ triều kỳ vọng nên năm lũ lớn vượt ngưỡng ở nhiều trạm.
+    """
+    rng = np.random.default_rng([seed, 0])
+    # Lấy mẫu phân tầng để khoảng cách phủ đều đoạn sông dù ít trạm
+    distances = rng.permutation((np.arange(count) + rng.uniform(0, 1, count)) / count)
+    width = max(len(str(count)), 3)
+    
+    stations = {}
+    for index, distance in enumerate(distances.tolist()):
+        base_level = 0.2 + 0.5 * distance + rng.normal(0, 0.05)
+        seasonal_amplitude = 0.3 + 3.2 * distance ** 1.3 * rng.uniform(0.85, 1.15)
+        tide_amplitude = sum(
+            amplitude * math.exp(-damping * distance) for _, _, amplitude, _, damping in CONSTITUENTS
+        )
+        warning = round(base_level + 0.8 * seasonal_amplitude + 0.6 * tide_amplitude, 1)
+        flood = round(warning + 0.2 + 0.1 * seasonal_amplitude, 1)
+        
+        # Vị trí trên đoạn sông, lệch ngang theo các nhánh sông
+        branch = rng.uniform(-0.3, 0.3)
+        lat = RIVER_MOUTH[0] + (RIVER_UPSTREAM[0] - RIVER_MOUTH[0]) * distance + branch * 0.6
+        lon = RIVER_MOUTH[1] + (RIVER_UPSTREAM[1] - RIVER_MOUTH[1]) * distance + branch * 0.4
+        
+        number = f"{index + 1:0{width}d}"
+        stations[f"syn_{number}"] = {
+            "name": f"Trạm tổng hợp {number}",
+            "name_en": f"Synthetic station {number}",
+            "flood_threshold": flood,
+            "warning_threshold": warning,
+            "coordinates": {"lat": round(lat, 4), "lon": round(lon, 4)},
+            "synthetic": {
+                "index": index,
+                "distance": round(distance, 4),  # 0 = cửa biển, 1 = thượng nguồn
+                "base_level": round(base_level, 3),
+                "seasonal_amplitude": round(seasonal_amplitude, 3),
+                "tide_scale": round(rng.uniform(0.9, 1.1), 3)
+            }
+        }
+    return stations
+
+
+def flood_year_factors(hydro_years: np.ndarray, seed: int) -> np.ndarray:
+    """Độ lớn lũ của từng năm thủy văn (dùng chung cho mọi trạm), log-normal quanh 1"""
+    factors = {
+        year: float(np.random.default_rng([seed, 1, year]).lognormal(0.0, 0.18))
+        for year in np.unique(hydro_years).tolist()
+    }
+    return np.array([factors[year] for year in hydro_years.tolist()])
+
+
+def station_levels(station: Dict, timestamps: np.ndarray, seed: int,
+                   noise_std: Optional[float] = None) -> np.ndarray:
+    """
+    Mực nước (mét, làm tròn 1 cm) của một trạm tại các timestamp (epoch ms, tăng dần)
+    """
+    params = station['synthetic']
+    distance = params['distance']
+    noise_std = config.SYNTHETIC_DATA['noise_std'] if noise_std is None else noise_std
+    rng = np.random.default_rng([seed, 2, params['index']])
+    hours = timestamps / HOUR_MS
+    
+    # Lũ theo mùa: 0 ở đầu năm thủy văn (giữa tháng 4), đỉnh giữa năm thủy văn
+    days = timestamps / DAY_MS - FLOOD_LOW_DAY
+    hydro_years = np.floor(days / YEAR_DAYS).astype(np.int64)
+    phase = days / YEAR_DAYS - hydro_years
+    season = ((1 - np.cos(2 * np.pi * phase)) / 2) ** FLOOD_SHAPE_POWER
+    flood = season * flood_year_factors(hydro_years, seed)
+    
+    # Triều: trễ pha theo quãng đường truyền, suy giảm theo khoảng cách và khi lũ lớn
+    lag = TIDE_TRAVEL_HOURS * distance
+    tide = np.zeros_like(hours)
+    for _, period, amplitude, phase0, damping in CONSTITUENTS:
+        tide += amplitude * math.exp(-damping * distance) * np.cos(2 * np.pi * (hours - lag) / period - phase0)
+    _, period, amplitude, phase0 = SHALLOW_WATER
+    tide += amplitude * 4 * distance * (1 - distance) * np.cos(2 * np.pi * (hours - lag) / period - phase0)
+    tide *= params['tide_scale'] * (1 - 0.6 * distance * np.minimum(flood, 1.0))
+    
+    # Nước dâng: nội suy tuyến tính giữa các nút ngẫu nhiên cách nhau SURGE_KNOT_HOURS giờ
+    knot_ms = SURGE_KNOT_HOURS * HOUR_MS
+    first_knot = int(timestamps[0] // knot_ms)
+    knots = np.arange(first_knot, int(timestamps[-1] // knot_ms) + 2) * knot_ms
+    surge = np.interp(timestamps, knots, rng.normal(0, noise_std, knots.size))
+    
+    levels = (
+        params['base_level']
+        + params['seasonal_amplitude'] * flood
+        + tide
+        + surge
+        + rng.normal(0, noise_std / 4, timestamps.size)
+    )
+    return np.round(levels, 2)
+
+
+def make_timestamps(end_ms: int, days: float, step_minutes: int) -> np.ndarray:
+    """Các mốc quan trắc đều nhau, căn theo chu kỳ, kết thúc tại hoặc trước end_ms"""
+    step_ms = step_minutes * MINUTE_MS
+    end_ms = end_ms // step_ms * step_ms
+    count = max(int(days * DAY_MS // step_ms), 1)
+    return end_ms - np.arange(count - 1, -1, -1, dtype=np.int64) * step_ms
+
+
+def raw_station_data(station_id: str, station: Dict, timestamps: np.ndarray, levels: np.ndarray) -> Dict:
+    """Dữ liệu thô theo định dạng output của scraper"""
+    return {
+        "station_id": station_id,
+        "station_name": station['name'],
+        "station_name_en": station['name_en'],
+        "data_source": "synthetic",
+        "raw_data": {
+            "name": station['name'],
+            "data": [
+                {"timestamp": timestamp, "value": level}
+                for timestamp, level in zip(timestamps.tolist(), levels.tolist())
+            ],
+            "unit": "m"
+        }
+    }
+
+
+def register_stations(stations: Dict[str, Dict], replace: bool = False) -> List[str]:
+    """Đưa mạng trạm tổng hợp vào config.STATIONS (replace: bỏ các trạm thật)"""
+    if replace:
+        config.STATIONS.clear()
+    config.STATIONS.update(stations)
+    return list(stations)
+
+
+def load_stations(data_dir: str) -> Dict[str, Dict]:
+    """Đọc mạng trạm đã sinh trong data_dir"""
+    with open(os.path.join(data_dir, STATIONS_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)['stations']
+
+
+def write_snapshot(processed_data: Dict, seed: int):
+    """Ghi snapshot mới nhất cùng định dạng với scheduler (ghi file tạm rồi os.replace)"""
+    output_data = {
+        "last_updated": datetime.now(pytz.timezone(config.TIMEZONE)).isoformat(),
+        "stations": {
+            station_id: {**result, "generation": 1}
+            for station_id, result in processed_data.items()
+        },
+        "alerts": build_index(processed_data),
+        "metadata": {
+            "total_stations": len(processed_data),
+            "data_source": f"Synthetic (synthetic_data.py, seed={seed})",
+            "update_interval_seconds": config.UPDATE_INTERVAL,
+            "fencing_token": None,
+            "generation": 1
+        }
+    }
+    tmp_path = f"{config.LATEST_DATA_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, config.LATEST_DATA_FILE)
+
+
+def generate(data_dir: Optional[str] = None, stations: Optional[int] = None, days: Optional[float] = None,
+             step_minutes: Optional[int] = None, seed: Optional[int] = None,
+             end_ms: Optional[int] = None) -> Dict:
+    """
+    Sinh mạng trạm và ghi lịch sử, snapshot mới nhất, mô hình triều vào data_dir
+    
+    Returns:
+        Thống kê: số trạm, số điểm, số dòng ghi, thời gian, kích thước DB
+    """
+    from data_processor import WaterLevelProcessor
+    from history_store import HistoricalStore
+    
+    synthetic_config = config.SYNTHETIC_DATA
+    data_dir = data_dir or synthetic_config['data_dir']
+    count = stations or synthetic_config['stations']
+    days = days or synthetic_config['days']
+    step_minutes = step_minutes or synthetic_config['step_minutes']
+    seed = synthetic_config['seed'] if seed is None else seed
+    end_ms = end_ms or int(time.time() * 1000)
+    
+    Path(data_dir).mkdir(parents=True, exist_ok=True)
+    use_data_dir(data_dir)
+    network = synthetic_stations(count, seed)
+    register_stations(network, replace=True)
+    with open(os.path.join(data_dir, STATIONS_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            "seed": seed,
+            "days": days,
+            "step_minutes": step_minutes,
+            "end_ms": end_ms,
+            "stations": network
+        }, f, indent=2, ensure_ascii=False)
+    
+    timestamps = make_timestamps(end_ms, days, step_minutes)
+    snapshot_points = max(int(synthetic_config['snapshot_hours'] * 60 // step_minutes), 1)
+    batch_rows = synthetic_config['write_batch_rows']
+    store = HistoricalStore()
+    
+    logger.info(
+        f"Sinh {count} trạm × {timestamps.size:,} điểm ({days:g} ngày, mỗi {step_minutes} phút, "
+        f"seed={seed}) vào {data_dir}"
+    )
+    start_time = time.time()
+    rows_written = 0
+    pending: List = []
+    raw_snapshot = {}
+    for done, (station_id, station) in enumerate(network.items(), start=1):
+        levels = station_levels(station, timestamps, seed)
+        pending.extend(zip(
+            [station_id] * timestamps.size, timestamps.tolist(), levels.tolist(),
+            [None] * timestamps.size, [None] * timestamps.size
+        ))
+        raw_snapshot[station_id] = raw_station_data(
+            station_id, station, timestamps[-snapshot_points:], levels[-snapshot_points:]
+        )
+        
+        if len(pending) >= batch_rows or done == count:
+            rows_written += store.upsert_rows(pending)
+            pending = []
+            elapsed = max(time.time() - start_time, 1e-9)
+            logger.info(
+                f"✓ {done}/{count} trạm, {rows_written:,} dòng ({rows_written / elapsed:,.0f} dòng/giây)"
+            )
+    
+    # Snapshot mới nhất và mô hình triều đi qua đúng đường xử lý của scheduler
+    processed = WaterLevelProcessor(use_cache=False).process_all_stations(raw_snapshot)
+    write_snapshot(processed, seed)
+    store.upsert_snapshots(processed)
+    
+    elapsed = time.time() - start_time
+    points = count * timestamps.size
+    return {
+        "stations": count,
+        "points": points,
+        "rows_written": rows_written,
+        "elapsed_seconds": round(elapsed, 2),
+        "points_per_second": round(points / max(elapsed, 1e-9)),
+        "db_size_mb": round(store.disk_size() / 1024 / 1024, 1),
+        "alerts": sum(1 for data in processed.values() if data['alert']['level'] != 'NORMAL')
+    }
+
+
+def _parse_time(value: str) -> int:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = pytz.timezone(config.TIMEZONE).localize(parsed)
+    return int(parsed.timestamp() * 1000)
+
+
+def main():
+    synthetic_config = config.SYNTHETIC_DATA
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu mực nước tổng hợp vào store")
+    parser.add_argument('--data-dir', default=synthetic_config['data_dir'])
+    parser.add_argument('--stations', type=int, default=synthetic_config['stations'])
+    parser.add_argument('--days', type=float, default=synthetic_config['days'])
+    parser.add_argument('--step-minutes', type=int, default=synthetic_config['step_minutes'])
+    parser.add_argument('--seed', type=int, default=synthetic_config['seed'])
+    parser.add_argument('--end', help='Mốc cuối (ISO 8601, mặc định giờ Việt Nam; mặc định: hiện tại)')
+    parser.add_argument('--force', action='store_true', help='Cho phép ghi vào DATA_DIR của dữ liệu thật')
+    args = parser.parse_args()
+    
+    if os.path.abspath(args.data_dir) == os.path.abspath(config.DATA_DIR) and not args.force:
+        parser.error(f"{args.data_dir} là thư mục dữ liệu thật, dùng --force nếu thực sự muốn ghi đè")
+    
+    try:
+        stats = generate(
+            data_dir=args.data_dir,
+            stations=args.stations,
+            days=args.days,
+            step_minutes=args.step_minutes,
+            seed=args.seed,
+            end_ms=_parse_time(args.end) if args.end else None
+        )
+    except KeyboardInterrupt:
+        logger.info("Đã dừng sinh dữ liệu")
+        sys.exit(130)
+    
+    print(f"\n{'='*60}")
+    print(f"Trạm: {stats['stations']}, điểm: {stats['points']:,} ({stats['rows_written']:,} dòng mới/sửa đổi)")
+    print(f"Thời gian: {stats['elapsed_seconds']} giây, {stats['points_per_second']:,} điểm/giây")
+    print(f"Store lịch sử: {stats['db_size_mb']} MB, trạm đang cảnh báo: {stats['alerts']}")
+    print(f"Phục vụ API trên dữ liệu này: python loadtest.py serve --data-dir {args.data_dir}")
+    print(f"{'='*60}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+Module mô hình thủy triều điều hòa (harmonic analysis) với hệ số được cache theo trạm
+Harmonic tidal constituent model fitted by incremental least squares
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from metrics import CACHE_REQUESTS
+from water_series import WaterLevelSeries, format_iso_timestamps
+
+logger = logging.getLogger(__name__)
+
+# Tốc độ góc các thành phần triều chính (độ/giờ)
+CONSTITUENT_SPEEDS = {
+    "M2": 28.9841042,   # Bán nhật mặt trăng chính
+    "S2": 30.0000000,   # Bán nhật mặt trời chính
+    "N2": 28.4397295,   # Bán nhật elip mặt trăng lớn
+    "K2": 30.0821373,   # Bán nhật mặt trăng - mặt trời
+    "K1": 15.0410686,   # Nhật triều mặt trăng - mặt trời
+    "O1": 13.9430356,   # Nhật triều mặt trăng chính
+    "P1": 14.9589314,   # Nhật triều mặt trời chính
+    "Q1": 13.3986609,   # Nhật triều elip mặt trăng lớn
+    "M4": 57.9682084,   # Nước nông (shallow water) M2+M2
+    "MS4": 58.9841042   # Nước nông M2+S2
+}
+
+MS_PER_HOUR = 3600 * 1000
+
+
+class HarmonicTideModel:
+    """
+    Mô hình h(t) = Z0 + Σ [a_k cos(ω_k t) + b_k sin(ω_k t)] của một trạm
+    
+    Hệ phương trình chuẩn (AᵀWA, AᵀWy) được cộng dồn khi có điểm mới, với trọng số
+    suy giảm theo thời gian (half-life) để bám theo mực nước trung bình theo mùa.
+    Hệ số chỉ được giải lại khi có dữ liệu mới, còn đường dự báo được tính vector hóa.
+    """
+    
+    def __init__(self, constituents: List[str], half_life_hours: float,
+                 rayleigh_factor: float = 1.0, min_points: int = 24):
+        self.constituents = list(constituents)
+        self.half_life_hours = half_life_hours
+        self.rayleigh_factor = rayleigh_factor
+        self.min_points = min_points
+        
+        size = 1 + 2 * len(self.constituents)
+        self.normal_matrix = np.zeros((size, size))
+        self.normal_vector = np.zeros(size)
+        self.count = 0
+        self.first_timestamp: Optional[int] = None
+        self.last_timestamp: Optional[int] = None
+        
+        self._speeds = np.radians([CONSTITUENT_SPEEDS[name] for name in self.constituents])
+        self._solution: Optional[Dict] = None
+    
+    def update(self, series: WaterLevelSeries) -> int:
+        """
+        Cộng dồn các điểm mới hơn last_timestamp vào hệ phương trình chuẩn
+        
+        Returns:
+            Số điểm mới đã được gộp
+        """
+        times, levels = series.timestamps, series.levels
+        if self.last_timestamp is not None:
+            start = int(np.searchsorted(times, self.last_timestamp, side='right'))
+            times, levels = times[start:], levels[start:]
+        if times.size == 0:
+            return 0
+        
+        newest = int(times[-1])
+        if self.last_timestamp is not None:
+            # Làm cũ phần đã tích lũy theo khoảng thời gian trôi qua
+            decay = self._decay((newest - self.last_timestamp) / MS_PER_HOUR)
+            self.normal_matrix *= decay
+            self.normal_vector *= decay
+        
+        design = self._design_matrix(times)
+        weights = self._decay((newest - times) / MS_PER_HOUR)
+        weighted = design * weights[:, None]
+        self.normal_matrix += weighted.T @ design
+        self.normal_vector += weighted.T @ levels.astype(np.float64)
+        
+        self.count += int(times.size)
+        if self.first_timestamp is None:
+            self.first_timestamp = int(times[0])
+        self.last_timestamp = newest
+        self._solution = None
+        
+        return int(times.size)
+    
+    def solve(self) -> Optional[Dict]:
+        """
+        Giải hệ số cho các thành phần phân giải được (tiêu chuẩn Rayleigh) trên dữ liệu hiện có
+        
+        Returns:
+            Dict {"mean", "constituents": {name: (a, b)}} hoặc None nếu chưa đủ dữ liệu
+        """
+        if self._solution is not None:
+            return self._solution
+        if self.count < self.min_points:
+            return None
+        
+        selected = self._resolvable_constituents()
+        columns = [0]
+        for name in selected:
+            k = self.constituents.index(name)
+            columns.extend([1 + 2 * k, 2 + 2 * k])
+        columns = np.array(columns)
+        
+        matrix = self.normal_matrix[np.ix_(columns, columns)]
+        vector = self.normal_vector[columns]
+        # Ridge rất nhỏ để ổn định khi dữ liệu còn ngắn
+        ridge = 1e-9 * max(np.trace(matrix), 1.0) / len(columns)
+        try:
+            coefficients = np.linalg.solve(matrix + ridge * np.eye(len(columns)), vector)
+        except np.linalg.LinAlgError:
+            return None
+        
+        self._solution = {
+            "mean": float(coefficients[0]),
+            "constituents": {
+                name: (float(coefficients[1 + 2 * i]), float(coefficients[2 + 2 * i]))
+                for i, name in enumerate(selected)
+            }
+        }
+        return self._solution
+    
+    def predict(self, timestamps_ms: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Tính mực nước dự báo tại các thời điểm (vector hóa)
+        """
+        solution = self.solve()
+        if solution is None:
+            return None
+        
+        hours = np.asarray(timestamps_ms, dtype=np.float64) / MS_PER_HOUR
+        levels = np.full(hours.shape, solution['mean'])
+        for name, (a, b) in solution['constituents'].items():
+            angle = math.radians(CONSTITUENT_SPEEDS[name]) * hours
+            levels += a * np.cos(angle) + b * np.sin(angle)
+        return levels
+    
+    def describe(self) -> List[Dict]:
+        """
+        Biên độ (m) và pha (độ, so với epoch Unix) của các thành phần đã fit
+        """
+        solution = self.solve()
+        if solution is None:
+            return []
+        return [
+            {
+                "name": name,
+                "speed_deg_per_hour": CONSTITUENT_SPEEDS[name],
+                "amplitude": round(math.hypot(a, b), 4),
+                "phase_deg": round(math.degrees(math.atan2(b, a)) % 360, 2)
+            }
+            for name, (a, b) in solution['constituents'].items()
+        ]
+    
+    def to_dict(self) -> Dict:
+        return {
+            "constituents": self.constituents,
+            "count": self.count,
+            "first_timestamp": self.first_timestamp,
+            "last_timestamp": self.last_timestamp,
+            "normal_matrix": self.normal_matrix.tolist(),
+            "normal_vector": self.normal_vector.tolist()
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict, half_life_hours: float, rayleigh_factor: float = 1.0,
+                  min_points: int = 24) -> 'HarmonicTideModel':
+        model = cls(data['constituents'], half_life_hours, rayleigh_factor, min_points)
+        model.count = data['count']
+        model.first_timestamp = data['first_timestamp']
+        model.last_timestamp = data['last_timestamp']
+        model.normal_matrix = np.array(data['normal_matrix'], dtype=np.float64)
+        model.normal_vector = np.array(data['normal_vector'], dtype=np.float64)
+        return model
+    
+    def _design_matrix(self, timestamps_ms: np.ndarray) -> np.ndarray:
+        hours = timestamps_ms.astype(np.float64) / MS_PER_HOUR
+        angles = np.outer(hours, self._speeds)
+        design = np.empty((hours.size, 1 + 2 * len(self.constituents)))
+        design[:, 0] = 1.0
+        design[:, 1::2] = np.cos(angles)
+        design[:, 2::2] = np.sin(angles)
+        return design
+    
+    def _decay(self, hours):
+        return np.power(0.5, np.asarray(hours, dtype=np.float64) / self.half_life_hours)
+    
+    def _resolvable_constituents(self) -> List[str]:
+        """
+        Chọn thành phần theo thứ tự ưu tiên, bỏ các thành phần quá gần tần số thành phần
+        đã chọn so với độ dài dữ liệu (|Δω|·T < 360°·rayleigh_factor)
+        """
+        span_hours = (self.last_timestamp - self.first_timestamp) / MS_PER_HOUR
+        # Dữ liệu cũ hơn vài half-life gần như không còn trọng số
+        span_hours = min(span_hours, 3 * self.half_life_hours)
+        max_constituents = (self.count - 1) // 2
+        
+        selected: List[str] = []
+        for name in self.constituents:
+            if len(selected) >= max_constituents:
+                break
+            speed = CONSTITUENT_SPEEDS[name]
+            if speed * span_hours < 360 * self.rayleigh_factor:
+                continue
+            if all(abs(speed - CONSTITUENT_SPEEDS[other]) * span_hours >= 360 * self.rayleigh_factor
+                   for other in selected):
+                selected.append(name)
+        return selected
+
+
+class TideModelStore:
+    """
+    Tập mô hình triều của các trạm, lưu/nạp từ file JSON dùng chung giữa scheduler và API
+    """
+    
+    def __init__(self, model_config: Dict):
+        self.config = model_config
+        self.file_path = model_config['file']
+        self.models: Dict[str, HarmonicTideModel] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._loaded_mtime: Optional[float] = None
+        self._forecast_cache: 'OrderedDict[tuple, List[Dict]]' = OrderedDict()
+    
+    def update(self, station_id: str, series: WaterLevelSeries) -> int:
+        """Gộp điểm mới của một trạm vào mô hình (tạo mô hình nếu chưa có)"""
+        with self._lock:
+            model = self.models.get(station_id)
+            if model is None:
+                model = self._new_model()
+                self.models[station_id] = model
+            added = model.update(series)
+            if added:
+                self._dirty = True
+            return added
+    
+    def bootstrap(self, station_id: str, series: WaterLevelSeries) -> bool:
+        """
+        Fit lại mô hình của một trạm từ lịch sử đã lưu khi lịch sử bắt đầu sớm hơn dữ liệu mô hình
+        đang có (vd. ngay sau deploy mô hình chỉ mới thấy vài cửa sổ scrape, chưa tách được M2/S2)
+        
+        Returns:
+            True nếu đã thay mô hình
+        """
+        if len(series) < self.config['min_points']:
+            return False
+        
+        with self._lock:
+            current = self.models.get(station_id)
+            if current is not None and current.first_timestamp is not None \
+                    and current.first_timestamp <= int(series.timestamps[0]):
+                return False
+        
+        model = self._new_model()
+        model.update(series)
+        with self._lock:
+            # Các điểm scrape mới hơn lịch sử (nếu có) sẽ được cộng dồn ở lượt cập nhật kế tiếp
+            self.models[station_id] = model
+            self._dirty = True
+        return True
+    
+    def export_models(self, station_ids: Iterable[str]) -> Dict[str, Dict]:
+        """Trạng thái (to_dict) mô hình của các trạm đã có mô hình, để gửi sang process khác"""
+        with self._lock:
+            return {
+                station_id: self.models[station_id].to_dict()
+                for station_id in station_ids if station_id in self.models
+            }
+    
+    def import_models(self, states: Dict[str, Dict]):
+        """Thay mô hình của các trạm bằng trạng thái do export_models (ở process khác) trả về"""
+        models = {station_id: self._model_from_dict(state) for station_id, state in states.items()}
+        with self._lock:
+            self.models.update(models)
+            if models:
+                self._dirty = True
+    
+    def _model_from_dict(self, data: Dict) -> HarmonicTideModel:
+        return HarmonicTideModel.from_dict(
+            data,
+            half_life_hours=self.config['half_life_days'] * 24,
+            rayleigh_factor=self.config['rayleigh_factor'],
+            min_points=self.config['min_points']
+        )
+    
+    def _new_model(self) -> HarmonicTideModel:
+        return HarmonicTideModel(
+            self.config['constituents'],
+            half_life_hours=self.config['half_life_days'] * 24,
+            rayleigh_factor=self.config['rayleigh_factor'],
+            min_points=self.config['min_points']
+        )
+    
+    def get(self, station_id: str) -> Optional[HarmonicTideModel]:
+        with self._lock:
+            return self.models.get(station_id)
+    
+    def forecast(self, station_id: str, start_ms: int, horizon_hours: int, step_minutes: int,
+                 timezone) -> Optional[List[Dict]]:
+        """
+        Đường dự báo của một trạm, cache theo (trạm, mốc bắt đầu, tầm dự báo, phiên bản mô hình)
+        
+        Returns:
+            Danh sách điểm {timestamp, datetime, water_level} hoặc None nếu chưa có mô hình
+        """
+        model = self.get(station_id)
+        if model is None:
+            return None
+        
+        key = (station_id, start_ms, horizon_hours, step_minutes, model.last_timestamp, model.count)
+        with self._lock:
+            cached = self._forecast_cache.get(key)
+            if cached is not None:
+                self._forecast_cache.move_to_end(key)
+        CACHE_REQUESTS.inc("forecast", "miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+        
+        step_ms = step_minutes * 60 * 1000
+        timestamps = start_ms + np.arange(horizon_hours * 60 // step_minutes + 1, dtype=np.int64) * step_ms
+        levels = model.predict(timestamps)
+        if levels is None:
+            return None
+        
+        points = [
+            {"timestamp": timestamp, "datetime": iso, "water_level": level}
+            for timestamp, iso, level in zip(
+                timestamps.tolist(),
+                format_iso_timestamps(timestamps, timezone),
+                np.round(levels, 3).tolist()
+            )
+        ]
+        
+        with self._lock:
+            self._forecast_cache[key] = points
+            while len(self._forecast_cache) > self.config['forecast_cache_size']:
+                self._forecast_cache.popitem(last=False)
+        return points
+    
+    def load(self) -> bool:
+        """
+        Nạp mô hình từ file nếu file đã thay đổi kể từ lần nạp trước
+        
+        Returns:
+            True nếu đã nạp lại
+        """
+        if not os.path.exists(self.file_path):
+            return False
+        
+        mtime = os.path.getmtime(self.file_path)
+        if mtime == self._loaded_mtime:
+            return False
+        
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            models = {
+                station_id: self._model_from_dict(model_data)
+                for station_id, model_data in data.get('models', {}).items()
+            }
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi đọc mô hình triều {self.file_path}: {str(e)}")
+            return False
+        
+        with self._lock:
+            self.models = models
+            self._loaded_mtime = mtime
+            self._dirty = False
+        return True
+    
+    def save(self):
+        """Ghi mô hình xuống file (atomic) nếu có thay đổi"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                "models": {
+                    station_id: model.to_dict() for station_id, model in self.models.items()
+                }
+            }
+            self._dirty = False
+        
+        try:
+            Path(self.file_path).parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = f"{self.file_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.file_path)
+            self._loaded_mtime = os.path.getmtime(self.file_path)
+        except Exception as e:
+            logger.error(f"✗ Lỗi khi lưu mô hình triều: {str(e)}")
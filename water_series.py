@@ -0,0 +1,140 @@
+"""
+Module chuỗi mực nước gọn nhẹ dựa trên NumPy (thay cho pandas trên hot path)
+Lightweight NumPy-backed water level series
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+
+class WaterLevelSeries:
+    """
+    Chuỗi thời gian mực nước: epoch milliseconds (int64) + mực nước (float32)
+    
+    Luôn được sắp xếp tăng dần theo thời gian và không có timestamp trùng lặp.
+    """
+    
+    __slots__ = ('timestamps', 'levels')
+    
+    def __init__(self, timestamps: np.ndarray, levels: np.ndarray):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.levels = np.asarray(levels, dtype=np.float32)
+    
+    @classmethod
+    def empty(cls) -> 'WaterLevelSeries':
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+    
+    @classmethod
+    def from_points(cls, data_points: List[Dict]) -> 'WaterLevelSeries':
+        """
+        Tạo chuỗi từ data points thô của scraper ({"timestamp": ms, "value": m})
+        
+        Bỏ điểm thiếu giá trị, sắp xếp theo thời gian và giữ bản ghi cuối khi trùng timestamp.
+        """
+        count = len(data_points)
+        if count == 0:
+            return cls.empty()
+        
+        timestamps = np.fromiter(
+            (point['timestamp'] for point in data_points), dtype=np.float64, count=count
+        )
+        levels = np.fromiter(
+            (np.nan if point.get('value') is None else point['value'] for point in data_points),
+            dtype=np.float64,
+            count=count
+        )
+        
+        valid = np.isfinite(timestamps) & np.isfinite(levels)
+        timestamps = timestamps[valid].astype(np.int64)
+        levels = levels[valid]
+        
+        if timestamps.size == 0:
+            return cls.empty()
+        
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        levels = levels[order]
+        
+        # Sau khi sort ổn định, điểm cuối của mỗi nhóm trùng là bản ghi đến sau
+        keep = np.r_[timestamps[1:] != timestamps[:-1], True]
+        return cls(timestamps[keep], levels[keep])
+    
+    def __len__(self) -> int:
+        return int(self.timestamps.size)
+    
+    def tail(self, limit: int) -> 'WaterLevelSeries':
+        """Lấy `limit` điểm gần nhất"""
+        if limit >= len(self):
+            return self
+        return WaterLevelSeries(self.timestamps[-limit:], self.levels[-limit:])
+    
+    def format_iso(self, timezone) -> List[str]:
+        """
+        Format toàn bộ timestamp sang ISO 8601 theo múi giờ, xử lý theo lô
+        
+        Kết quả giống datetime.isoformat(): chỉ hiện phần thập phân khi khác 0.
+        """
+        return format_iso_timestamps(self.timestamps, timezone)
+    
+    def to_points(self, timezone, decimals: int = 2) -> List[Dict]:
+        """
+        Chuyển chuỗi thành danh sách điểm cho API: {timestamp, datetime, water_level}
+        """
+        return [
+            {"timestamp": timestamp, "datetime": iso, "water_level": level}
+            for timestamp, iso, level in zip(
+                self.timestamps.tolist(),
+                self.format_iso(timezone),
+                np.round(self.levels.astype(np.float64), decimals).tolist()
+            )
+        ]
+
+
+def to_level(value) -> float:
+    """
+    Chuyển một mực nước float32 sang float Python, bỏ nhiễu biểu diễn nhị phân
+    """
+    return round(float(value), 4)
+
+
+def format_iso_timestamps(timestamps_ms: Iterable[int], timezone) -> List[str]:
+    """
+    Format một mảng epoch ms sang chuỗi ISO 8601 có offset múi giờ
+    
+    Múi giờ có offset cố định trên toàn khoảng (như Asia/Ho_Chi_Minh) được format
+    bằng numpy.datetime_as_string; nếu offset thay đổi (DST) thì format từng điểm.
+    """
+    timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+    if timestamps_ms.size == 0:
+        return []
+    
+    first_offset = _utc_offset(int(timestamps_ms[0]), timezone)
+    last_offset = _utc_offset(int(timestamps_ms[-1]), timezone)
+    if first_offset != last_offset:
+        return [
+            datetime.fromtimestamp(ms / 1000, tz=timezone).isoformat()
+            for ms in timestamps_ms.tolist()
+        ]
+    
+    offset_ms = int(first_offset.total_seconds() * 1000)
+    local = (timestamps_ms + offset_ms).astype('datetime64[ms]')
+    
+    iso = np.datetime_as_string(local, unit='s')
+    has_fraction = (timestamps_ms % 1000) != 0
+    if has_fraction.any():
+        iso = np.where(has_fraction, np.datetime_as_string(local, unit='us'), iso)
+    
+    return np.char.add(iso, _format_offset(first_offset)).tolist()
+
+
+def _utc_offset(timestamp_ms: int, timezone) -> timedelta:
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone).utcoffset()
+
+
+def _format_offset(offset: timedelta) -> str:
+    total_minutes = int(offset.total_seconds() // 60)
+    sign = '+' if total_minutes >= 0 else '-'
+    hours, minutes = divmod(abs(total_minutes), 60)
+    return f"{sign}{hours:02d}:{minutes:02d}"
@@ -0,0 +1,744 @@
+"""
+Module webhook: đăng ký nhận và gửi nền các lần chuyển mức cảnh báo qua HTTP
+Webhook subscriptions and a batched, retrying background dispatcher over a durable SQLite outbox
+
+Thay vì hệ thống bên ngoài gọi /api/alerts mỗi phút, các lần chuyển mức (nhật ký
+alert_transitions của AlertTracker) được đẩy tới các URL đã đăng ký:
+
+- Fan-out: dispatcher đọc nhật ký chuyển mức từ con trỏ seq đã lưu và ghi một dòng outbox cho mỗi
+  subscription khớp (mức, trạm), con trỏ và outbox cập nhật trong cùng một transaction. Nhật ký và
+  outbox đều nằm trên đĩa nên chuyển mức không bị mất khi process dừng giữa chừng
+- Gửi: mỗi subscription một lô tối đa batch_size chuyển mức mỗi request (POST JSON), tối đa
+  `concurrency` lô song song; trong một subscription, các lô gửi theo đúng thứ tự seq
+- Lỗi (timeout, mã khác 2xx): thử lại sau base * 2^(n-1) giây (có jitter, tối đa backoff_max_seconds);
+  quá max_attempts thì đánh dấu dead và gửi tiếp các chuyển mức sau
+- Giao ít nhất một lần: bên nhận loại trùng theo `seq` của từng chuyển mức
+
+Scheduler chỉ báo hiệu (notify) khi có chuyển mức mới, không chờ mạng; dispatcher chỉ chạy trên
+replica leader. Body được ký HMAC-SHA256 bằng secret của subscription (header X-Mekong-Signature).
+
+Thử với HTTP sink local:
+    python webhooks.py sink --port 8765 --fail-rate 0.3
+    python webhooks.py add http://127.0.0.1:8765/hook --levels CRITICAL
+    python webhooks.py list
+    python webhooks.py remove <subscription_id>
+    python webhooks.py test   # kiểm tra end-to-end với sink trên port ngẫu nhiên
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import random
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import pytz
+import requests
+
+import config
+from alerts import SEVERITY, AlertTracker
+from log_setup import setup_logging
+from metrics import WEBHOOK_DELIVERIES
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_subscriptions (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    secret TEXT,
+    levels TEXT NOT NULL,
+    station_ids TEXT,
+    created_at INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS webhook_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    subscription_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at INTEGER NOT NULL,
+    last_error TEXT,
+    created_at INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_outbox_pending ON webhook_outbox (subscription_id, status, id);
+
+CREATE TABLE IF NOT EXISTS webhook_cursor (
+    name TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+"""
+
+SIGNATURE_HEADER = "X-Mekong-Signature"
+DELIVERY_HEADER = "X-Mekong-Delivery"
+
+
+def token_matches(supplied: Optional[str]) -> bool:
+    """So sánh token (thời gian hằng) với WEBHOOKS['admin_token']; luôn False nếu chưa cấu hình token"""
+    expected = config.WEBHOOKS['admin_token']
+    if not expected or not supplied:
+        return False
+    return hmac.compare_digest(supplied.encode('utf-8'), expected.encode('utf-8'))
+
+
+def sign(secret: str, body: bytes) -> str:
+    """Giá trị header X-Mekong-Signature: sha256=<hex HMAC-SHA256 của body>"""
+    return "sha256=" + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def backoff_seconds(attempts: int, base: float, maximum: float) -> float:
+    """Thời gian chờ trước lần thử thứ attempts + 1 (full jitter trong nửa trên của khoảng)"""
+    delay = min(base * 2 ** max(attempts - 1, 0), maximum)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def validate_subscription(url: str, levels: Optional[Iterable[str]] = None,
+                          station_ids: Optional[Iterable[str]] = None) -> Optional[str]:
+    """Thông báo lỗi nếu tham số đăng ký không hợp lệ, None nếu hợp lệ"""
+    parsed = urlparse(url or "")
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        return "url phải là URL http(s) đầy đủ"
+    if levels is not None:
+        unknown = [level for level in levels if level not in SEVERITY]
+        if unknown or not list(levels):
+            return f"levels phải là danh sách khác rỗng gồm: {', '.join(SEVERITY)}"
+    if station_ids is not None:
+        unknown = [station_id for station_id in station_ids if station_id not in config.STATIONS]
+        if unknown:
+            return f"Không tìm thấy trạm: {', '.join(unknown)}"
+    return None
+
+
+class WebhookStore:
+    """
+    Subscription, outbox và con trỏ fan-out trong SQLite (WAL) dùng chung giữa scheduler
+    (dispatcher) và các replica API (đăng ký/xem trạng thái)
+    """
+    
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or config.WEBHOOKS['db_file']
+        self.timezone = pytz.timezone(config.TIMEZONE)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+    
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+    
+    def _write(self, func: Callable[[sqlite3.Connection], object]):
+        conn = self._connection()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return result
+    
+    def _iso(self, timestamp_ms: int) -> str:
+        return datetime.fromtimestamp(timestamp_ms / 1000, self.timezone).isoformat()
+    
+    def _subscription(self, row: tuple) -> Dict:
+        subscription_id, url, secret, levels, station_ids, created_at = row
+        return {
+            "id": subscription_id,
+            "url": url,
+            "secret": secret,
+            "levels": levels.split(","),
+            "station_ids": station_ids.split(",") if station_ids else None,
+            "created_at": self._iso(created_at)
+        }
+    
+    def add_subscription(self, url: str, secret: Optional[str] = None,
+                         levels: Optional[Iterable[str]] = None,
+                         station_ids: Optional[Iterable[str]] = None) -> Dict:
+        """
+        Đăng ký URL nhận các lần chuyển mức vào hoặc ra khỏi một trong `levels`
+        (mặc định WARNING, CRITICAL: mọi lần chuyển mức), chỉ các trạm station_ids nếu có
+        """
+        row = (
+            uuid.uuid4().hex[:16],
+            url,
+            secret or None,
+            ",".join(levels or ("WARNING", "CRITICAL")),
+            ",".join(station_ids) if station_ids else None,
+            int(time.time() * 1000)
+        )
+        self._write(lambda conn: conn.execute(
+            "INSERT INTO webhook_subscriptions (id, url, secret, levels, station_ids, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)", row
+        ))
+        return self._subscription(row)
+    
+    def remove_subscription(self, subscription_id: str) -> bool:
+        """Xóa subscription cùng các chuyển mức chưa gửi của nó"""
+        def remove(conn: sqlite3.Connection) -> bool:
+            conn.execute("DELETE FROM webhook_outbox WHERE subscription_id = ?", (subscription_id,))
+            return conn.execute(
+                "DELETE FROM webhook_subscriptions WHERE id = ?", (subscription_id,)
+            ).rowcount > 0
+        return self._write(remove)
+    
+    def subscriptions(self) -> List[Dict]:
+        rows = self._connection().execute(
+            "SELECT id, url, secret, levels, station_ids, created_at FROM webhook_subscriptions ORDER BY created_at"
+        ).fetchall()
+        return [self._subscription(row) for row in rows]
+    
+    def status(self) -> Dict:
+        """Subscription (không kèm secret) với số chuyển mức đang chờ/dead, và con trỏ fan-out"""
+        conn = self._connection()
+        counts: Dict[Tuple[str, str], int] = {
+            (subscription_id, status): count
+            for subscription_id, status, count in conn.execute(
+                "SELECT subscription_id, status, COUNT(*) FROM webhook_outbox GROUP BY subscription_id, status"
+            )
+        }
+        # Lỗi của lần gửi thất bại gần nhất (cột lẻ đi kèm MAX() lấy từ chính dòng đó trong SQLite)
+        errors = {
+            subscription_id: last_error
+            for subscription_id, last_error, _ in conn.execute(
+                "SELECT subscription_id, last_error, MAX(id) FROM webhook_outbox "
+                "WHERE last_error IS NOT NULL GROUP BY subscription_id"
+            )
+        }
+        
+        subscriptions = []
+        for subscription in self.subscriptions():
+            subscription_id = subscription['id']
+            entry = {key: value for key, value in subscription.items() if key != 'secret'}
+            entry.update({
+                "has_secret": subscription['secret'] is not None,
+                "pending": counts.get((subscription_id, 'pending'), 0),
+                "dead": counts.get((subscription_id, 'dead'), 0),
+                "last_error": errors.get(subscription_id)
+            })
+            subscriptions.append(entry)
+        return {"subscriptions": subscriptions, "cursor": self.cursor()}
+    
+    def cursor(self) -> Optional[int]:
+        """seq cuối cùng đã đưa vào outbox (None nếu chưa khởi tạo)"""
+        row = self._connection().execute("SELECT seq FROM webhook_cursor WHERE name = 'fanout'").fetchone()
+        return row[0] if row else None
+    
+    def reset_cursor(self, seq: int):
+        self._write(lambda conn: conn.execute(
+            "INSERT INTO webhook_cursor (name, seq) VALUES ('fanout', ?) "
+            "ON CONFLICT (name) DO UPDATE SET seq = excluded.seq", (seq,)
+        ))
+    
+    def enqueue(self, transitions: List[Dict], after_seq: int) -> int:
+        """
+        Ghi một dòng outbox cho mỗi cặp (subscription khớp, chuyển mức) và dời con trỏ tới seq
+        cuối của transitions, trong một transaction; bỏ qua nếu con trỏ đã khác after_seq
+        
+        Returns:
+            Số dòng outbox đã ghi
+        """
+        if not transitions:
+            return 0
+        
+        def enqueue(conn: sqlite3.Connection) -> int:
+            row = conn.execute("SELECT seq FROM webhook_cursor WHERE name = 'fanout'").fetchone()
+            if row is None or row[0] != after_seq:
+                return 0
+            now = int(time.time() * 1000)
+            rows = []
+            for subscription in self.subscriptions():
+                levels = set(subscription['levels'])
+                station_ids = subscription['station_ids']
+                for transition in transitions:
+                    if station_ids is not None and transition['station_id'] not in station_ids:
+                        continue
+                    if transition['from_level'] not in levels and transition['to_level'] not in levels:
+                        continue
+                    rows.append((
+                        subscription['id'], transition['seq'],
+                        json.dumps(transition, ensure_ascii=False), now, now
+                    ))
+            conn.executemany(
+                "INSERT INTO webhook_outbox (subscription_id, seq, payload, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+            conn.execute("UPDATE webhook_cursor SET seq = ? WHERE name = 'fanout'", (transitions[-1]['seq'],))
+            return len(rows)
+        return self._write(enqueue)
+    
+    def due_batches(self, batch_size: int, now_ms: Optional[int] = None) -> List[Tuple[Dict, List[tuple]]]:
+        """
+        Lô đến hạn của mỗi subscription: batch_size dòng pending cũ nhất, chỉ khi dòng cũ nhất
+        đã đến hạn (lô đang chờ thử lại giữ các chuyển mức sau lại để giữ thứ tự)
+        
+        Returns:
+            [(subscription, [(outbox_id, attempts, payload), ...]), ...]
+        """
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        conn = self._connection()
+        batches = []
+        for subscription in self.subscriptions():
+            rows = conn.execute(
+                "SELECT id, attempts, payload, next_attempt_at FROM webhook_outbox "
+                "WHERE subscription_id = ? AND status = 'pending' ORDER BY id LIMIT ?",
+                (subscription['id'], batch_size)
+            ).fetchall()
+            if rows and rows[0][3] <= now_ms:
+                batches.append((subscription, [row[:3] for row in rows]))
+        return batches
+    
+    def mark_delivered(self, outbox_ids: List[int]):
+        placeholders = ",".join("?" * len(outbox_ids))
+        self._write(lambda conn: conn.execute(
+            f"DELETE FROM webhook_outbox WHERE id IN ({placeholders})", outbox_ids
+        ))
+    
+    def mark_failed(self, outbox_ids: List[int], error: str, next_attempt_at: int, max_attempts: int) -> int:
+        """
+        Tăng số lần thử của lô và hẹn lần thử kế tiếp; dòng đã đủ max_attempts thành dead
+        
+        Returns:
+            Số dòng vừa thành dead
+        """
+        placeholders = ",".join("?" * len(outbox_ids))
+        
+        def fail(conn: sqlite3.Connection) -> int:
+            conn.execute(
+                f"UPDATE webhook_outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ? "
+                f"WHERE id IN ({placeholders})",
+                [error[:500], next_attempt_at] + outbox_ids
+            )
+            return conn.execute(
+                f"UPDATE webhook_outbox SET status = 'dead' WHERE id IN ({placeholders}) AND attempts >= ?",
+                outbox_ids + [max_attempts]
+            ).rowcount
+        return self._write(fail)
+    
+    def prune_dead(self, retention_days: float):
+        cutoff = int((time.time() - retention_days * 86400) * 1000)
+        self._write(lambda conn: conn.execute(
+            "DELETE FROM webhook_outbox WHERE status = 'dead' AND created_at < ?", (cutoff,)
+        ))
+
+
+class WebhookDispatcher:
+    """
+    Thread nền đưa chuyển mức từ nhật ký vào outbox và gửi các lô đến hạn qua một
+    ThreadPoolExecutor giới hạn WEBHOOKS['concurrency'] request song song
+    
+    is_active: chỉ làm việc khi hàm trả True (replica leader), để các replica không gửi trùng
+    """
+    
+    def __init__(self, tracker: AlertTracker, store: Optional[WebhookStore] = None,
+                 is_active: Callable[[], bool] = lambda: True):
+        webhook_config = config.WEBHOOKS
+        self.tracker = tracker
+        self.store = store or WebhookStore()
+        self.is_active = is_active
+        self.concurrency = webhook_config['concurrency']
+        self.batch_size = webhook_config['batch_size']
+        self.timeout = webhook_config['timeout_seconds']
+        self.max_attempts = webhook_config['max_attempts']
+        self.backoff_base = webhook_config['backoff_base_seconds']
+        self.backoff_max = webhook_config['backoff_max_seconds']
+        self.poll_interval = webhook_config['poll_interval_seconds']
+        self.fanout_batch = webhook_config['fanout_batch']
+        self.dead_retention_days = webhook_config['dead_retention_days']
+        
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._sessions = threading.local()
+        self._last_prune = 0.0
+    
+    def notify(self):
+        """Báo có chuyển mức mới (không chặn: chỉ đánh thức thread gửi)"""
+        self._wake.set()
+    
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="webhook")
+        self._thread = threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info(f"✓ Webhook dispatcher đã chạy ({self.concurrency} lô song song, lô {self.batch_size})")
+    
+    def stop(self):
+        """Dừng thread; lô đang gửi dở được gửi lại sau khi khởi động (outbox vẫn giữ)"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+    
+    def _run(self):
+        while not self._stop.is_set():
+            more = False
+            if self.is_active():
+                try:
+                    more = self.run_once()
+                except Exception as e:
+                    logger.error(f"✗ Lỗi webhook dispatcher: {str(e)}", exc_info=True)
+            if not more:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+    
+    def run_once(self) -> bool:
+        """
+        Một vòng: fan-out chuyển mức mới rồi gửi các lô đến hạn (chờ tất cả xong)
+        
+        Returns:
+            True nếu có thể còn việc ngay (fan-out chưa hết hoặc có lô đầy vừa gửi thành công)
+        """
+        more = self.fan_out()
+        
+        now = time.time()
+        if now - self._last_prune > 3600:
+            self.store.prune_dead(self.dead_retention_days)
+            self._last_prune = now
+        
+        batches = self.store.due_batches(self.batch_size)
+        if not batches:
+            return more
+        
+        if self._executor is None:
+            results = [self._deliver(subscription, rows) for subscription, rows in batches]
+        else:
+            futures = [self._executor.submit(self._deliver, subscription, rows) for subscription, rows in batches]
+            results = [future.result() for future in futures]
+        
+        for (subscription, rows), error in zip(batches, results):
+            self._record(subscription, rows, error)
+            if error is None and len(rows) == self.batch_size:
+                more = True
+        return more
+    
+    def fan_out(self) -> bool:
+        """
+        Đưa các chuyển mức sau con trỏ vào outbox (tối đa fanout_batch mỗi lần gọi)
+        
+        Lần đầu (DB webhook mới) con trỏ đặt ở chuyển mức mới nhất: không gửi lại lịch sử cũ.
+        Returns:
+            True nếu có thể còn chuyển mức chưa fan-out
+        """
+        cursor = self.store.cursor()
+        last_seq = self.tracker.last_seq()
+        if cursor is None or cursor > last_seq:
+            # Chưa khởi tạo, hoặc DB cảnh báo được tạo lại (seq bắt đầu lại từ đầu)
+            self.store.reset_cursor(last_seq)
+            return False
+        if cursor == last_seq:
+            return False
+        
+        transitions = self.tracker.history(cursor, self.fanout_batch)
+        queued = self.store.enqueue(transitions, cursor)
+        if queued:
+            logger.info(f"✓ Đưa {len(transitions)} chuyển mức vào outbox webhook ({queued} lượt gửi)")
+        return len(transitions) == self.fanout_batch
+    
+    def _session(self) -> requests.Session:
+        # Mỗi thread gửi một Session để giữ kết nối keep-alive giữa các lô
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers['User-Agent'] = "mekong-water-webhooks/1.0"
+            self._sessions.session = session
+        return session
+    
+    def _deliver(self, subscription: Dict, rows: List[tuple]) -> Optional[str]:
+        """POST một lô; trả None nếu bên nhận trả 2xx, ngược lại là mô tả lỗi"""
+        delivery_id = f"{subscription['id']}-{rows[0][0]}-{rows[-1][0]}"
+        body = json.dumps({
+            "event": "alert.transitions",
+            "subscription_id": subscription['id'],
+            "delivery_id": delivery_id,
+            "sent_at": datetime.now(self.store.timezone).isoformat(),
+            "transitions": [json.loads(payload) for _, _, payload in rows]
+        }, ensure_ascii=False).encode('utf-8')
+        
+        headers = {"Content-Type": "application/json", DELIVERY_HEADER: delivery_id}
+        if subscription['secret']:
+            headers[SIGNATURE_HEADER] = sign(subscription['secret'], body)
+        
+        try:
+            response = self._session().post(subscription['url'], data=body, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            return f"{type(e).__name__}: {str(e)}"
+        if 200 <= response.status_code < 300:
+            return None
+        return f"HTTP {response.status_code}: {response.text[:200]}"
+    
+    def _record(self, subscription: Dict, rows: List[tuple], error: Optional[str]):
+        outbox_ids = [row[0] for row in rows]
+        if error is None:
+            self.store.mark_delivered(outbox_ids)
+            WEBHOOK_DELIVERIES.inc("delivered")
+            logger.info(f"✓ Đã gửi {len(rows)} chuyển mức tới webhook {subscription['id']}")
+            return
+        
+        attempts = max(row[1] for row in rows) + 1
+        next_attempt_at = int((time.time() + backoff_seconds(attempts, self.backoff_base, self.backoff_max)) * 1000)
+        dead = self.store.mark_failed(outbox_ids, error, next_attempt_at, self.max_attempts)
+        WEBHOOK_DELIVERIES.inc("dead" if dead else "retry")
+        if dead:
+            logger.error(
+                f"✗ Bỏ {dead} chuyển mức của webhook {subscription['id']} sau {attempts} lần thử: {error}"
+            )
+        else:
+            logger.warning(
+                f"✗ Gửi webhook {subscription['id']} thất bại (lần {attempts}/{self.max_attempts}), "
+                f"thử lại sau {(next_attempt_at / 1000 - time.time()):.0f} giây: {error}"
+            )
+
+
+def make_sink(host: str, port: int, secret: Optional[str] = None, fail_rate: float = 0.0,
+              fail_first: int = 0) -> ThreadingHTTPServer:
+    """
+    Tạo HTTP sink (chưa chạy serve_forever) để thử webhook: kiểm tra chữ ký nếu có secret,
+    trả 503 cho fail_first request đầu tiên và ngẫu nhiên với xác suất fail_rate
+    
+    server.received giữ seq của mọi chuyển mức đã nhận (theo thứ tự, kể cả trùng),
+    server.requests đếm mọi request POST; port 0 để hệ điều hành chọn port trống
+    """
+    seen = set()
+    seen_lock = threading.Lock()
+    
+    class SinkHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            with seen_lock:
+                self.server.requests += 1
+                fail = self.server.requests <= fail_first
+            if secret and not hmac.compare_digest(self.headers.get(SIGNATURE_HEADER, ""), sign(secret, body)):
+                logger.warning("✗ Chữ ký không hợp lệ, trả 401")
+                self.send_response(401)
+                self.end_headers()
+                return
+            if fail or random.random() < fail_rate:
+                logger.info(f"Giả lập lỗi cho lô {self.headers.get(DELIVERY_HEADER)}, trả 503")
+                self.send_response(503)
+                self.end_headers()
+                return
+            
+            transitions = json.loads(body)['transitions']
+            with seen_lock:
+                duplicates = sum(1 for transition in transitions if transition['seq'] in seen)
+                seen.update(transition['seq'] for transition in transitions)
+                self.server.received.extend(transition['seq'] for transition in transitions)
+            logger.info(
+                f"✓ Lô {self.headers.get(DELIVERY_HEADER)}: {len(transitions)} chuyển mức "
+                f"(seq {transitions[0]['seq']}..{transitions[-1]['seq']}, {duplicates} trùng)"
+            )
+            for transition in transitions:
+                logger.info(
+                    f"  → {transition['station_name']}: {transition['from_level']} → "
+                    f"{transition['to_level']} ({transition['water_level']}m, {transition['observed_at']})"
+                )
+            self.send_response(204)
+            self.end_headers()
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer((host, port), SinkHandler)
+    server.received = []
+    server.requests = 0
+    return server
+
+
+def run_sink(host: str, port: int, secret: Optional[str] = None, fail_rate: float = 0.0):
+    """
+    HTTP sink để thử webhook trên máy local: in mỗi lô nhận được, kiểm tra chữ ký nếu có
+    secret, trả 503 ngẫu nhiên với xác suất fail_rate để thử cơ chế thử lại
+    """
+    server = make_sink(host, port, secret, fail_rate)
+    logger.info(f"Webhook sink tại http://{host}:{port}/ (fail rate {fail_rate:g}), nhấn Ctrl+C để dừng")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def _test_transitions(tracker: AlertTracker, level: str, observed_ms: int):
+    """Ghi chuyển mức cho hai trạm đầu tiên trong config qua AlertTracker.apply"""
+    observed_at = datetime.fromtimestamp(observed_ms / 1000, tracker.timezone).isoformat()
+    tracker.apply({
+        station_id: {
+            "station_name": station["name"],
+            "current": {"water_level": 5.0, "timestamp": observed_at},
+            "alert": {"level": level}
+        }
+        for station_id, station in list(config.STATIONS.items())[:2]
+    })
+
+
+def test_webhooks():
+    """
+    Hàm test webhook end-to-end với HTTP sink trên port ngẫu nhiên: thử lại có backoff khi bên
+    nhận trả lỗi, chữ ký HMAC, và giao ít nhất một lần khi dispatcher khởi động lại
+    """
+    import tempfile
+    
+    print("="*60)
+    print("TESTING WEBHOOK DISPATCHER")
+    print("="*60)
+    
+    secret = "s3cret"
+    backoff_base = 0.2
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tracker = AlertTracker(db_path=str(Path(tmp_dir) / "alerts.db"), min_hold_minutes=0)
+        store_path = str(Path(tmp_dir) / "webhooks.db")
+        store = WebhookStore(store_path)
+        sink = make_sink("127.0.0.1", 0, secret=secret, fail_first=2)
+        threading.Thread(target=sink.serve_forever, name="webhook-sink", daemon=True).start()
+        url = f"http://127.0.0.1:{sink.server_address[1]}/hook"
+        subscription = store.add_subscription(url, secret, ["WARNING", "CRITICAL"])
+        
+        def make_dispatcher(webhook_store: WebhookStore) -> WebhookDispatcher:
+            dispatcher = WebhookDispatcher(tracker, webhook_store)
+            dispatcher.backoff_base, dispatcher.backoff_max = backoff_base, 10 * backoff_base
+            dispatcher.poll_interval = 0.05
+            return dispatcher
+        
+        def outbox() -> List[tuple]:
+            return store._connection().execute(
+                "SELECT seq, attempts, next_attempt_at FROM webhook_outbox ORDER BY id"
+            ).fetchall()
+        
+        try:
+            dispatcher = make_dispatcher(store)
+            dispatcher.fan_out()
+            observed_ms = int(time.time() * 1000)
+            _test_transitions(tracker, "WARNING", observed_ms)
+            
+            # Bên nhận trả 503 hai lần: mỗi lần thử lại chờ base * 2^(n-1) giây (jitter 0.5-1)
+            for attempt in (1, 2):
+                failed_at = time.time()
+                dispatcher.run_once()
+                rows = outbox()
+                assert [row[1] for row in rows] == [attempt] * 2, rows
+                delay = rows[0][2] / 1000 - failed_at
+                expected = backoff_base * 2 ** (attempt - 1)
+                assert 0.5 * expected - 0.05 <= delay <= expected + 0.05, (attempt, delay)
+                requests_before = sink.requests
+                dispatcher.run_once()
+                assert sink.requests == requests_before, "lô chưa đến hạn đã bị gửi lại"
+                time.sleep(max(rows[0][2] / 1000 - time.time(), 0) + 0.01)
+            
+            dispatcher.run_once()
+            assert outbox() == [] and sorted(sink.received) == [1, 2], (outbox(), sink.received)
+            print(f"✓ Thử lại với backoff sau 2 lần HTTP 503, lô được gửi ở lần thứ 3 ({sink.requests} request)")
+            
+            # Sink chỉ nhận (204) khi X-Mekong-Signature khớp secret
+            body = b'{"transitions": []}'
+            response = requests.post(url, data=body, headers={SIGNATURE_HEADER: sign("wrong", body)}, timeout=5)
+            assert response.status_code == 401, response.status_code
+            print(f"✓ Chữ ký HMAC {SIGNATURE_HEADER} được kiểm tra (sai secret → HTTP 401)")
+            
+            # Dispatcher dừng sau khi bên nhận đã nhận lô nhưng trước khi đánh dấu đã gửi:
+            # process mới (store mới trên cùng file) gửi lại lô còn trong outbox
+            _test_transitions(tracker, "CRITICAL", observed_ms + 60_000)
+            dispatcher.fan_out()
+            batches = store.due_batches(dispatcher.batch_size)
+            dispatcher._deliver(subscription, batches[0][1])
+            
+            restarted = make_dispatcher(WebhookStore(store_path))
+            restarted.start()
+            try:
+                deadline = time.time() + 10
+                while outbox() and time.time() < deadline:
+                    time.sleep(0.05)
+            finally:
+                restarted.stop()
+            assert outbox() == [], outbox()
+            assert sorted(set(sink.received)) == [1, 2, 3, 4], sink.received
+            assert sink.received.count(3) == 2 and sink.received.count(4) == 2, sink.received
+            print("✓ Giao ít nhất một lần qua lần khởi động lại: lô chưa xác nhận được gửi lại "
+                  "(bên nhận loại trùng theo seq)")
+        finally:
+            sink.shutdown()
+            sink.server_close()
+
+
+def main():
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Quản lý webhook chuyển mức cảnh báo")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    sink_parser = subparsers.add_parser("sink", help="Chạy HTTP sink local nhận webhook")
+    sink_parser.add_argument('--host', default="127.0.0.1")
+    sink_parser.add_argument('--port', type=int, default=8765)
+    sink_parser.add_argument('--secret', help='Kiểm tra chữ ký bằng secret này')
+    sink_parser.add_argument('--fail-rate', type=float, default=0.0, help='Tỉ lệ request trả 503 (0-1)')
+    
+    add_parser = subparsers.add_parser("add", help="Đăng ký URL nhận chuyển mức")
+    add_parser.add_argument('url')
+    add_parser.add_argument('--levels', help='Danh sách mức, cách nhau bởi dấu phẩy (mặc định: WARNING,CRITICAL)')
+    add_parser.add_argument('--stations', help='Danh sách station_id, cách nhau bởi dấu phẩy (mặc định: tất cả)')
+    add_parser.add_argument('--secret', help='Secret ký HMAC-SHA256 body')
+    
+    subparsers.add_parser("list", help="Liệt kê subscription và outbox")
+    
+    remove_parser = subparsers.add_parser("remove", help="Xóa subscription")
+    remove_parser.add_argument('subscription_id')
+    
+    subparsers.add_parser("test", help="Kiểm tra thử lại, chữ ký và giao lại sau khởi động lại với sink local")
+    args = parser.parse_args()
+    
+    if args.command == "sink":
+        run_sink(args.host, args.port, args.secret, args.fail_rate)
+        return
+    if args.command == "test":
+        test_webhooks()
+        return
+    
+    store = WebhookStore()
+    if args.command == "add":
+        levels = args.levels.split(",") if args.levels else None
+        station_ids = args.stations.split(",") if args.stations else None
+        error = validate_subscription(args.url, levels, station_ids)
+        if error:
+            logger.error(f"✗ {error}")
+            sys.exit(1)
+        subscription = store.add_subscription(args.url, args.secret, levels, station_ids)
+        logger.info(f"✓ Đã đăng ký webhook {subscription['id']} → {subscription['url']}")
+    elif args.command == "remove":
+        if not store.remove_subscription(args.subscription_id):
+            logger.error(f"✗ Không tìm thấy webhook {args.subscription_id}")
+            sys.exit(1)
+        logger.info(f"✓ Đã xóa webhook {args.subscription_id}")
+    else:
+        print(json.dumps(store.status(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()